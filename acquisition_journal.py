@@ -0,0 +1,231 @@
+import json
+import os
+import time
+import typing
+from datetime import datetime
+
+import numpy as np
+
+from acquisition_pipeline import AcquisitionPipeline, PipelineStage, TileWriter
+
+JOURNAL_VERSION = 1
+JOURNAL_FILE_NAME = "journal.jsonl"
+# the journal is synced on disk every SYNC_EVERY tiles or SYNC_PERIOD seconds, whichever comes first
+SYNC_EVERY = 64
+SYNC_PERIOD = 2.
+
+
+def to_json(value):
+    """
+    json.dumps default: numpy scalars and arrays of the grids are written as plain numbers and lists.
+    """
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+class AcquisitionJournal:
+    def __init__(self, path: str, plan: typing.Dict, sync_every: int = SYNC_EVERY, sync_period: float = SYNC_PERIOD):
+        """
+        Append-only journal of an acquisition run (one JSON record per line): the plan of the run first, then one
+        record per tile written on disk, then an end record. After a crash of the application or of the serial link,
+        the run is resumed from the journal at the first tiles which were not written, without imaging the finished
+        ones again.
+        Each record is written to the OS at once (a crash of the application loses nothing), but the costly fsync is
+        only done every sync_every tiles or sync_period seconds, so only the last few tiles may be imaged again after a
+        power failure. A line cut by a crash is dropped when the journal is opened again.
+        Use AcquisitionJournal.create or AcquisitionJournal.open.
+        :param path: path of the journal file.
+        :param plan: plan record of the run.
+        """
+        self.path = path
+        self.plan = plan
+        self.sync_every = sync_every
+        self.sync_period = sync_period
+
+        self.grids = [np.asarray(grid) for grid in plan["grids"]]
+        # completed[g][i]: the tile i of the grid g is written on disk
+        self.completed = [np.zeros(len(grid), dtype=bool) for grid in self.grids]
+        self.tiles = {}
+        self.finished = False
+
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    @classmethod
+    def create(cls, path: str, grids: typing.Sequence, objective=None, metadata: typing.Union[None, typing.Dict] = None,
+               **kwargs) -> "AcquisitionJournal":
+        """
+        Start the journal of a new run (an existing journal at path is replaced).
+        :param grids: positions of the tiles of each grid in acquisition order.
+        :param objective: ObjectiveProfile of the run (its field of view and overlap are recorded).
+        :param metadata: other information about the run (slides, user, settings...).
+        """
+        plan = {"type": "plan", "version": JOURNAL_VERSION, "created": datetime.now().isoformat(),
+                "grids": [np.asarray(grid) for grid in grids], "metadata": metadata or {}}
+        if objective is not None:
+            plan["objective"] = {"name": objective.name, "pixel_scale": objective.pixel_scale,
+                                 "sensor_size": objective.sensor_size, "overlap": objective.overlap,
+                                 "overlap_percentage": objective.overlap_percentage}
+        journal = cls(path, plan, **kwargs)
+        journal._file = open(path, "w")
+        journal._append(plan)
+        journal.sync()
+        return journal
+
+    @classmethod
+    def open(cls, path: str, **kwargs) -> "AcquisitionJournal":
+        """
+        Load the journal of a previous run to resume it, new tiles are appended to it.
+        """
+        with open(path, "rb") as file:
+            content = file.read()
+        # a crash may leave the last record incomplete: it is ignored and overwritten
+        valid_size = content.rfind(b"\n") + 1
+        lines = content[:valid_size].decode("utf-8").splitlines()
+        if not lines:
+            raise ValueError("The journal {} has no plan".format(path))
+        plan = json.loads(lines[0])
+        if plan.get("type") != "plan":
+            raise ValueError("The journal {} does not start with the plan of the run".format(path))
+
+        journal = cls(path, plan, **kwargs)
+        for line in lines[1:]:
+            record = json.loads(line)
+            if record["type"] == "tile":
+                journal.completed[record["grid"]][record["index"]] = True
+                journal.tiles[(record["grid"], record["index"])] = record
+            elif record["type"] == "end":
+                journal.finished = True
+
+        journal._file = open(path, "r+")
+        journal._file.truncate(valid_size)
+        journal._file.seek(valid_size)
+        return journal
+
+    @classmethod
+    def open_or_create(cls, path: str, grids: typing.Sequence, objective=None,
+                       metadata: typing.Union[None, typing.Dict] = None, **kwargs) -> "AcquisitionJournal":
+        """
+        Resume the unfinished run journaled at path (its plan is kept, grids is then ignored), or start a new one.
+        """
+        if os.path.exists(path):
+            journal = cls.open(path, **kwargs)
+            if not journal.finished:
+                return journal
+            journal.close()
+        return cls.create(path, grids, objective=objective, metadata=metadata, **kwargs)
+
+    @property
+    def nb_tiles(self) -> int:
+        return sum(len(grid) for grid in self.grids)
+
+    @property
+    def nb_completed(self) -> int:
+        return int(sum(completed.sum() for completed in self.completed))
+
+    def get_remaining(self, grid_index: int) -> np.ndarray:
+        """
+        :return: indices of the tiles of a grid which are not written yet, in acquisition order.
+        """
+        return np.flatnonzero(~self.completed[grid_index])
+
+    def record_tile(self, grid_index: int, index: int, file_name: str, position: typing.Sequence) -> None:
+        """
+        :param file_name: file of the tile.
+        :param position: actual position of the stage when the frame was taken.
+        """
+        record = {"type": "tile", "grid": grid_index, "index": index, "file": file_name, "position": list(position),
+                  "time": time.time()}
+        self._append(record)
+        self.completed[grid_index][index] = True
+        self.tiles[(grid_index, index)] = record
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_period:
+            self.sync()
+
+    def finish(self, metadata: typing.Union[None, typing.Dict] = None) -> None:
+        """
+        Close the run: a finished journal is not resumed.
+        """
+        self._append({"type": "end", "time": time.time(), "completed": self.nb_completed, "metadata": metadata or {}})
+        self.finished = True
+        self.sync()
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if self._file is not None and not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def _append(self, record: typing.Dict) -> None:
+        self._file.write(json.dumps(record, default=to_json, separators=(",", ":")) + "\n")
+        # in the OS buffers at once: only fsync is batched
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def acquire_journaled(journal: AcquisitionJournal, output_folder: str,
+                      acquire: typing.Union[None, typing.Callable[[int, typing.Any], typing.Any]] = None,
+                      scan: typing.Union[None, typing.Callable[[np.ndarray, np.ndarray], typing.Iterable]] = None,
+                      image_extension: str = ".png", encoders: int = 1,
+                      on_grid: typing.Union[None, typing.Callable[[int], None]] = None,
+                      locate: typing.Union[None, typing.Callable[[], typing.Any]] = None) -> bool:
+    """
+    Acquire the tiles of the journal which are not written yet, grid after grid, with an AcquisitionPipeline: the
+    tiles of the grid g are written in output_folder/grid_g, then journaled. The journal is finished once every grid
+    is acquired.
+    :param acquire: function (index, position) -> frame moving to a tile and taking its frame (stop and shoot).
+    :param scan: function (grid, indices) -> iterator over the Tiles of these indices (fly scanning), used instead of
+                 acquire if given.
+    :param encoders: number of encoding threads.
+    :param on_grid: function called with the index of each grid before its acquisition.
+    :param locate: function () -> position of the stage read back from the controller after each stop and shoot
+                   acquisition (see AcquisitionPipeline). The journal records the measured position of each tile: the
+                   interpolated one when fly scanning, the one read back by locate otherwise, and the planned position
+                   only when there is no locate.
+    :return: True if the run is finished, False if a grid failed (the journal can be resumed).
+    """
+    if journal.finished:
+        return True
+    for grid_index, grid in enumerate(journal.grids):
+        remaining = journal.get_remaining(grid_index)
+        if len(remaining) == 0:
+            continue
+        if on_grid is not None:
+            on_grid(grid_index)
+        writer = TileWriter(folder=os.path.join(output_folder, "grid_{}".format(grid_index)), extension=image_extension)
+        # the tile is journaled once its file is written
+        journal_stage = PipelineStage(name="journal", function=lambda tile, g=grid_index, w=writer: journal.record_tile(
+            g, tile.index, os.path.basename(w.get_path(tile)), tile.measured_position or tile.position))
+        pipeline = AcquisitionPipeline(acquire=acquire, stages=writer.get_stages(encoders=encoders) + [journal_stage],
+                                       locate=locate)
+        try:
+            if scan is not None:
+                pipeline.start_from(scan(grid, remaining))
+                pipeline.join()
+            else:
+                pipeline.run(grid, indices=remaining)
+            for statistics in pipeline.statistics:
+                print(statistics)
+        except Exception as error:
+            print("The acquisition of the grid {} failed: {}".format(grid_index, error))
+            journal.sync()
+            return False
+    journal.finish()
+    return True
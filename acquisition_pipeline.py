@@ -0,0 +1,299 @@
+import os
+import queue
+import threading
+import time
+import typing
+
+import cv2
+import numpy as np
+
+# maximum number of tiles waiting between two stages: a slow stage blocks the previous one instead of piling frames up
+DEFAULT_QUEUE_SIZE = 4
+# end of the stream of tiles, sent once per worker of a stage
+_END = object()
+
+
+class Tile:
+    __slots__ = ("index", "position", "frame", "data", "acquisition_time", "measured_position")
+
+    def __init__(self, index: int, position, frame=None):
+        """
+        Tile going through the acquisition pipeline.
+        :param index: index of the tile in the grid.
+        :param position: (x, y) or (x, y, z) position of the stage.
+        :param frame: image of the camera.
+        """
+        self.index = index
+        self.position = position
+        self.frame = frame
+        # output of the intermediate stages (encoded image...)
+        self.data = None
+        self.acquisition_time = None
+        # position of the stage when the frame was taken, if it differs from the tile position (fly scanning)
+        self.measured_position = None
+
+
+class StageStatistics:
+    def __init__(self, name: str):
+        """
+        Activity of a stage: time spent working, and time blocked waiting for the next stage (back-pressure).
+        """
+        self.name = name
+        self.count = 0
+        self.busy_time = 0.
+        self.blocked_time = 0.
+
+    @property
+    def mean_time(self) -> float:
+        """
+        Mean working time per tile (in s): the tile rate of the pipeline is set by the slowest stage.
+        """
+        return self.busy_time / self.count if self.count else 0.
+
+    def __repr__(self):
+        return "{name}: {count} tiles, {mean:.1f} ms/tile, blocked {blocked:.2f} s".format(
+            name=self.name, count=self.count, mean=self.mean_time * 1e3, blocked=self.blocked_time)
+
+
+class PipelineStage:
+    def __init__(self, name: str, function: typing.Callable[[Tile], None], workers: int = 1,
+                 queue_size: int = DEFAULT_QUEUE_SIZE):
+        """
+        :param name: name of the stage in the statistics.
+        :param function: processing of one tile (it can fill tile.data for the next stage).
+        :param workers: number of threads running the stage (tiles may then be processed out of order).
+        :param queue_size: maximum number of tiles waiting for this stage.
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue_size = queue_size
+
+
+class AcquisitionPipeline:
+    def __init__(self, acquire: typing.Union[None, typing.Callable[[int, typing.Any], typing.Any]],
+                 stages: typing.Sequence[PipelineStage],
+                 locate: typing.Union[None, typing.Callable[[], typing.Any]] = None):
+        """
+        Staged acquisition of a grid: the acquisition stage moves the stage to a tile and takes its frame, then moves
+        on to the next tile while the next stages (encoding, writing on disk...) process the frame in background
+        threads. The stages are linked by bounded queues, so the tile rate is set by the slowest stage instead of the
+        sum of all of them, and a slow stage stops the motion instead of filling the memory.
+        :param acquire: function (index, position) -> frame, moving to the position and capturing the frame (blocking).
+                        It can be None if the tiles are given by start_from.
+        :param stages: stages processing the acquired tiles, in order.
+        :param locate: function () -> position of the stage read back from the controller, called after each
+                       acquire to fill tile.measured_position (None: the tiles only have their planned position).
+        An error of the acquisition stops the feeding of the pipeline, but the tiles already acquired still go through
+        the next stages (they are written); an error of another stage drops them (see stop).
+        """
+        self.acquire = acquire
+        self.locate = locate
+        self.stages = list(stages)
+        self.statistics = [StageStatistics("acquisition")] + [StageStatistics(stage.name) for stage in self.stages]
+
+        self._stop = threading.Event()
+        self._errors = []
+        self._threads = []
+        self._queues = []
+        self._finished_workers = []
+        self._stats_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self, positions: typing.Sequence, indices: typing.Union[None, typing.Sequence[int]] = None) -> None:
+        """
+        Start the acquisition of the positions in background threads (see join).
+        :param indices: indices of the positions to acquire (all by default), to resume an interrupted run.
+        """
+        self.start_from(self._acquire_tiles(positions, indices))
+
+    def start_from(self, tiles: typing.Iterable[Tile]) -> None:
+        """
+        Start the pipeline on tiles acquired by another source (fly scanning...): the iteration over tiles is the
+        acquisition stage, it runs in its own thread and is blocked while the next stage is full.
+        """
+        self._stop.clear()
+        self._errors = []
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        self._finished_workers = [0] * len(self.stages)
+        self._threads = [threading.Thread(target=self._feed, args=(tiles,), name="acquisition",
+                                          daemon=True)]
+        for number, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self._threads.append(threading.Thread(target=self._run_stage, args=(number,), name=stage.name,
+                                                      daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def join(self, timeout: typing.Union[None, float] = None) -> None:
+        """
+        Wait for the end of the acquisition, and raise the first error of a stage if any.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0., deadline - time.monotonic()))
+        if self._errors:
+            raise self._errors[0]
+
+    def run(self, positions: typing.Sequence,
+            indices: typing.Union[None, typing.Sequence[int]] = None) -> typing.List[StageStatistics]:
+        """
+        Blocking acquisition of the positions (see start).
+        :return: statistics of each stage.
+        """
+        self.start(positions, indices)
+        self.join()
+        return self.statistics
+
+    def stop(self) -> None:
+        """
+        Abort the acquisition: no new tile is acquired, the tiles already in the pipeline are dropped.
+        """
+        self._stop.set()
+
+    def _put(self, number: int, item, statistics: StageStatistics) -> bool:
+        """
+        Give an item to the stage number, waiting while its queue is full.
+        :return: False if the pipeline was stopped meanwhile.
+        """
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queues[number].put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        with self._stats_lock:
+            statistics.blocked_time += time.perf_counter() - start
+        return not self._stop.is_set()
+
+    def _end_stage(self, number: int) -> None:
+        if number < len(self.stages):
+            for _ in range(self.stages[number].workers):
+                self._put(number, _END, self.statistics[number])
+
+    def _fail(self, error: BaseException, drain: bool = False) -> None:
+        """
+        :param drain: only stop feeding the pipeline, the tiles already in the queues are processed.
+        """
+        self._errors.append(error)
+        if not drain:
+            self._stop.set()
+
+    def _acquire_tiles(self, positions: typing.Sequence,
+                       indices: typing.Union[None, typing.Sequence[int]]) -> typing.Iterator[Tile]:
+        for index in range(len(positions)) if indices is None else indices:
+            position = positions[index]
+            tile = Tile(index=int(index), position=position)
+            tile.frame = self.acquire(index, position)
+            tile.acquisition_time = time.time()
+            if self.locate is not None:
+                tile.measured_position = self.locate()
+            yield tile
+
+    def _feed(self, tiles: typing.Iterable[Tile]) -> None:
+        statistics = self.statistics[0]
+        try:
+            tiles = iter(tiles)
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                tile = next(tiles, None)
+                if tile is None:
+                    break
+                with self._stats_lock:
+                    statistics.count += 1
+                    statistics.busy_time += time.perf_counter() - start
+                if self.stages and not self._put(0, tile, statistics):
+                    break
+        except Exception as error:
+            # the tiles acquired before the error are still written
+            self._fail(error, drain=True)
+        finally:
+            self._end_stage(0)
+
+    def _run_stage(self, number: int) -> None:
+        stage = self.stages[number]
+        statistics = self.statistics[number + 1]
+        while True:
+            try:
+                tile = self._queues[number].get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                continue
+            if tile is _END:
+                break
+            if self._stop.is_set():
+                continue
+            start = time.perf_counter()
+            try:
+                stage.function(tile)
+            except Exception as error:
+                self._fail(error)
+                continue
+            with self._stats_lock:
+                statistics.count += 1
+                statistics.busy_time += time.perf_counter() - start
+            if number + 1 < len(self.stages):
+                self._put(number + 1, tile, statistics)
+        # the last worker of the stage ends the next one
+        with self._stats_lock:
+            self._finished_workers[number] += 1
+            last_worker = self._finished_workers[number] == stage.workers
+        if last_worker:
+            self._end_stage(number + 1)
+
+
+class TileWriter:
+    def __init__(self, folder: str, extension: str = ".png", params: typing.Union[None, typing.List[int]] = None):
+        """
+        Encoding and writing of the tiles, split in two pipeline stages: the encoding is CPU bound, the writing I/O
+        bound.
+        :param folder: output folder, the tiles are named index_x_y(_z) + extension.
+        :param extension: image format given to cv2.imencode (".png", ".jpg", ".tif"...).
+        :param params: parameters of the encoder ([cv2.IMWRITE_JPEG_QUALITY, 95]...).
+        """
+        self.folder = folder
+        self.extension = extension
+        self.params = [] if params is None else params
+        os.makedirs(folder, exist_ok=True)
+        self._positions_lock = threading.Lock()
+
+    @property
+    def positions_path(self) -> str:
+        """
+        CSV file of the measured position of each tile (fly scanning, or read back from the controller): file name,
+        then the coordinates.
+        """
+        return os.path.join(self.folder, "measured_positions.csv")
+
+    def get_path(self, tile: Tile) -> str:
+        name = "_".join([str(tile.index).zfill(6)] + [str(int(value)) for value in tile.position])
+        return os.path.join(self.folder, name + self.extension)
+
+    def encode(self, tile: Tile) -> None:
+        success, buffer = cv2.imencode(self.extension, np.ascontiguousarray(tile.frame), self.params)
+        if not success:
+            raise IOError("The tile {} could not be encoded in {}".format(tile.index, self.extension))
+        tile.data = buffer
+        # the raw frame is not needed anymore
+        tile.frame = None
+
+    def write(self, tile: Tile) -> None:
+        with open(self.get_path(tile), "wb") as file:
+            file.write(tile.data.tobytes())
+        tile.data = None
+        if tile.measured_position is not None:
+            with self._positions_lock, open(self.positions_path, "a") as file:
+                file.write(",".join([os.path.basename(self.get_path(tile))] +
+                                    ["{:.1f}".format(value) for value in tile.measured_position]) + "\n")
+
+    def get_stages(self, encoders: int = 1, queue_size: int = DEFAULT_QUEUE_SIZE) -> typing.List[PipelineStage]:
+        """
+        :param encoders: number of encoding threads (cv2 releases the GIL while encoding).
+        """
+        return [PipelineStage(name="encoding", function=self.encode, workers=encoders, queue_size=queue_size),
+                PipelineStage(name="writing", function=self.write, queue_size=queue_size)]
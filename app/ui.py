@@ -793,7 +793,7 @@ class Window(QWidget):
         self._y = None
         self._z = None
 
-        self.prior = PriorController(port="COM15", baudrate=9600, timeout=0.05)
+        self.prior = PriorController(port="COM15", baudrate=9600, timeout=0.05, target_baudrate=115200)
 
         layout = QVBoxLayout()
         control_layout = QHBoxLayout()
@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import sys
+import typing
+
+from main import PriorController, Success, Error
+from prior_protocol import Position
+
+
+class AsyncZAxis:
+    def __init__(self, stage):
+        self.stage = stage
+
+    async def position(self) -> typing.Union[int, None]:
+        answer = await self.stage.query("PZ")
+        try:
+            return int(answer)
+        except ValueError:
+            Error(feature=sys._getframe().f_code.co_name, response=answer)
+
+    async def move_to(self, z: int) -> bool:
+        return await self.stage.move("V, {z}".format(z=z), feature=sys._getframe().f_code.co_name, axis=2, value=z)
+
+    async def move_relative(self, value: int) -> bool:
+        if value <= 0:
+            cmd = "D, {z}".format(z=abs(value))
+        else:
+            cmd = "U, {z}".format(z=value)
+        return await self.stage.move(cmd, feature=sys._getframe().f_code.co_name, axis=2, value=value)
+
+    async def speed(self) -> int:
+        z_controller = self.stage.prior.z_controller
+        if z_controller._speed is None:
+            z_controller._speed = int(await self.stage.query("SMZ"))
+        return z_controller._speed
+
+    async def set_speed(self, value: int) -> bool:
+        assert 4 <= value <= 100, "Speed value should to be in range [4 - 100]"
+        success = await self.stage.setting("SMZ, {z}".format(z=value), feature="speed", axis=2, value=value)
+        self.stage.prior.z_controller._speed = value if success else None
+        return success
+
+    async def acceleration(self) -> int:
+        z_controller = self.stage.prior.z_controller
+        if z_controller._acceleration is None:
+            z_controller._acceleration = int(await self.stage.query("SAZ"))
+        return z_controller._acceleration
+
+    async def set_acceleration(self, value: int) -> bool:
+        assert 4 <= value <= 100, "Acceleration value should to be in range [4 - 100]"
+        success = await self.stage.setting("SAZ, {z}".format(z=value), feature="acceleration", axis=2, value=value)
+        self.stage.prior.z_controller._acceleration = value if success else None
+        return success
+
+
+class AsyncPriorController:
+    def __init__(self, prior: PriorController):
+        """
+        asyncio counterpart of PriorController. The commands go through the I/O engine of the controller and their
+        answers are awaited, so the event loop keeps running while the stage moves (camera readout, disk writes...).
+        Usage:
+            stage = await AsyncPriorController.open(port="COM15")
+            await stage.move_to(1000, 2000, 300)
+            x, y, z = await stage.position()
+            await stage.z.move_relative(-50)
+        :param prior: connected PriorController. Its serial port is given to its I/O engine.
+        """
+        self.prior = prior
+        self.engine = prior.start_engine()
+        self.z = AsyncZAxis(stage=self)
+
+    @classmethod
+    async def open(cls, port: str, baudrate: int = 9600, timeout: float = 0.1):
+        """
+        Open the controller without blocking the event loop (the initialization of PriorController writes and reads
+        several settings).
+        """
+        loop = asyncio.get_running_loop()
+        prior = await loop.run_in_executor(None, functools.partial(PriorController, port=port, baudrate=baudrate,
+                                                                   timeout=timeout))
+        return cls(prior)
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.prior.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def query(self, cmd: str) -> str:
+        return await asyncio.wrap_future(self.engine.submit(cmd))
+
+    async def move(self, cmd: str, feature, axis, value) -> bool:
+        """
+        Send a movement and wait for its end without blocking the loop.
+        :return: True if the controller answered "R".
+        """
+        answer = await self.query(cmd)
+        self.prior.report_motion(answer=answer, feature=feature, axis=axis, value=value)
+        return answer == "R"
+
+    async def setting(self, cmd: str, feature, value, axis=None) -> bool:
+        answer = await self.query(cmd)
+        if answer == "0":
+            Success(feature=feature, value=value, axis=axis)
+            return True
+        Error(feature=feature, response=answer)
+        return False
+
+    async def position(self) -> typing.Union[None, typing.Tuple[int, ...]]:
+        message = await asyncio.wrap_future(self.engine.submit("P", typed=True))
+        if not isinstance(message, Position):
+            Error(feature=sys._getframe().f_code.co_name, response=message.text)
+            return None
+        return message.coords
+
+    async def x_position(self) -> int:
+        return int(await self.query("PX"))
+
+    async def y_position(self) -> int:
+        return int(await self.query("PY"))
+
+    async def move_to(self, x: int, y: int, z: typing.Union[int, None] = None) -> bool:
+        if z is None:
+            cmd = "G, {x}, {y}".format(x=x, y=y)
+        else:
+            cmd = "G, {x}, {y}, {z}".format(x=x, y=y, z=z)
+        return await self.move(cmd, feature=sys._getframe().f_code.co_name, axis="XY", value=(x, y))
+
+    async def move_relative(self, x: int = 0, y: int = 0) -> bool:
+        cmd = "GR, {x}, {y}".format(x=x, y=y)
+        return await self.move(cmd, feature=sys._getframe().f_code.co_name, axis="XY", value=(x, y))
+
+    async def return2home(self) -> bool:
+        return await self.move("M", feature=sys._getframe().f_code.co_name, axis="ALL", value=None)
+
+    async def busy(self) -> bool:
+        return await self.query("$") not in ("0", "R")
+
+    async def emergency_stop(self) -> None:
+        response = await self.query("K")
+        if response == 'R' or response == '':
+            Success(feature="Emergency stop", value=None)
+        else:
+            Error(feature=sys._getframe().f_code.co_name, response=response)
+
+    # the settings share the cache of the PriorController
+
+    async def speed(self) -> int:
+        if self.prior._speed is None:
+            self.prior._speed = int(await self.query("SMS"))
+        return self.prior._speed
+
+    async def set_speed(self, value: int) -> bool:
+        success = await self.setting("SMS, {speed}".format(speed=value), feature="speed", value=value)
+        self.prior._speed = value if success else None
+        return success
+
+    async def acceleration(self) -> int:
+        if self.prior._acceleration is None:
+            self.prior._acceleration = int(await self.query("SAS"))
+        return self.prior._acceleration
+
+    async def set_acceleration(self, value: int) -> bool:
+        success = await self.setting("SAS, {acceleration}".format(acceleration=value), feature="acceleration",
+                                     value=value)
+        self.prior._acceleration = value if success else None
+        return success
+
+
+async def overlap_moves_demo():
+    async with await AsyncPriorController.open(port="COM15") as stage:
+        # the position is read while the stage moves
+        move = asyncio.ensure_future(stage.move_to(10000, 10000))
+        while not move.done():
+            print(await stage.position())
+            await asyncio.sleep(0.1)
+        await stage.z.move_relative(50)
+        await stage.return2home()
+
+
+if __name__ == "__main__":
+    asyncio.run(overlap_moves_demo())
@@ -1,16 +1,32 @@
+import json
+import os
+import threading
 import time
 import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from serial import Serial
 from serial.tools import list_ports
 
+from main import BAUDRATE_CODES
+
+# file storing the port and the baud rate of the last successful detection
+LAST_PORT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".prior_controller", "last_port.json")
+# baud rates tried first: ProScan II default then the other rates it supports
+PREFERRED_BAUDRATES = [9600, 38400, 19200, 57600, 115200]
+
 
 class PriorSearcher:
-    def __init__(self, baudrate_list: typing.Union[None, typing.List[int]] = None):
+    def __init__(self, baudrate_list: typing.Union[None, typing.List[int]] = None,
+                 cache_path: typing.Union[None, str] = LAST_PORT_CACHE_PATH):
         """
         The aim of this class is to detect right COM PORT and baud rate to communicate with PRIOR ProScan II.
         :param baudrate_list: list of communication speeds tested to communicate with PRIOR.
-                              if this parameter is None -> try all standard baud rates.
+                              if this parameter is None -> try all standard baud rates. The baud rates the
+                              controller can be negotiated to (BAUDRATE_CODES) are always tried afterwards: a session
+                              which was not closed cleanly leaves the controller at its negotiated rate.
+        :param cache_path: JSON file where the last detected port / baud rate are saved and tried first on the next
+                           detection. None to disable the cache.
         """
         # detect available com ports
         self.ports = list_ports.comports()
@@ -19,45 +35,108 @@ class PriorSearcher:
         if self.baudrate_list is None:
             self.baudrate_list = [110, 300, 600, 1200, 2400, 4800, 9600, 14400, 19200, 38400, 57600, 115200]
 
+        self.cache_path = cache_path
+
         self.port, self.baudrate = self.find_prior()
 
+    @property
+    def ordered_baudrates(self) -> typing.List[int]:
+        """
+        Baud rates of baudrate_list, the most likely ones first, then the other baud rates of BAUDRATE_CODES.
+        """
+        preferred = [baudrate for baudrate in PREFERRED_BAUDRATES if baudrate in self.baudrate_list]
+        ordered = preferred + [baudrate for baudrate in self.baudrate_list if baudrate not in preferred]
+        return ordered + [baudrate for baudrate in sorted(BAUDRATE_CODES, reverse=True) if baudrate not in ordered]
+
+    @staticmethod
+    def probe(port: str, baudrate: int, timeout: float = 0.1) -> bool:
+        """
+        Open the port and write "SERIAL": the Prior answers with its serial number (otherwise it returns empty encoded
+        string). One thing remains mysterious: if the com port was tested with one "wrong" baud rate before 9600 (right
+        baud rate to ensure communication with Prior), the device return encoded "R" when the script ask for the serial
+        number on 9600 bauds.
+        :return: True if the Prior answered on this port with this baud rate.
+        """
+        try:
+            serial = Serial(port=port, baudrate=baudrate, timeout=timeout)
+            try:
+                cmd = "SERIAL"
+                serial.write((cmd + "\r").encode())
+                serial_response = serial.readline()
+                serial_number = serial_response.decode(errors="replace").strip()
+                return serial_number.isdigit() or serial_number == "R"
+            finally:
+                serial.close()
+
+        except Exception as e:
+            print(str(e))
+            return False
+
     def find_prior(self) -> [typing.Union[str, None], typing.Union[int, None]]:
         """
-        This function iterates over all COM ports and all baud rates. During these iterations, it tries to communicate
-        with the Prior thanks to Serial communication. When the communication is established, the script
-        launches an initialization writing by UART. The script writes "SERIAL", if the communicating device is the
-        Prior, it has to return the serial number of the device (otherwise it returns empty encoded string). One thing
-        remains mysterious: if the com port was tested with one "wrong" baud rate before 9600 (right baud rate to ensure
-        communication with Prior), the device return encoded "R" when the script ask for the serial number on 9600
-        bauds.
+        The port / baud rate of the last successful detection are tried first. If the Prior does not answer on them,
+        all the COM ports are probed concurrently (one worker per port, each one tries the baud rates from the most
+        likely to the least likely) and the first port which answers is returned.
         :return: port com, baud rate
         - port com : like "COM3" if a right communication was found else None.
         - baud rate : baud rate if a right communication was found else None.
         """
-        for port, _, _ in self.ports:
-            for baudrate in self.baudrate_list:
-                try:
-                    serial = Serial(port=port, baudrate=baudrate)
-                    serial.timeout = 0.1
-                    cmd = "SERIAL"
-
-                    serial.write((cmd + "\r").encode())
-                    serial_response = serial.readline()
-                    serial_number = serial_response.decode().strip()
-
-                    if serial_number.isdigit() or serial_number == "R":
-                        serial.close()
-                        return port, baudrate
+        port_names = [port for port, _, _ in self.ports]
 
-                    serial.close()
-                    del serial
+        cached_port, cached_baudrate = self.load_cache()
+        if cached_port in port_names and cached_baudrate in self.ordered_baudrates:
+            if self.probe(cached_port, cached_baudrate):
+                return cached_port, cached_baudrate
 
-                except Exception as e:
-                    print(str(e))
+        if len(port_names) > 0:
+            found = threading.Event()
+            executor = ThreadPoolExecutor(max_workers=len(port_names))
+            try:
+                futures = [executor.submit(self.search_on_port, port, found) for port in port_names]
+                for future in as_completed(futures):
+                    port, baudrate = future.result()
+                    if port is not None:
+                        found.set()
+                        self.save_cache(port, baudrate)
+                        return port, baudrate
+            finally:
+                # the other workers stop after their current probe, no need to wait for them
+                found.set()
+                executor.shutdown(wait=False)
 
         print("We didn't find any COM PORT which is managing lights.")
         return None, None
 
+    def search_on_port(self, port: str, found: threading.Event) -> [typing.Union[str, None], typing.Union[int, None]]:
+        for baudrate in self.ordered_baudrates:
+            # another worker already found the Prior
+            if found.is_set():
+                break
+            if self.probe(port, baudrate):
+                return port, baudrate
+        return None, None
+
+    def load_cache(self) -> [typing.Union[str, None], typing.Union[int, None]]:
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return None, None
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                cache = json.load(cache_file)
+            return cache["port"], cache["baudrate"]
+        except (OSError, ValueError, KeyError) as e:
+            print(str(e))
+            return None, None
+
+    def save_cache(self, port: str, baudrate: int) -> None:
+        if self.cache_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, "w") as cache_file:
+                json.dump({"port": port, "baudrate": baudrate}, cache_file)
+        except OSError as e:
+            print(str(e))
+
 
 if __name__ == '__main__':
     start = time.time()
@@ -0,0 +1,165 @@
+import threading
+import time
+import typing
+from importlib.metadata import version
+
+import numpy as np
+from ids_peak import ids_peak
+from ids_peak_ipl import ids_peak_ipl
+from packaging.version import parse as parse_version
+
+# resolved once: the buffers are converted by Image_CreateFromSizeAndBuffer before ids_peak 1.6, by
+# ids_peak_ipl_extension since
+LEGACY_IDS_PEAK = parse_version(version('ids_peak')) < parse_version('1.6')
+if not LEGACY_IDS_PEAK:
+    from ids_peak import ids_peak_ipl_extension
+
+FPS_LIMIT = 30
+
+
+class IDSCamera:
+    def __init__(self, fps: float = FPS_LIMIT):
+        """
+        IDS camera without any widget (headless acquisitions): the same setup as IDSCamWindow, but the frames are
+        grabbed by a background thread instead of a QTimer. The last frame is kept as a BGRA numpy array and given to
+        the settle detector if any.
+        :param fps: maximum frame rate of the camera.
+        """
+        self.fps = fps
+        # SettleDetector given the live frames (see camera.settle_detection)
+        self.settle_detector = None
+        self.frame_counter = 0
+
+        self._device = None
+        self._datastream = None
+        self._nodemap_remote_device = None
+        self._condition = threading.Condition()
+        self._frame = None
+        self._frame_time = None
+        self._running = False
+        self._thread = None
+
+        ids_peak.Library.Initialize()
+        self._open_device()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open_device(self) -> None:
+        device_manager = ids_peak.DeviceManager.Instance()
+        device_manager.Update()
+        for device in device_manager.Devices():
+            if device.IsOpenable():
+                self._device = device.OpenDevice(ids_peak.DeviceAccessType_Control)
+                break
+        if self._device is None:
+            raise IOError("No IDS camera could be opened")
+
+        datastreams = self._device.DataStreams()
+        if datastreams.empty():
+            raise IOError("The IDS camera has no DataStream")
+        self._datastream = datastreams[0].OpenDataStream()
+        self._nodemap_remote_device = self._device.RemoteDevice().NodeMaps()[0]
+
+        try:
+            self._nodemap_remote_device.FindNode("UserSetSelector").SetCurrentEntry("Default")
+            self._nodemap_remote_device.FindNode("UserSetLoad").Execute()
+            self._nodemap_remote_device.FindNode("UserSetLoad").WaitUntilDone()
+        except ids_peak.Exception:
+            # Userset is not available
+            pass
+
+        payload_size = self._nodemap_remote_device.FindNode("PayloadSize").Value()
+        for _ in range(self._datastream.NumBuffersAnnouncedMinRequired()):
+            self._datastream.QueueBuffer(self._datastream.AllocAndAnnounceBuffer(payload_size))
+
+    def start(self) -> None:
+        if self._running:
+            return
+        try:
+            max_fps = self._nodemap_remote_device.FindNode("AcquisitionFrameRate").Maximum()
+            self._nodemap_remote_device.FindNode("AcquisitionFrameRate").SetValue(min(max_fps, self.fps))
+        except ids_peak.Exception:
+            print("Unable to limit fps, the AcquisitionFrameRate node is not supported by the camera")
+
+        self._nodemap_remote_device.FindNode("TLParamsLocked").SetValue(1)
+        self._datastream.StartAcquisition()
+        self._nodemap_remote_device.FindNode("AcquisitionStart").Execute()
+        self._nodemap_remote_device.FindNode("AcquisitionStart").WaitUntilDone()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._grab_frames, name="ids camera", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if not self._running:
+            return
+        self._running = False
+        self._datastream.KillWait()
+        self._thread.join()
+        self._nodemap_remote_device.FindNode("AcquisitionStop").Execute()
+        self._datastream.StopAcquisition(ids_peak.AcquisitionStopMode_Default)
+        self._datastream.Flush(ids_peak.DataStreamFlushMode_DiscardAll)
+        self._nodemap_remote_device.FindNode("TLParamsLocked").SetValue(0)
+
+    def close(self) -> None:
+        self.stop()
+        if self._datastream is not None:
+            for buffer in self._datastream.AnnouncedBuffers():
+                self._datastream.RevokeBuffer(buffer)
+            self._datastream = None
+        ids_peak.Library.Close()
+
+    def change_exp_time(self, value: float) -> None:
+        """
+        :param value: exposure time (in ms).
+        """
+        self._nodemap_remote_device.FindNode("ExposureTime").SetValue(value * 1000)
+
+    def change_white_balance(self, value: int) -> None:
+        """
+        :param value: 2 => white balance once, 1 => continuous, 0 => off.
+        """
+        entries = {2: "Once", 1: "Continuous"}
+        self._nodemap_remote_device.FindNode("BalanceWhiteAuto").SetCurrentEntry(entries.get(value, "Off"))
+
+    def _grab_frames(self) -> None:
+        while self._running:
+            try:
+                buffer = self._datastream.WaitForFinishedBuffer(1000)
+            except ids_peak.Exception as e:
+                if self._running:
+                    print("Exception: " + str(e))
+                continue
+            frame_time = time.perf_counter()
+            if LEGACY_IDS_PEAK:
+                ipl_image = ids_peak_ipl.Image_CreateFromSizeAndBuffer(buffer.PixelFormat(), buffer.BasePtr(),
+                                                                       buffer.Size(), buffer.Width(), buffer.Height())
+            else:
+                ipl_image = ids_peak_ipl_extension.BufferToImage(buffer)
+            converted_ipl_image = ipl_image.ConvertTo(ids_peak_ipl.PixelFormatName_BGRa8)
+            self._datastream.QueueBuffer(buffer)
+
+            frame = converted_ipl_image.get_numpy_1D().reshape(converted_ipl_image.Height(),
+                                                               converted_ipl_image.Width(), 4).copy()
+            if self.settle_detector is not None:
+                self.settle_detector.add_frame(frame)
+            with self._condition:
+                self._frame, self._frame_time = frame, frame_time
+                self.frame_counter += 1
+                self._condition.notify_all()
+
+    def get_frame(self, newer_than: typing.Union[None, float] = None, timeout: float = 5.) -> np.ndarray:
+        """
+        :param newer_than: time (time.perf_counter): wait for a frame received after it (taken after a movement...).
+        :return: last (H, W, 4) BGRA frame of the camera.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame is not None and
+                                            (newer_than is None or self._frame_time > newer_than), timeout=timeout):
+                raise TimeoutError("No frame received from the camera")
+            return self._frame
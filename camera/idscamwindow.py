@@ -20,7 +20,9 @@
 # General permission to copy or modify is hereby granted.
 
 import sys
-from importlib.metadata import version
+import threading
+import time
+import typing
 
 import cv2
 import numpy as np
@@ -29,12 +31,12 @@ from PyQt5.QtGui import QImage
 from PyQt5.QtWidgets import QVBoxLayout, QMessageBox, QWidget, QPushButton
 from ids_peak import ids_peak
 from ids_peak_ipl import ids_peak_ipl
-from packaging.version import parse as parse_version
 
 from camera.display import CustomGraphicsScene
+from camera.ids_camera import LEGACY_IDS_PEAK
 from grid.display import Display
 
-if parse_version(version('ids_peak')) > parse_version('1.6'):
+if not LEGACY_IDS_PEAK:
     from ids_peak import ids_peak_ipl_extension
 
 VERSION = "1.2.0"
@@ -71,6 +73,12 @@ class IDSCamWindow(QWidget):
         self.__datastream = None
 
         self.display = None
+        # SettleDetector given the live frames (see camera.settle_detection)
+        self.settle_detector = None
+        # last frame given to the worker threads (see get_frame), they never touch the Qt objects of the window
+        self._frame_condition = threading.Condition()
+        self._frame = None
+        self._frame_time = None
         self.__acquisition_timer = QTimer()
         self.frame_counter = 0
         self.__error_counter = 0
@@ -325,6 +333,19 @@ class IDSCamWindow(QWidget):
     #     """
     #     self.__label_infos.setText("Acquired: " + str(self.frame_counter) + ", Errors: " + str(self.__error_counter))
 
+    def get_frame(self, newer_than: typing.Union[None, float] = None, timeout: float = 5.) -> np.ndarray:
+        """
+        Thread-safe access to the live image, for the workers running out of the GUI thread.
+        :param newer_than: time (time.perf_counter): wait for a frame received after it (taken after a movement...).
+        :return: last (H, W, 4) BGRA frame of the camera.
+        """
+        with self._frame_condition:
+            if not self._frame_condition.wait_for(lambda: self._frame is not None and
+                                                  (newer_than is None or self._frame_time > newer_than),
+                                                  timeout=timeout):
+                raise TimeoutError("No frame received from the camera")
+            return self._frame
+
     def on_acquisition_timer(self):
         """
         This function gets called on every timeout of the acquisition timer
@@ -334,7 +355,7 @@ class IDSCamWindow(QWidget):
             buffer = self.__datastream.WaitForFinishedBuffer(5000)
 
             # Create IDS peak IPL image for debayering and convert it to RGBa8 format
-            if parse_version(version('ids_peak')) < parse_version('1.6'):
+            if LEGACY_IDS_PEAK:
                 # Create IDS peak IPL image for debayering and convert it to RGB8 format
                 ipl_image = ids_peak_ipl.Image_CreateFromSizeAndBuffer(
                     buffer.PixelFormat(),
@@ -351,7 +372,14 @@ class IDSCamWindow(QWidget):
             self.__datastream.QueueBuffer(buffer)
 
             # Get raw image data from converted image and construct a QImage from it
+            frame_time = time.perf_counter()
             image_np_array = converted_ipl_image.get_numpy_1D()
+            frame = image_np_array.reshape(converted_ipl_image.Height(), converted_ipl_image.Width(), 4).copy()
+            if self.settle_detector is not None:
+                self.settle_detector.add_frame(frame)
+            with self._frame_condition:
+                self._frame, self._frame_time = frame, frame_time
+                self._frame_condition.notify_all()
             image = QImage(image_np_array,
                            converted_ipl_image.Width(), converted_ipl_image.Height(),
                            QImage.Format_RGB32)
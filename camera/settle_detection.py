@@ -0,0 +1,194 @@
+import threading
+import time
+import typing
+
+import cv2
+import numpy as np
+
+# side of the central region of the frame compared between two frames (in pixels of the camera)
+SETTLE_ROI_SIZE = 512
+# the region is reduced by this factor before the comparison
+SETTLE_DOWNSAMPLING = 4
+# motion below which the scene is still: shift in pixels of the camera ("phase") or mean absolute difference in gray
+# levels ("difference")
+SETTLE_THRESHOLDS = {"phase": 0.5, "difference": 1.5}
+# number of consecutive still frames needed to declare the scene stable
+SETTLE_STABLE_FRAMES = 2
+# maximum waiting time, the capture is released even if the scene is not still (in s)
+SETTLE_TIMEOUT = 1.
+
+
+def get_settle_roi(frame: np.ndarray, roi_size: int = SETTLE_ROI_SIZE,
+                   downsampling: int = SETTLE_DOWNSAMPLING) -> np.ndarray:
+    """
+    Central region of a frame, reduced by averaging (which also averages out the noise of the sensor) and converted to
+    a float32 gray image. The green channel is used as gray level (no color conversion of the whole frame).
+    :param frame: (H, W) gray or (H, W, 3 / 4) color frame of the camera.
+    """
+    height, width = frame.shape[:2]
+    top, left = max(0, (height - roi_size) // 2), max(0, (width - roi_size) // 2)
+    roi = frame[top:top + roi_size, left:left + roi_size]
+    if roi.ndim == 3:
+        roi = roi[..., 1]
+    roi = roi.astype(np.float32)
+    if downsampling > 1:
+        roi = cv2.resize(roi, (roi.shape[1] // downsampling, roi.shape[0] // downsampling),
+                         interpolation=cv2.INTER_AREA)
+    return roi
+
+
+def get_phase_shift(previous: np.ndarray, current: np.ndarray, window: typing.Union[None, np.ndarray] = None) -> float:
+    """
+    :return: translation between two images found by phase correlation (in pixels of the images).
+    """
+    (shift_x, shift_y), _ = cv2.phaseCorrelate(previous, current, window)
+    return float(np.hypot(shift_x, shift_y))
+
+
+def get_frame_difference(previous: np.ndarray, current: np.ndarray) -> float:
+    """
+    :return: mean absolute difference between two images (in gray levels).
+    """
+    return float(np.mean(np.abs(current - previous)))
+
+
+class SettleDetector:
+    def __init__(self, method: str = "difference", threshold: typing.Union[None, float] = None,
+                 stable_frames: int = SETTLE_STABLE_FRAMES, timeout: float = SETTLE_TIMEOUT,
+                 roi_size: int = SETTLE_ROI_SIZE, downsampling: int = SETTLE_DOWNSAMPLING):
+        """
+        Detect from the live frames of the camera when the stage is still after a movement, so the capture is released
+        as soon as the image is stable instead of after a fixed worst-case delay. Each new frame is compared with the
+        previous one on a reduced central region: the scene is stable after stable_frames consecutive comparisons
+        below the threshold.
+        Usage: arm() at the end of the movement, the camera gives its frames to add_frame, then wait() blocks until the
+        scene is stable (or the callback given to arm is called).
+        :param method: "difference" (mean absolute difference, it also sees the focus changing during Z movements) or
+                       "phase" (shift measured by phase correlation, robust to illumination changes but blind to Z
+                       movements).
+        :param threshold: motion below which two frames are still (see SETTLE_THRESHOLDS for the default).
+        :param stable_frames: number of consecutive still comparisons.
+        :param timeout: maximum waiting time after arm (in s).
+        :param roi_size: side of the compared central region (in pixels of the camera).
+        :param downsampling: reduction factor of the region.
+        """
+        if method not in SETTLE_THRESHOLDS:
+            raise ValueError("Unknown settle detection method {}, expected one of {}".format(
+                method, list(SETTLE_THRESHOLDS)))
+        self.method = method
+        self.threshold = SETTLE_THRESHOLDS[method] if threshold is None else threshold
+        self.stable_frames = stable_frames
+        self.timeout = timeout
+        self.roi_size = roi_size
+        self.downsampling = downsampling
+
+        self._lock = threading.Lock()
+        self._settled = threading.Event()
+        self._armed = False
+        self._previous = None
+        self._still_count = 0
+        self._callback = None
+        self._timer = None
+        self._window = None
+        self._arm_time = None
+        # number of the current arming: a timeout timer of a previous arming must not release the current one
+        self._generation = 0
+
+        # motion measured between the last two frames, and waiting time of the last settling (in s)
+        self.motion = None
+        self.settle_time = None
+        self.timed_out = False
+
+    @property
+    def armed(self) -> bool:
+        return self._armed
+
+    def get_motion(self, previous: np.ndarray, current: np.ndarray) -> float:
+        """
+        :return: motion between two regions, in pixels of the camera for "phase", in gray levels for "difference".
+        """
+        if self.method == "phase":
+            if self._window is None or self._window.shape != current.shape:
+                self._window = cv2.createHanningWindow(current.shape[::-1], cv2.CV_32F)
+            return get_phase_shift(previous, current, self._window) * self.downsampling
+        return get_frame_difference(previous, current)
+
+    def arm(self, callback: typing.Union[None, typing.Callable[[bool], None]] = None) -> None:
+        """
+        Start waiting for a still scene: frames received before this call are ignored.
+        :param callback: function called once with True when the scene is stable, False when the timeout expired. It
+                         is called in the thread giving the frames (or in a timer thread on timeout).
+        """
+        with self._lock:
+            self._cancel_timer()
+            self._settled.clear()
+            self._armed = True
+            self._generation += 1
+            self._previous = None
+            self._still_count = 0
+            self._callback = callback
+            self._arm_time = time.perf_counter()
+            self.timed_out = False
+            if callback is not None and self.timeout is not None:
+                self._timer = threading.Timer(self.timeout, self._release, args=(False, self._generation))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def disarm(self) -> None:
+        with self._lock:
+            self._cancel_timer()
+            self._armed = False
+            self._callback = None
+
+    def add_frame(self, frame: np.ndarray) -> None:
+        """
+        Give a live frame of the camera (called for each frame, it does nothing when the detector is not armed).
+        """
+        if not self._armed:
+            return
+        roi = get_settle_roi(frame, self.roi_size, self.downsampling)
+        with self._lock:
+            if not self._armed:
+                return
+            previous, self._previous = self._previous, roi
+            if previous is None or previous.shape != roi.shape:
+                return
+            self.motion = self.get_motion(previous, roi)
+            self._still_count = self._still_count + 1 if self.motion < self.threshold else 0
+            settled = self._still_count >= self.stable_frames
+            generation = self._generation
+        if settled:
+            self._release(True, generation)
+
+    def wait(self, timeout: typing.Union[None, float] = None) -> bool:
+        """
+        Block until the scene is stable.
+        :param timeout: maximum waiting time (in s), the timeout of the detector by default.
+        :return: True if the scene is stable, False if the timeout expired.
+        """
+        if not self._armed:
+            # already released (or never armed)
+            return self._settled.is_set()
+        settled = self._settled.wait(self.timeout if timeout is None else timeout)
+        if not settled:
+            self._release(False)
+        return settled
+
+    def _release(self, settled: bool, generation: typing.Union[None, int] = None) -> None:
+        with self._lock:
+            if not self._armed or (generation is not None and generation != self._generation):
+                return
+            self._armed = False
+            self._cancel_timer()
+            callback, self._callback = self._callback, None
+            self.settle_time = time.perf_counter() - self._arm_time
+            self.timed_out = not settled
+            if settled:
+                self._settled.set()
+        if callback is not None:
+            callback(settled)
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
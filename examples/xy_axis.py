@@ -30,8 +30,7 @@ def return2home_demo():
 def report_limit_switch():
     prior = PriorController(port="COM12", baudrate=9600, timeout=0.1)
     while True:
-        prior.write_cmd("LMT")
-        print(prior.cmd_answer())
+        print(prior.query("LMT"))
 
         if keyboard.is_pressed("q"):
             print("q pressed, ending loop")
@@ -0,0 +1,346 @@
+import math
+import threading
+import time
+import typing
+
+import numpy as np
+
+from acquisition_pipeline import Tile
+from motion_model import MAX_XY_SPEED, MAX_XY_ACCELERATION, get_travel_time
+from prior_engine import PriorIOEngine
+
+# short exposure limiting the motion blur of the frames taken while the stage is moving (in s): with the x40
+# (11.64 px/µm) and a blur of 1 pixel, 100 µs allows 860 µm/s, a tile every 0.13 s
+DEFAULT_EXPOSURE = 0.0001
+# maximum displacement of the stage during the exposure (in pixels of the camera)
+MAX_MOTION_BLUR = 1.
+# period of the position requests while flying (in s): the crossing of each tile is predicted from the last ones
+FLY_POLLING_PERIOD = 0.01
+# time per tile of the stop-and-shoot acquisition (movement, settle and frame) measured with the x40 (in s)
+STOP_AND_SHOOT_TILE_TIME = 0.22
+# margin added to the expected duration of a sweep before it is considered stuck (in s)
+SWEEP_TIMEOUT_MARGIN = 2.
+
+
+def get_fly_speed(pitch: float, pixel_scale: float, exposure: float = DEFAULT_EXPOSURE,
+                  max_blur: float = MAX_MOTION_BLUR, frame_period: float = 0., max_speed: float = MAX_XY_SPEED,
+                  stop_and_shoot_time: typing.Union[None, float] = STOP_AND_SHOOT_TILE_TIME) -> float:
+    """
+    Highest constant speed of a fly scan.
+    :param pitch: distance between two tiles along the scanned axis (in µm).
+    :param pixel_scale: number of camera pixels per µm (see ObjectiveProfile).
+    :param exposure: exposure time of the camera (in s).
+    :param max_blur: maximum displacement during the exposure (in pixels).
+    :param frame_period: minimum time between two frames of the camera (in s), the next tile must not be reached
+                         before the camera is ready.
+    :param max_speed: maximum speed of the stage (in µm/s).
+    :param stop_and_shoot_time: time per tile of the stop-and-shoot acquisition (in s), None to skip the comparison.
+    :return: speed (in µm/s).
+    :raise ValueError: if the blur limit needs a speed below the slowest "SMS" setting, or if the fly scan would be
+                       slower than the stop-and-shoot acquisition (the exposure has to be shortened).
+    """
+    speeds = [max_blur / pixel_scale / exposure, max_speed]
+    if frame_period > 0:
+        speeds.append(pitch / frame_period)
+    speed = min(speeds)
+    # the controller runs at the "SMS" setting just below
+    setting_speed = MAX_XY_SPEED * get_speed_setting(speed) / 100
+    tile_time = pitch / setting_speed
+    if stop_and_shoot_time is not None and tile_time >= stop_and_shoot_time:
+        raise ValueError("The fly scan at {speed:.0f} µm/s takes {tile_time:.2f} s per tile, more than the "
+                         "{stop_and_shoot_time:.2f} s of the stop-and-shoot acquisition: shorten the exposure "
+                         "({exposure} s)".format(speed=setting_speed, tile_time=tile_time,
+                                                 stop_and_shoot_time=stop_and_shoot_time, exposure=exposure))
+    return speed
+
+
+def get_speed_setting(speed: float) -> int:
+    """
+    :param speed: speed (in µm/s).
+    :return: highest "SMS" setting (percentage of the maximum speed) not faster than speed.
+    :raise ValueError: if speed is below the slowest setting (1 %), it would exceed the blur limit.
+    """
+    setting = math.floor(speed / MAX_XY_SPEED * 100)
+    if setting < 1:
+        raise ValueError("The speed {speed:.0f} µm/s is below the slowest speed setting ({slowest:.0f} µm/s)".format(
+            speed=speed, slowest=MAX_XY_SPEED / 100))
+    return min(setting, 100)
+
+
+class FlyLine:
+    def __init__(self, indices: np.ndarray, positions: np.ndarray, axis: int = 1):
+        """
+        Tiles imaged during one sweep of the stage at constant speed.
+        :param indices: indices of the tiles in the grid.
+        :param positions: (N, 2) or (N, 3) positions of the tiles in visiting order, aligned along axis.
+        :param axis: scanned axis (0: x, 1: y).
+        """
+        self.indices = np.asarray(indices)
+        self.positions = np.asarray(positions)
+        self.axis = axis
+        self.direction = 1 if len(self.positions) < 2 or self.positions[-1, axis] >= self.positions[0, axis] else -1
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def triggers(self) -> np.ndarray:
+        """
+        Coordinates along the scanned axis where a frame is taken.
+        """
+        return self.positions[:, self.axis].astype(np.float64)
+
+    def get_path(self, run_up: float) -> typing.Tuple[typing.Tuple[int, ...], typing.Tuple[int, ...]]:
+        """
+        Start and end of the sweep: the stage starts run_up µm before the first tile so it reaches its constant speed
+        before it, and stops run_up µm after the last one. A single Z (median of the tiles) is used for the whole line.
+        """
+        start = self.positions[0].astype(np.float64)
+        end = self.positions[-1].astype(np.float64)
+        start[self.axis] -= self.direction * run_up
+        end[self.axis] += self.direction * run_up
+        if self.positions.shape[1] > 2:
+            start[2] = end[2] = np.median(self.positions[:, 2])
+        return tuple(int(value) for value in np.rint(start)), tuple(int(value) for value in np.rint(end))
+
+
+def get_fly_lines(positions, axis: int = 1,
+                  indices: typing.Union[None, typing.Sequence[int]] = None) -> typing.List[FlyLine]:
+    """
+    Split the positions of a grid in visiting order into the straight lines of the serpentine (columns for axis=1):
+    a new line starts when the other coordinate changes or when the scanned coordinate turns back.
+    :param positions: (N, 2) or (N, 3) tile positions (array, list or LazyGrid).
+    :param indices: indices of the tiles to image (all by default), the lines keep the indices of the grid.
+    """
+    positions = np.asarray(positions)
+    indices = np.arange(len(positions)) if indices is None else np.asarray(indices, dtype=np.int64)
+    positions = positions[indices]
+    if len(positions) == 0:
+        return []
+    steps = np.sign(np.diff(positions[:, axis]))
+    cuts = (positions[1:, 1 - axis] != positions[:-1, 1 - axis]) | (steps == 0)
+    turns = np.zeros_like(cuts)
+    turns[1:] = (steps[1:] != steps[:-1]) & ~cuts[:-1]
+    starts = np.concatenate([[0], np.nonzero(cuts | turns)[0] + 1, [len(positions)]])
+    return [FlyLine(indices=indices[start:end], positions=positions[start:end], axis=axis)
+            for start, end in zip(starts[:-1], starts[1:])]
+
+
+class PositionTrack:
+    def __init__(self):
+        """
+        Time stamped positions of the stage received while flying (filled by the polling of the I/O engine).
+        """
+        self._condition = threading.Condition()
+        self.times = []
+        self.positions = []
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self.times)
+
+    def add(self, position: typing.Tuple[int, ...]) -> None:
+        with self._condition:
+            self.times.append(time.perf_counter())
+            self.positions.append(position)
+            self._condition.notify_all()
+
+    def wait_for_sample(self, count: int, timeout: float) -> bool:
+        """
+        :param count: number of samples already seen.
+        :return: True if a new sample arrived before the timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self.times) > count, timeout=timeout)
+
+    def get_samples(self, count: int = 2) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: times and positions of the last count samples.
+        """
+        with self._condition:
+            return np.array(self.times[-count:]), np.array(self.positions[-count:], dtype=np.float64)
+
+    def interpolate(self, times: np.ndarray) -> np.ndarray:
+        """
+        Positions of the stage at the given times (time.perf_counter), linear between the samples and extrapolated
+        with the speed of the first and last two samples outside of them.
+        :return: (len(times), number of axes) positions.
+        """
+        with self._condition:
+            sample_times, positions = np.array(self.times), np.array(self.positions, dtype=np.float64)
+        times = np.asarray(times, dtype=np.float64)
+        if len(sample_times) < 2:
+            return np.repeat(positions[:1], len(times), axis=0)
+        interpolated = np.stack([np.interp(times, sample_times, positions[:, axis])
+                                 for axis in range(positions.shape[1])], axis=1)
+        for index, other in ((0, 1), (-1, -2)):
+            velocity = (positions[index] - positions[other]) / (sample_times[index] - sample_times[other])
+            outside = times < sample_times[0] if index == 0 else times > sample_times[-1]
+            interpolated[outside] = positions[index] + np.outer(times[outside] - sample_times[index], velocity)
+        return interpolated
+
+
+class FlyScanner:
+    def __init__(self, engine: PriorIOEngine, capture: typing.Callable[[], typing.Any], speed: float,
+                 acceleration: float = MAX_XY_ACCELERATION / 2, exposure: float = DEFAULT_EXPOSURE,
+                 trigger_latency: float = 0., polling_period: float = FLY_POLLING_PERIOD):
+        """
+        Continuous motion acquisition: the stage sweeps each line of the serpentine at constant speed without stopping
+        at the tiles, and a frame is taken when the stage crosses each tile. The position of the stage is polled while
+        flying, the crossing time of the next tile is predicted from the last samples and the frame is taken so that
+        the middle of the exposure is at the crossing. Each frame is then tagged with the position interpolated at
+        the middle of its exposure.
+        The acceleration, deceleration and settle time are only paid once per line instead of once per tile, at the
+        price of a short exposure (see get_fly_speed) and a position known within the polling jitter.
+        :param engine: running I/O engine of the controller.
+        :param capture: function returning the current frame of the camera (blocking).
+        :param speed: speed of the sweeps (in µm/s), rounded down to a "SMS" setting.
+        :param acceleration: acceleration of the stage (in µm/s²), sets the run-up before the first tile of a line.
+        :param exposure: exposure time of the camera (in s).
+        :param trigger_latency: delay between the call of capture and the start of the exposure (in s).
+        :param polling_period: period of the position requests (in s).
+        """
+        self.engine = engine
+        self.capture = capture
+        self.speed_setting = get_speed_setting(speed)
+        self.speed = MAX_XY_SPEED * self.speed_setting / 100
+        self.acceleration = acceleration
+        self.exposure = exposure
+        self.trigger_latency = trigger_latency
+        self.polling_period = polling_period
+        self._stop = threading.Event()
+        # speed setting of the controller outside of the sweeps
+        self._travel_setting = ""
+
+    @property
+    def run_up(self) -> float:
+        """
+        Distance needed to reach the constant speed, plus a few polling periods so the crossing of the first tile is
+        predicted from samples taken at constant speed (in µm).
+        """
+        return self.speed ** 2 / (2 * self.acceleration) + 3 * self.speed * self.polling_period
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def move(self, position: typing.Sequence[int]) -> None:
+        handle = self.engine.submit("G, " + ", ".join(str(int(value)) for value in position))
+        handle.wait()
+        if not handle.reached:
+            raise IOError("The position {} was not reached".format(tuple(position)))
+
+    def get_sweep_time(self, line: FlyLine) -> float:
+        """
+        :return: expected duration of the sweep of a line, run-ups included (in s).
+        """
+        start, end = line.get_path(self.run_up)
+        return get_travel_time(end[line.axis] - start[line.axis], self.speed, self.acceleration)
+
+    def wait_crossing(self, track: PositionTrack, line: FlyLine, trigger: float, handle,
+                      deadline: float) -> typing.Union[None, float]:
+        """
+        :param deadline: time (time.perf_counter) after which the sweep is considered stuck.
+        :return: predicted time (time.perf_counter) of the crossing of trigger, None if the sweep ended (or the
+                 deadline passed) before.
+        """
+        count = len(track)
+        while not self._stop.is_set() and not handle.done() and time.perf_counter() < deadline:
+            if not track.wait_for_sample(count, timeout=self.polling_period * 5):
+                continue
+            count = len(track)
+            times, positions = track.get_samples(2)
+            remaining = (trigger - positions[-1, line.axis]) * line.direction
+            if remaining <= 0:
+                # already crossed (late sample)
+                return time.perf_counter()
+            if len(times) == 2 and times[1] > times[0]:
+                speed = (positions[1, line.axis] - positions[0, line.axis]) / (times[1] - times[0]) * line.direction
+                if speed > 0:
+                    crossing_time = times[1] + remaining / speed
+                    # the crossing happens before the next sample: wait for it here
+                    if crossing_time - time.perf_counter() < 1.5 * self.polling_period:
+                        return crossing_time
+        return None
+
+    def scan_line(self, line: FlyLine) -> typing.List[Tile]:
+        """
+        Sweep a line and take a frame at each of its tiles.
+        :return: tiles of the line, with the measured position of each frame.
+        """
+        start, end = line.get_path(self.run_up)
+        self.move(start)
+
+        track = PositionTrack()
+        tiles, mid_exposure_times = [], []
+        self.set_speed(self.speed_setting)
+        # faster polling during the sweep, the positions are still given to the previous callback (display...)
+        previous_callback, previous_period = self.engine.position_polling
+
+        def on_position(position: typing.Tuple[int, ...]) -> None:
+            track.add(position)
+            if previous_period is not None and previous_callback is not None:
+                previous_callback(position)
+
+        self.engine.start_position_polling(on_position, period=self.polling_period)
+        handle = None
+        try:
+            sweep_timeout = self.get_sweep_time(line) + SWEEP_TIMEOUT_MARGIN
+            handle = self.engine.submit("G, " + ", ".join(str(value) for value in end), timeout=sweep_timeout)
+            deadline = time.perf_counter() + sweep_timeout
+            for index, position, trigger in zip(line.indices, line.positions, line.triggers):
+                crossing_time = self.wait_crossing(track, line, trigger, handle, deadline)
+                if crossing_time is None:
+                    if self._stop.is_set():
+                        break
+                    raise IOError("The sweep ended before the tile {index} at {position}".format(index=index,
+                                                                                                 position=position))
+                delay = crossing_time - self.exposure / 2 - self.trigger_latency - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                capture_time = time.perf_counter()
+                tile = Tile(index=int(index), position=tuple(int(value) for value in position), frame=self.capture())
+                tile.acquisition_time = time.time()
+                tiles.append(tile)
+                mid_exposure_times.append(capture_time + self.trigger_latency + self.exposure / 2)
+            if not self._stop.is_set():
+                handle.wait()
+            # a few samples after the last frame for the interpolation
+            track.wait_for_sample(len(track), timeout=self.polling_period * 5)
+        finally:
+            if handle is not None and not handle.reached:
+                # stuck, failed or interrupted sweep: the stage is stopped before anything else is sent
+                self.engine.submit("I").wait()
+            if previous_period is None:
+                self.engine.stop_position_polling()
+            else:
+                self.engine.start_position_polling(previous_callback, period=previous_period)
+            if self._travel_setting.isdigit():
+                self.set_speed(self._travel_setting)
+
+        if tiles:
+            measured_positions = track.interpolate(np.array(mid_exposure_times))
+            for tile, measured_position in zip(tiles, measured_positions):
+                tile.measured_position = tuple(float(value) for value in measured_position)
+        return tiles
+
+    def set_speed(self, setting: typing.Union[int, str]) -> None:
+        answer = self.engine.query("SMS, {speed}".format(speed=setting))
+        if answer != "0":
+            raise IOError("The speed {} was refused by the controller: {}".format(setting, answer))
+
+    def scan(self, positions, axis: int = 1,
+             indices: typing.Union[None, typing.Sequence[int]] = None) -> typing.Iterator[Tile]:
+        """
+        Fly scan of a grid, line after line. Only the sweeps run at the fly speed: the stage goes from one line to the
+        next at the speed set before the scan.
+        :param positions: tile positions of the grid in visiting order (serpentine).
+        :param axis: scanned axis (1: the columns of the serpentine are swept).
+        :param indices: indices of the tiles to image (all by default), to resume an interrupted run.
+        :return: iterator over the tiles, given line after line (it can feed AcquisitionPipeline.start_from).
+        """
+        self._stop.clear()
+        self._travel_setting = self.engine.query("SMS")
+        for line in get_fly_lines(positions, axis=axis, indices=indices):
+            if self._stop.is_set():
+                break
+            yield from self.scan_line(line)
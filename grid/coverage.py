@@ -0,0 +1,207 @@
+import itertools
+import math
+from typing import Tuple, Dict
+
+import numpy as np
+
+
+def get_tile_boxes(grid, tile_size: Tuple[int, int]) -> np.ndarray:
+    """
+    :param grid: (N, 2) tile positions (array, list or LazyGrid), top left corner of each tile.
+    :param tile_size: footprint of a tile (image size).
+    :return: (N, 4) float64 array of the tiles (x min, y min, x max, y max).
+    """
+    positions = np.asarray(grid, dtype=np.float64)[:, :2]
+    return np.concatenate([positions, positions + np.asarray(tile_size, dtype=np.float64)], axis=1)
+
+
+def get_intersection(box_a: np.ndarray, box_b: np.ndarray) -> np.ndarray:
+    """
+    Vectorized intersection of rectangles, neighbours in any direction (diagonals included).
+    :param box_a: (..., 4) rectangles (x min, y min, x max, y max).
+    :param box_b: (..., 4) rectangles, broadcast with box_a.
+    :return: (..., 4) intersections, with x max <= x min or y max <= y min when the rectangles do not intersect.
+    """
+    box_a, box_b = np.asarray(box_a, dtype=np.float64), np.asarray(box_b, dtype=np.float64)
+    return np.concatenate([np.maximum(box_a[..., :2], box_b[..., :2]), np.minimum(box_a[..., 2:], box_b[..., 2:])],
+                          axis=-1)
+
+
+def get_overlapping_pairs(grid, tile_size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Every pair of overlapping tiles, found with a spatial hash: the tiles are binned on cells of the tile size, so two
+    tiles can only overlap if their cells are neighbours.
+    :return: (M, 2) indices (i < j) of the overlapping tiles, (M, 2) overlap width and height of each pair.
+    """
+    positions = np.asarray(grid, dtype=np.float64)[:, :2]
+    nb_tiles = len(positions)
+    if nb_tiles < 2:
+        return np.empty((0, 2), dtype=np.int64), np.empty((0, 2))
+
+    tile_size = np.asarray(tile_size, dtype=np.float64)
+    bins = np.floor(positions / tile_size).astype(np.int64)
+    bins -= bins.min(axis=0)
+    # one key per cell, the rows are shifted by one so the neighbours of the first row have a positive key
+    height = int(bins[:, 1].max()) + 3
+    keys = bins[:, 0] * height + bins[:, 1] + 1
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    first, second = [], []
+    for x_offset, y_offset in itertools.product((-1, 0, 1), repeat=2):
+        target_keys = keys + x_offset * height + y_offset
+        start = np.searchsorted(sorted_keys, target_keys, side="left")
+        counts = np.searchsorted(sorted_keys, target_keys, side="right") - start
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        tiles = np.repeat(np.arange(nb_tiles), counts)
+        # rank of each candidate in the cell of its tile
+        ranks = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates = order[np.repeat(start, counts) + ranks]
+        kept = tiles < candidates
+        first.append(tiles[kept])
+        second.append(candidates[kept])
+
+    pairs = np.stack([np.concatenate(first), np.concatenate(second)], axis=1)
+    overlaps = tile_size - np.abs(positions[pairs[:, 0]] - positions[pairs[:, 1]])
+    overlapping = (overlaps > 0).all(axis=1)
+    return pairs[overlapping], overlaps[overlapping]
+
+
+def get_coverage_cells(grid, tile_size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Exact coverage of the bounding box of the grid: the plane is cut along every tile side (coordinate compression)
+    and the number of tiles covering each elementary cell is computed with a 2D difference array.
+    :return: x and y edges of the cells, (len(x edges) - 1, len(y edges) - 1) number of tiles covering each cell.
+    """
+    boxes = get_tile_boxes(grid, tile_size)
+    x_edges = np.unique(boxes[:, [0, 2]])
+    y_edges = np.unique(boxes[:, [1, 3]])
+    first_x, last_x = np.searchsorted(x_edges, boxes[:, 0]), np.searchsorted(x_edges, boxes[:, 2])
+    first_y, last_y = np.searchsorted(y_edges, boxes[:, 1]), np.searchsorted(y_edges, boxes[:, 3])
+
+    difference = np.zeros((len(x_edges), len(y_edges)), dtype=np.int32)
+    np.add.at(difference, (first_x, first_y), 1)
+    np.add.at(difference, (last_x, first_y), -1)
+    np.add.at(difference, (first_x, last_y), -1)
+    np.add.at(difference, (last_x, last_y), 1)
+    counts = difference.cumsum(axis=0).cumsum(axis=1)[:-1, :-1]
+    return x_edges, y_edges, counts
+
+
+class GridCoverage:
+    def __init__(self, grid, tile_size: Tuple[int, int]):
+        """
+        Coverage and overlap analytics of a grid: union area, overlap of each pair of neighbours, uncovered gaps and
+        redundancy, to tune the overlap against the stitching quality.
+        :param grid: (N, 2) tile positions (array, list or LazyGrid).
+        :param tile_size: footprint of a tile (image size).
+        """
+        self.tile_size = tuple(tile_size)
+        self.nb_tiles = len(grid)
+        if self.nb_tiles == 0:
+            raise ValueError("The grid has no tile")
+        self.x_edges, self.y_edges, self.counts = get_coverage_cells(grid, tile_size)
+        self.cell_areas = np.outer(np.diff(self.x_edges), np.diff(self.y_edges))
+        self.positions = np.asarray(grid, dtype=np.float64)[:, :2]
+        self.pairs, self.overlaps = get_overlapping_pairs(self.positions, tile_size)
+
+    @property
+    def bounding_box(self) -> Tuple[float, float, float, float]:
+        return self.x_edges[0], self.y_edges[0], self.x_edges[-1], self.y_edges[-1]
+
+    @property
+    def tiles_area(self) -> float:
+        """
+        Sum of the areas of the tiles (overlaps counted several times).
+        """
+        return float(self.nb_tiles * self.tile_size[0] * self.tile_size[1])
+
+    @property
+    def union_area(self) -> float:
+        """
+        Exact area covered by at least one tile.
+        """
+        return float(self.cell_areas[self.counts > 0].sum())
+
+    @property
+    def gap_area(self) -> float:
+        """
+        Area of the bounding box of the grid which is not imaged.
+        """
+        return float(self.cell_areas[self.counts == 0].sum())
+
+    @property
+    def gaps(self) -> np.ndarray:
+        """
+        :return: (K, 4) uncovered cells (x min, y min, x max, y max) inside the bounding box.
+        """
+        columns, rows = np.nonzero(self.counts == 0)
+        return np.stack([self.x_edges[columns], self.y_edges[rows], self.x_edges[columns + 1],
+                         self.y_edges[rows + 1]], axis=1)
+
+    @property
+    def redundancy_ratio(self) -> float:
+        """
+        Imaged area over covered area: 1 without overlap, 1 / (1 - overlap)^2 for a regular grid.
+        """
+        return self.tiles_area / self.union_area
+
+    @property
+    def overlap_areas(self) -> np.ndarray:
+        """
+        :return: (M,) overlap area of each pair of overlapping tiles (see pairs).
+        """
+        return self.overlaps.prod(axis=1)
+
+    def get_neighbour_overlaps(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Overlaps used by the stitching, as a percentage of the image size: along x between each tile and its nearest
+        neighbour on the right (same row), along y between each tile and its nearest neighbour below (same column).
+        """
+        offsets = self.positions[self.pairs[:, 1]] - self.positions[self.pairs[:, 0]]
+        neighbour_overlaps = []
+        for axis in range(2):
+            other_axis = 1 - axis
+            aligned = (offsets[:, other_axis] == 0) & (offsets[:, axis] != 0)
+            # the pair is indexed by its tile on the left (or on the top)
+            tiles = np.where(offsets[:, axis] > 0, self.pairs[:, 0], self.pairs[:, 1])[aligned]
+            largest = np.full(self.nb_tiles, -np.inf)
+            np.maximum.at(largest, tiles, self.overlaps[aligned, axis])
+            neighbour_overlaps.append(largest[largest > -np.inf] / self.tile_size[axis] * 100)
+        return neighbour_overlaps[0], neighbour_overlaps[1]
+
+    def summary(self) -> Dict[str, float]:
+        x_overlaps, y_overlaps = self.get_neighbour_overlaps()
+        return {"tiles": self.nb_tiles,
+                "union_area": self.union_area,
+                "gap_area": self.gap_area,
+                "redundancy_ratio": self.redundancy_ratio,
+                "overlapping_pairs": len(self.pairs),
+                "min_x_overlap": float(x_overlaps.min()) if len(x_overlaps) else 0.,
+                "min_y_overlap": float(y_overlaps.min()) if len(y_overlaps) else 0.}
+
+    def print_summary(self) -> None:
+        for name, value in self.summary().items():
+            print("{name:>18} : {value:.6g}".format(name=name, value=value))
+
+
+def get_min_tiles_matrix(area_size: Tuple[float, float], tile_size: Tuple[int, int],
+                         min_overlap: float) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Smallest matrix covering an area with at least a minimal overlap between neighbours: the largest step allowed by
+    the overlap is used, then shrunk so the tiles are spread evenly over the area.
+    :param area_size: width and height of the area (in µm).
+    :param min_overlap: minimal overlap between two neighbours (in % of the image size).
+    :return: number of tiles (columns, rows), step along x and y.
+    """
+    matrix, step = [], []
+    for axis in range(2):
+        max_step = math.floor(tile_size[axis] * (1 - min_overlap / 100))
+        if max_step <= 0:
+            raise ValueError("The overlap has to be lower than 100 %")
+        nb_tiles = max(1, math.ceil((area_size[axis] - tile_size[axis]) / max_step) + 1)
+        matrix.append(nb_tiles)
+        step.append(max_step if nb_tiles == 1 else math.ceil((area_size[axis] - tile_size[axis]) / (nb_tiles - 1)))
+    return tuple(matrix), tuple(step)
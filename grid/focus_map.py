@@ -0,0 +1,260 @@
+from typing import List, Union, Sequence, Callable, Tuple
+
+import numpy as np
+
+# default number of autofocus points per grid
+NB_FOCUS_POINTS = 9
+# regularization of the thin-plate spline (0: exact interpolation of the focus points)
+THIN_PLATE_SMOOTHING = 1e-3
+
+
+class FocusSurface:
+    """
+    Model of the focus height of a slide: z = f(x, y). Subclasses implement fit and predict.
+    """
+    name = None
+    # number of focus points needed to fit the model
+    min_points = 1
+
+    def fit(self, xy: np.ndarray, z: np.ndarray) -> None:
+        """
+        :param xy: (N, 2) positions of the focus points (in µm).
+        :param z: (N,) focus height at these positions.
+        """
+        raise NotImplementedError
+
+    def predict(self, xy: np.ndarray) -> np.ndarray:
+        """
+        :param xy: (M, 2) positions (in µm).
+        :return: (M,) predicted focus heights.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return "{name}()".format(name=type(self).__name__)
+
+
+class ConstantSurface(FocusSurface):
+    """
+    Mean height of the focus points: used when there are too few points for the requested model.
+    """
+    name = "constant"
+
+    def fit(self, xy: np.ndarray, z: np.ndarray) -> None:
+        self.z = float(np.mean(z))
+
+    def predict(self, xy: np.ndarray) -> np.ndarray:
+        return np.full(len(xy), self.z)
+
+
+class PolynomialSurface(FocusSurface):
+    """
+    Least squares fit of z on polynomial terms of (x, y). The coordinates are centered and scaled for conditioning.
+    """
+
+    def get_terms(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def fit(self, xy: np.ndarray, z: np.ndarray) -> None:
+        self.center = xy.mean(axis=0)
+        self.scale = max(float(np.abs(xy - self.center).max()), 1.)
+        normalized = (xy - self.center) / self.scale
+        self.coefficients = np.linalg.lstsq(self.get_terms(normalized[:, 0], normalized[:, 1]), z, rcond=None)[0]
+
+    def predict(self, xy: np.ndarray) -> np.ndarray:
+        normalized = (np.asarray(xy, dtype=np.float64) - self.center) / self.scale
+        return self.get_terms(normalized[:, 0], normalized[:, 1]) @ self.coefficients
+
+
+class PlaneSurface(PolynomialSurface):
+    """
+    z = a + b.x + c.y: tilt of the slide in its holder.
+    """
+    name = "plane"
+    min_points = 3
+
+    def get_terms(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        return np.stack([np.ones_like(x), x, y], axis=1)
+
+
+class BilinearSurface(PolynomialSurface):
+    """
+    z = a + b.x + c.y + d.x.y: tilt and twist of the slide.
+    """
+    name = "bilinear"
+    min_points = 4
+
+    def get_terms(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        return np.stack([np.ones_like(x), x, y, x * y], axis=1)
+
+
+class ThinPlateSurface(FocusSurface):
+    name = "thin-plate"
+    min_points = 3
+
+    def __init__(self, smoothing: float = THIN_PLATE_SMOOTHING):
+        """
+        Thin-plate spline: smoothest surface going (almost) through the focus points, it follows the warping of the
+        slide and the thickness variations of the sample.
+        :param smoothing: regularization, larger values give a smoother surface which does not go exactly through the
+                          points (noisy autofocus).
+        """
+        self.smoothing = smoothing
+
+    @staticmethod
+    def kernel(distances: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(distances > 0, distances ** 2 * np.log(distances), 0.)
+
+    def fit(self, xy: np.ndarray, z: np.ndarray) -> None:
+        self.center = xy.mean(axis=0)
+        self.scale = max(float(np.abs(xy - self.center).max()), 1.)
+        self.points = (xy - self.center) / self.scale
+        nb_points = len(self.points)
+
+        # [[K + smoothing.I, P], [P^T, 0]] [weights, affine] = [z, 0]
+        system = np.zeros((nb_points + 3, nb_points + 3))
+        system[:nb_points, :nb_points] = self.kernel(
+            np.linalg.norm(self.points[:, np.newaxis] - self.points[np.newaxis], axis=2)) + \
+            self.smoothing * np.eye(nb_points)
+        system[:nb_points, nb_points] = 1
+        system[:nb_points, nb_points + 1:] = self.points
+        system[nb_points:, :nb_points] = system[:nb_points, nb_points:].T
+        solution = np.linalg.lstsq(system, np.concatenate([z, np.zeros(3)]), rcond=None)[0]
+        self.weights, self.affine = solution[:nb_points], solution[nb_points:]
+
+    def predict(self, xy: np.ndarray) -> np.ndarray:
+        normalized = (np.asarray(xy, dtype=np.float64) - self.center) / self.scale
+        distances = np.linalg.norm(normalized[:, np.newaxis] - self.points[np.newaxis], axis=2)
+        return self.kernel(distances) @ self.weights + self.affine[0] + normalized @ self.affine[1:]
+
+    def __repr__(self):
+        return "ThinPlateSurface(smoothing={})".format(self.smoothing)
+
+
+FOCUS_SURFACES = {surface.name: surface for surface in [PlaneSurface, BilinearSurface, ThinPlateSurface]}
+
+
+def select_focus_points(positions: np.ndarray, nb_points: int = NB_FOCUS_POINTS) -> np.ndarray:
+    """
+    Well-spread subset of the tiles of a grid (farthest point sampling): the first point is the tile nearest to the
+    center of the grid, each next one is the tile farthest from the points already chosen.
+    :param positions: (N, 2) tile positions.
+    :return: indices of the chosen tiles in positions.
+    """
+    positions = np.asarray(positions, dtype=np.float64)[:, :2]
+    nb_points = min(nb_points, len(positions))
+    if nb_points == 0:
+        return np.empty(0, dtype=np.int64)
+
+    chosen = [int(np.argmin(np.linalg.norm(positions - positions.mean(axis=0), axis=1)))]
+    distances = np.linalg.norm(positions - positions[chosen[0]], axis=1)
+    for _ in range(nb_points - 1):
+        chosen.append(int(np.argmax(distances)))
+        distances = np.minimum(distances, np.linalg.norm(positions - positions[chosen[-1]], axis=1))
+    return np.array(chosen, dtype=np.int64)
+
+
+def get_sweep_positions(center: float, half_range: float, step: float) -> np.ndarray:
+    """
+    :return: Z positions of an autofocus sweep around center.
+    """
+    return np.arange(center - half_range, center + half_range + step / 2, step).round().astype(np.int32)
+
+
+def get_best_focus(z_positions: Sequence[float], sharpness_values: Sequence[float]) -> float:
+    """
+    Z of the sharpest image of a sweep, refined with a parabola through the maximum and its two neighbours.
+    """
+    z_positions = np.asarray(z_positions, dtype=np.float64)
+    sharpness_values = np.asarray(sharpness_values, dtype=np.float64)
+    best = int(np.argmax(sharpness_values))
+    if best == 0 or best == len(sharpness_values) - 1:
+        return float(z_positions[best])
+    previous_value, value, next_value = sharpness_values[best - 1:best + 2]
+    curvature = previous_value - 2 * value + next_value
+    if curvature >= 0:
+        return float(z_positions[best])
+    offset = 0.5 * (previous_value - next_value) / curvature
+    return float(z_positions[best] + offset * (z_positions[best + 1] - z_positions[best - 1]) / 2)
+
+
+def find_best_focus(measure: Callable[[int], float], center: float, coarse_sweep: Tuple[float, float] = (100, 20),
+                    fine_sweep: Tuple[float, float] = (20, 5)) -> float:
+    """
+    Blocking autofocus: a coarse Z sweep around center, then a fine one around its sharpest Z.
+    :param measure: function moving to a Z and returning the sharpness of the frame taken there.
+    :param coarse_sweep: (half range, step) of the coarse sweep.
+    :param fine_sweep: (half range, step) of the fine sweep.
+    :return: Z of the sharpest frame.
+    """
+    best_z = center
+    for half_range, step in (coarse_sweep, fine_sweep):
+        sweep = get_sweep_positions(center=best_z, half_range=half_range, step=step)
+        best_z = get_best_focus(sweep, [measure(int(z)) for z in sweep])
+    return best_z
+
+
+class FocusMap:
+    def __init__(self, surface: Union[str, FocusSurface] = "plane"):
+        """
+        Focus height over a slide, interpolated from autofocus measured on a few points: the acquisition then moves to
+        (x, y, z) in one command instead of running an autofocus on each tile.
+        :param surface: model of the focus height ("plane", "bilinear", "thin-plate" or a FocusSurface). If there are
+                        not enough focus points for it, a plane (or a constant height) is used.
+        """
+        self.surface = FOCUS_SURFACES[surface]() if isinstance(surface, str) else surface
+        self._xy = []
+        self._z = []
+        self._fitted_surface = None
+
+    @property
+    def nb_points(self) -> int:
+        return len(self._z)
+
+    def add_point(self, x: float, y: float, z: float) -> None:
+        self._xy.append((x, y))
+        self._z.append(z)
+        self._fitted_surface = None
+
+    def fit(self) -> FocusSurface:
+        """
+        :return: surface fitted on the focus points.
+        """
+        if self.nb_points == 0:
+            raise ValueError("The focus map has no focus point")
+        if self.nb_points >= self.surface.min_points:
+            surface = self.surface
+        elif self.nb_points >= PlaneSurface.min_points:
+            surface = PlaneSurface()
+        else:
+            surface = ConstantSurface()
+        surface.fit(np.array(self._xy, dtype=np.float64), np.array(self._z, dtype=np.float64))
+        self._fitted_surface = surface
+        return surface
+
+    def predict(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: (N, 2) positions.
+        :return: (N,) int32 predicted Z positions.
+        """
+        if self._fitted_surface is None:
+            self.fit()
+        return self._fitted_surface.predict(np.asarray(positions)[:, :2]).round().astype(np.int32)
+
+    def attach_z(self, positions: np.ndarray) -> np.ndarray:
+        """
+        :param positions: (N, 2) tile positions.
+        :return: (N, 3) int32 array of the tile positions with their predicted Z.
+        """
+        positions = np.asarray(positions)
+        return np.column_stack([positions[:, :2], self.predict(positions)]).astype(np.int32)
+
+
+def attach_focus_maps(grids: Sequence[np.ndarray], focus_maps: Sequence[FocusMap]) -> List[np.ndarray]:
+    """
+    :param grids: tile positions of each grid.
+    :param focus_maps: focus map of each grid.
+    :return: (N, 3) positions of each grid with the Z predicted by its focus map.
+    """
+    return [focus_map.attach_z(grid) for grid, focus_map in zip(grids, focus_maps)]
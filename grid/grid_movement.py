@@ -1,14 +1,21 @@
+import collections
 from typing import Tuple, Union, List
 
 import numpy as np
 
 from app.utils.position import Position
+from grid.lazy_grid import LazyGrid
+from grid.roi import MaskROI, PolygonROI, get_roi_matrix, get_tile_mask
+from grid.scan_order import ScanOrder, TravelCostModel, get_serpentine_indices, get_tile_positions, rank_scan_orders
+from objectives import ObjectiveProfile
 
 APP_SIZE = (700, 500)
 GRID = (200, 200)  # width, height -> 1 pixel equals 10 µm
 # IMAGE_SIZE = (5, 5)  # width, height -> camera image size
 IMAGE_SIZE = (11, 9)  # width, height -> camera image size
 RATIO = 76 * 2 * 4  # 1 pixel equals 10 µm
+# number of grid geometries kept by a GridCache
+GRID_CACHE_SIZE = 32
 
 """"
 Objectif Olympus x40:
@@ -60,12 +67,15 @@ class GridMovement:
 
     @velocity.setter
     def velocity(self, value):
-        if isinstance(value, float):
-            self._velocity = (value * self.img_size[0], value * self.img_size[1])
-        elif isinstance(value, Tuple):
-            self._velocity = (value[0] * self.img_size[0], value[1] * self.img_size[1])
+        self._velocity = get_step(img_size=self.img_size, percentage_non_overlap=value)
 
-        self._velocity = tuple([round(x) for x in self._velocity])
+    def set_objective(self, objective: ObjectiveProfile) -> None:
+        """
+        Tiling given by an objective: tile size of its field of view and exact pitch (independent overlap along x and y
+        in µm). The grids are then generated without percentage_non_overlap.
+        """
+        self.img_size = objective.field_of_view
+        self._velocity = objective.pitch
 
     @property
     def course(self):
@@ -194,7 +204,7 @@ class GridMovement:
                         return None, None
 
                 else:
-                    self.y += self._velocity
+                    self.y += self._velocity[1]
 
             if self._direction == 2:  # RIGHT
                 if self.x == self.x_lim[1] - self.img_size[0]:
@@ -202,13 +212,13 @@ class GridMovement:
                     # else:
                     #     self.direction = 3
                 else:
-                    self.x += self._velocity
+                    self.x += self._velocity[0]
 
             if self._direction == 4:  # LEFT
                 if self.x == self.x_lim[0]:
                     self.direction = 1
                 else:
-                    self.x -= self._velocity
+                    self.x -= self._velocity[0]
 
         elif self._course == Course().H_LEFT:
             if self._direction == 1:  # DOWN
@@ -221,7 +231,7 @@ class GridMovement:
                         self.direction = 4
 
                 else:
-                    self.y += self._velocity
+                    self.y += self._velocity[1]
 
             if self._direction == 2:  # RIGHT
                 if self.x == self.x_lim[1] - self.img_size[0]:
@@ -229,13 +239,13 @@ class GridMovement:
                     # else:
                     #     self.direction = 3
                 else:
-                    self.x += self._velocity
+                    self.x += self._velocity[0]
 
             if self._direction == 4:  # LEFT
                 if self.x == self.x_lim[0]:
                     self.direction = 1
                 else:
-                    self.x -= self._velocity
+                    self.x -= self._velocity[0]
 
         return self.x, self.y
 
@@ -243,65 +253,67 @@ class GridMovement:
         self._direction = 0
 
     def get_grid_from_matrix(self, start_pt: Tuple[int, int], matrix: Tuple[int, int],
-                             percentage_non_overlap: Union[Tuple, float]):
-        self.velocity = percentage_non_overlap
-        position_reached = False
-
-        grid = []
-        self.direction = 0
+                             percentage_non_overlap: Union[None, Tuple, float] = None) -> np.ndarray:
+        """
+        Serpentine course of a matrix of tiles: from the start point, the first column is scanned downwards, the next
+        one upwards and so on (vertical courses). Horizontal courses scan the rows instead of the columns.
+        :param start_pt: position of the first tile.
+        :param matrix: number of tiles (columns, rows).
+        :param percentage_non_overlap: step between two tiles as a percentage of the image size (float or per axis),
+                                       None to keep the current step (see set_objective).
+        :return: (columns * rows, 2) int32 array of the tile positions in visiting order.
+        """
+        if percentage_non_overlap is not None:
+            self.velocity = percentage_non_overlap
         self.start_pt = start_pt
-        self.x, self.y = self.start_pt
-        x, y = self.start_pt
-
-        grid.append(list(self.start_pt))
-        matrix = (matrix[0] - 1, matrix[1] - 1)
-        matrix_counter = [0, 0]
 
-        while not position_reached:
-
-            if self._course == Course().V_RIGHT or self._course == Course().V_LEFT:
-                if self._direction == 0:  # DOWN
-                    print("down")
-                    if matrix_counter[1] == matrix[1]:
-                        self.direction = 2
-
-                    # if matrix_counter[1] == 0 and matrix_counter[0] != 0:
-                    #     self.direction = 2
-
-                    else:
-                        self.y += self._velocity[1]
-                        matrix_counter[1] += 1
-                        grid.append([self._x, self._y])
-
-                elif self._direction == 2:  # RIGHT
-                    self.x += self._velocity[0]
-                    matrix_counter[0] += 1
-                    grid.append([self._x, self._y])
-
-                    if matrix_counter[0] % 2 == 0:
-
-                        self.direction = 0
-                    else:
-                        self.direction = 3
-
-                elif self._direction == 3:  # UP
-                    if matrix_counter[1] != 0:
-                        self.y -= self._velocity[1]
-                        matrix_counter[1] -= 1
-                        grid.append([self._x, self._y])
-
-                    else:
-                        self.direction = 2
+        by_rows = self._course == Course().H_RIGHT or self._course == Course().H_LEFT
+        grid = get_serpentine_grid(start_pt=start_pt, matrix=matrix, step=self._velocity, by_rows=by_rows)
+        self._x, self._y = (int(value) for value in grid[-1])
+        return grid
 
-            if matrix_counter == list(matrix):
-                position_reached = True
+    def get_lazy_grid_from_matrix(self, start_pt: Tuple[int, int], matrix: Tuple[int, int],
+                                  percentage_non_overlap: Union[None, Tuple, float] = None) -> LazyGrid:
+        """
+        Same course as get_grid_from_matrix, but the positions are computed on demand (see LazyGrid): for very large
+        matrices (whole slide scans).
+        """
+        if percentage_non_overlap is not None:
+            self.velocity = percentage_non_overlap
+        self.start_pt = start_pt
 
-        if matrix[0] % 2 != 0:
-            while matrix_counter[1] != 0:
-                self.y -= self._velocity[1]
-                matrix_counter[1] -= 1
-                grid.append([self._x, self._y])
+        by_rows = self._course == Course().H_RIGHT or self._course == Course().H_LEFT
+        grid = LazyGrid(origin=start_pt, matrix=matrix, step=self._velocity, by_rows=by_rows)
+        self._x, self._y = (int(value) for value in grid[-1])
+        return grid
 
+    def get_grid_from_roi(self, roi: Union[MaskROI, PolygonROI],
+                          percentage_non_overlap: Union[None, Tuple, float] = None,
+                          origin: Union[None, Tuple[int, int]] = None,
+                          scan_orders: Union[None, List[ScanOrder]] = None,
+                          cost_model: Union[None, TravelCostModel] = None) -> np.ndarray:
+        """
+        Tiles whose footprint (image size) intersects a region of interest, ordered by the fastest scan order.
+        :param roi: polygon or binary mask in stage coordinates.
+        :param percentage_non_overlap: step between two tiles as a percentage of the image size (float or per axis),
+                                       None to keep the current step (see set_objective).
+        :param origin: position of a tile the grid has to be aligned with, the top left corner of the ROI if None.
+        :param scan_orders: strategies compared to order the tiles, all the SCAN_ORDERS if None.
+        :param cost_model: run time model used to compare the strategies.
+        :return: (N, 2) int32 array of the tile positions in visiting order.
+        :raise ValueError: the ROI is empty.
+        """
+        if percentage_non_overlap is not None:
+            self.velocity = percentage_non_overlap
+        origin, matrix = get_roi_matrix(roi, step=self._velocity, tile_size=self.img_size, origin=origin)
+        tile_mask = get_tile_mask(roi, origin=origin, matrix=matrix, step=self._velocity, tile_size=self.img_size)
+
+        _, scan_order, corner = rank_scan_orders(origin=origin, matrix=matrix, step=self._velocity,
+                                                 cost_model=cost_model, scan_orders=scan_orders,
+                                                 tile_mask=tile_mask)[0]
+        grid = scan_order.get_positions(origin=origin, matrix=matrix, step=self._velocity, corner=corner,
+                                        tile_mask=tile_mask)
+        self.start_pt = tuple(int(value) for value in grid[0]) if len(grid) > 0 else origin
         return grid
 
     def get_grid(self, start_pt: Tuple[int, int], final_pt: Tuple[int, int],
@@ -357,37 +369,20 @@ class GridMovement:
         return grid
 
     @staticmethod
-    def grid_translation(new_start_pt: Position, grid):
-        new_grid = []
-
-        current_start_point = Position(*grid[0])
-        offset_x = current_start_point.x - new_start_pt.x
-        offset_y = current_start_point.y - new_start_pt.y
-
-        for pt in grid:
-            pt[0] -= offset_x
-            pt[1] -= offset_y
-            new_grid.append(pt)
-
-        return new_grid
-
-    @staticmethod
-    def remove_duplicate_positions(grid: List) -> List:
-        output_grid = []
-        for idx in range(len(grid) - 1):
-            if grid[idx] != grid[idx + 1]:
-                output_grid.append(grid[idx])
-        return output_grid
+    def grid_translation(new_start_pt: Position, grid) -> Union[np.ndarray, LazyGrid]:
+        if isinstance(grid, LazyGrid):
+            return grid.translate_to((new_start_pt.x, new_start_pt.y))
+        grid = np.asarray(grid)
+        offset = np.array([new_start_pt.x - grid[0, 0], new_start_pt.y - grid[0, 1]], dtype=grid.dtype)
+        return grid + offset
 
     @staticmethod
     def get_x_limits(grid):
-        np_grid = np.array(grid)
-        return min(np_grid[:, 0]), max(np_grid[:, 0])
+        return get_x_limits(grid)
 
     @staticmethod
     def get_y_limits(grid):
-        np_grid = np.array(grid)
-        return min(np_grid[:, 1]), max(np_grid[:, 1])
+        return get_y_limits(grid)
 
     def get_bounding_rec_grid(self, grid):
         x_min, x_max = self.get_x_limits(grid)
@@ -401,6 +396,122 @@ class GridMovement:
             return self.start_pt[0], self.start_pt[1], self.final_pt[0], self.final_pt[1]
 
 
+class GridCache:
+    def __init__(self, max_size: int = GRID_CACHE_SIZE):
+        """
+        LRU cache of grid geometries. Square grids are generated once at (0, 0) for each (matrix, overlap, image size,
+        course) and translated to the requested start position, so moving a grid only costs a translation (nothing for
+        a lazy grid). ROI grids are cached for each (content of the ROI, start position, overlap, image size).
+        :param max_size: maximum number of cached geometries, the least recently used one is dropped beyond.
+        """
+        self.max_size = max_size
+        self._grids = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._grids)
+
+    def clear(self) -> None:
+        self._grids.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        cached = self._grids.get(key)
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._grids.move_to_end(key)
+        return cached
+
+    def _put(self, key, value) -> None:
+        self._grids[key] = value
+        if len(self._grids) > self.max_size:
+            self._grids.popitem(last=False)
+
+    @staticmethod
+    def get_grid_movement(percentage_non_overlap: Union[None, Tuple, float] = None,
+                          img_size: Union[None, Tuple[int, int]] = None,
+                          objective: Union[None, ObjectiveProfile] = None) -> GridMovement:
+        """
+        :return: grid generator with the tiling of the objective, or of the image size and percentage_non_overlap.
+        """
+        if objective is not None:
+            gm = GridMovement(x=0, y=0, img_size=objective.field_of_view)
+            gm.set_objective(objective)
+        else:
+            gm = GridMovement(x=0, y=0, img_size=img_size)
+            gm.velocity = percentage_non_overlap
+        return gm
+
+    def get_grid(self, start_pt: Tuple[int, int], matrix: Tuple[int, int],
+                 percentage_non_overlap: Union[None, Tuple, float] = None,
+                 img_size: Union[None, Tuple[int, int]] = None, course: int = Course.V_RIGHT, lazy: bool = False,
+                 objective: Union[None, ObjectiveProfile] = None) -> Union[np.ndarray, LazyGrid]:
+        """
+        :param objective: tiling of the grid, replaces percentage_non_overlap and img_size.
+        :param lazy: if True, return a LazyGrid (see GridMovement.get_lazy_grid_from_matrix), otherwise an array (see
+                     GridMovement.get_grid_from_matrix).
+        :return: positions of the grid starting at start_pt.
+        """
+        gm = self.get_grid_movement(percentage_non_overlap=percentage_non_overlap, img_size=img_size,
+                                    objective=objective)
+        key = (tuple(matrix), tuple(gm.velocity), tuple(gm.img_size), course, lazy)
+        grid = self._get(key)
+        if grid is None:
+            gm.course = course
+            if lazy:
+                grid = gm.get_lazy_grid_from_matrix(start_pt=(0, 0), matrix=matrix)
+            else:
+                grid = gm.get_grid_from_matrix(start_pt=(0, 0), matrix=matrix)
+            self._put(key, grid)
+        # the translation gives a new grid: the cached one is never modified
+        return GridMovement.grid_translation(Position(*start_pt), grid)
+
+    def get_roi_grid(self, roi: Union[MaskROI, PolygonROI], start_pt: Union[None, Tuple[int, int]],
+                     percentage_non_overlap: Union[None, Tuple, float] = None,
+                     img_size: Union[None, Tuple[int, int]] = None,
+                     objective: Union[None, ObjectiveProfile] = None) -> np.ndarray:
+        """
+        :return: copy of the positions of the ROI grid (see GridMovement.get_grid_from_roi).
+        """
+        gm = self.get_grid_movement(percentage_non_overlap=percentage_non_overlap, img_size=img_size,
+                                    objective=objective)
+        # keyed on the content of the ROI: an ROI edited in place gets a new grid, and the entries only hold positions
+        key = (roi.key, None if start_pt is None else tuple(start_pt), tuple(gm.velocity), tuple(gm.img_size))
+        grid = self._get(key)
+        if grid is None:
+            grid = gm.get_grid_from_roi(roi=roi, origin=start_pt)
+            self._put(key, grid)
+        return grid.copy()
+
+
+def get_step(img_size: Tuple[int, int], percentage_non_overlap: Union[Tuple, float]) -> Tuple[int, int]:
+    """
+    Distance between two neighbouring tiles.
+    :param img_size: size of the camera image.
+    :param percentage_non_overlap: part of the image which does not overlap the next one (float or per axis).
+    """
+    if isinstance(percentage_non_overlap, tuple):
+        return round(percentage_non_overlap[0] * img_size[0]), round(percentage_non_overlap[1] * img_size[1])
+    return round(percentage_non_overlap * img_size[0]), round(percentage_non_overlap * img_size[1])
+
+
+def get_serpentine_grid(start_pt: Tuple[int, int], matrix: Tuple[int, int], step: Tuple[int, int],
+                        by_rows: bool = False) -> np.ndarray:
+    """
+    Positions of the tiles of a serpentine course, computed in one vectorized call.
+    :param start_pt: position of the first tile.
+    :param matrix: number of tiles (columns, rows).
+    :param step: distance between two neighbouring tiles along x and y (see get_step).
+    :param by_rows: see get_serpentine_indices.
+    :return: (columns * rows, 2) int32 array of the tile positions in visiting order.
+    """
+    return get_tile_positions(get_serpentine_indices(matrix=matrix, by_rows=by_rows), origin=start_pt, step=step)
+
+
 def get_bounding_rec_grid(grid, img_size):
     x_min, x_max = get_x_limits(grid)
     y_min, y_max = get_y_limits(grid)
@@ -408,13 +519,19 @@ def get_bounding_rec_grid(grid, img_size):
 
 
 def get_x_limits(grid):
-    np_grid = np.array(grid)
-    return min(np_grid[:, 0]), max(np_grid[:, 0])
+    if isinstance(grid, LazyGrid):
+        x_min, _, x_max, _ = grid.bounds
+        return x_min, x_max
+    np_grid = np.asarray(grid)
+    return np_grid[:, 0].min(), np_grid[:, 0].max()
 
 
 def get_y_limits(grid):
-    np_grid = np.array(grid)
-    return min(np_grid[:, 1]), max(np_grid[:, 1])
+    if isinstance(grid, LazyGrid):
+        _, y_min, _, y_max = grid.bounds
+        return y_min, y_max
+    np_grid = np.asarray(grid)
+    return np_grid[:, 1].min(), np_grid[:, 1].max()
 
 
 def position_done(last_bbox, current_bbox):
@@ -12,7 +12,10 @@ from PyQt5.QtWidgets import QGraphicsScene, QApplication, QGraphicsPixmapItem, Q
 
 from grid.display import Display
 from grid.grid_movement import Course, GridMovement, get_bounding_rec_grid
-from hardware_constants import IMAGE_SIZE
+from objectives import OBJECTIVES, DEFAULT_OBJECTIVE
+
+# footprint of a tile in the stage (in µm) with the default objective
+TILE_SIZE = OBJECTIVES[DEFAULT_OBJECTIVE].field_of_view
 
 
 class DockedForm(QWidget):
@@ -128,13 +131,13 @@ class MainWindow(QMainWindow):
     def generate_grid(self, dict_values):
         matrix, overlap = dict_values["matrix"], 100 - dict_values["overlap"]
         if overlap < 50:
-            width_grid = int(IMAGE_SIZE[0] * (matrix * (overlap / 100)))
-            length_grid = int(IMAGE_SIZE[1] * (matrix * (overlap / 100)))
+            width_grid = int(TILE_SIZE[0] * (matrix * (overlap / 100)))
+            length_grid = int(TILE_SIZE[1] * (matrix * (overlap / 100)))
         else:
-            width_grid = int(IMAGE_SIZE[0] * (matrix * (overlap / 100))) + 1
-            length_grid = int(IMAGE_SIZE[1] * (matrix * (overlap / 100))) + 10
+            width_grid = int(TILE_SIZE[0] * (matrix * (overlap / 100))) + 1
+            length_grid = int(TILE_SIZE[1] * (matrix * (overlap / 100))) + 10
 
-        gm = GridMovement(x=0, y=0, img_size=IMAGE_SIZE, x_lim=(0, 80000), y_lim=(0, 80000))
+        gm = GridMovement(x=0, y=0, img_size=TILE_SIZE, x_lim=(0, 80000), y_lim=(0, 80000))
         gm.course = Course().V_RIGHT
         # grid = gm.get_grid(start_pt=(0, 0), final_pt=(width_grid, length_grid),
         #                    percentage_non_overlap=(overlap / 100, overlap / 100))
@@ -146,10 +149,14 @@ class MainWindow(QMainWindow):
 
 class GridVerification(QWidget):
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, tile_size: typing.Tuple[float, float] = TILE_SIZE):
+        """
+        :param tile_size: footprint of a tile in the stage (in µm), the field of view of the objective.
+        """
         super().__init__()
         self.current_lens = None
         self.parent = parent
+        self.tile_size = tile_size
 
         self.setMinimumWidth(300)
         self.setMinimumHeight(300)
@@ -199,7 +206,7 @@ class GridVerification(QWidget):
     def grid(self, value):
         self._grid = value
         if self._grid is not None:
-            bounding_rect = list(get_bounding_rec_grid(grid=self._grid, img_size=IMAGE_SIZE))
+            bounding_rect = list(get_bounding_rec_grid(grid=self._grid, img_size=self.tile_size))
             self.draw_grid(bounding_rect)
             # self.draw_lens()
             # self.move_rectangle(counter=0)
@@ -217,7 +224,7 @@ class GridVerification(QWidget):
         grid_layer = QGraphicsItemGroup()
         grid_layer.setData(0, "grid")
         for point in self._grid:
-            rec = GraphicsCellItem(point[0], point[1], IMAGE_SIZE[0], IMAGE_SIZE[1])
+            rec = GraphicsCellItem(point[0], point[1], self.tile_size[0], self.tile_size[1])
             grid_layer.addToGroup(rec)
 
         self.replace_grid_layer_in_scene(new_grid_layer=grid_layer)
@@ -251,7 +258,7 @@ class GridVerification(QWidget):
 
         """
         start_pt_x, start_pt_y = self._grid[0]
-        self.current_lens = GraphicsLensItem(QRectF(start_pt_x, start_pt_y, IMAGE_SIZE[0], IMAGE_SIZE[1]),
+        self.current_lens = GraphicsLensItem(QRectF(start_pt_x, start_pt_y, self.tile_size[0], self.tile_size[1]),
                                              name="current")
 
         self.scene.addItem(self.current_lens)
@@ -284,7 +291,8 @@ class GridVerification(QWidget):
 
         if counter != 0:
             new_rectangle = GraphicsLensItem(
-                QRectF(self._grid[counter - 1][0], self._grid[counter - 1][1], IMAGE_SIZE[0], IMAGE_SIZE[1]),
+                QRectF(self._grid[counter - 1][0], self._grid[counter - 1][1], self.tile_size[0],
+                       self.tile_size[1]),
                 name="old")
             new_rectangle.setZValue(1)
 
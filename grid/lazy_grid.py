@@ -0,0 +1,117 @@
+from typing import Tuple, Iterator, Sequence, Union
+
+import numpy as np
+
+from grid.scan_order import TOP_LEFT
+
+# number of positions computed at once when iterating over a lazy grid
+DEFAULT_CHUNK_SIZE = 4096
+
+
+class LazyGrid:
+    def __init__(self, origin: Tuple[int, int], matrix: Tuple[int, int], step: Tuple[float, float],
+                 by_rows: bool = False, corner: Tuple[bool, bool] = TOP_LEFT):
+        """
+        Serpentine grid defined by its parameters only: the positions are computed on demand (length, bounds, random
+        access, chunked iteration) so the memory does not depend on the size of the matrix. It gives the same positions
+        as get_serpentine_grid / Serpentine.get_positions.
+        :param origin: position of the top left tile.
+        :param matrix: number of tiles (columns, rows).
+        :param step: distance between two neighbouring tiles along x and y, it may be fractional (exact pitch of an
+                     objective, see grid.scan_order.get_tile_positions).
+        :param by_rows: if False, the columns are scanned one after the other, otherwise the rows.
+        :param corner: entry corner, the course is mirrored so it starts from this corner.
+        """
+        self.origin = (int(origin[0]), int(origin[1]))
+        self.matrix = (int(matrix[0]), int(matrix[1]))
+        self.step = (float(step[0]), float(step[1]))
+        self.by_rows = by_rows
+        self.corner = corner
+
+    def __len__(self) -> int:
+        return self.matrix[0] * self.matrix[1]
+
+    def get_positions(self, indices: Union[Sequence[int], np.ndarray]) -> np.ndarray:
+        """
+        :param indices: indices of the tiles in visiting order (negative indices count from the end).
+        :return: (len(indices), 2) int32 array of the tile positions.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if np.any((indices < -len(self)) | (indices >= len(self))):
+            raise IndexError("Grid index out of range")
+        indices = indices % max(len(self), 1)
+
+        columns, rows = self.matrix
+        inner = columns if self.by_rows else rows
+        outer_indices, inner_indices = np.divmod(indices, inner)
+        # every other line is scanned backwards
+        inner_indices = np.where(outer_indices % 2 == 1, inner - 1 - inner_indices, inner_indices)
+        column_indices, row_indices = (inner_indices, outer_indices) if self.by_rows else (outer_indices, inner_indices)
+        if self.corner[0]:
+            column_indices = columns - 1 - column_indices
+        if self.corner[1]:
+            row_indices = rows - 1 - row_indices
+
+        positions = np.empty((len(indices), 2), dtype=np.int32)
+        positions[:, 0] = self.origin[0] + np.rint(column_indices * self.step[0])
+        positions[:, 1] = self.origin[1] + np.rint(row_indices * self.step[1])
+        return positions
+
+    def __getitem__(self, item) -> np.ndarray:
+        """
+        :param item: index (returns one (2,) position), slice or array of indices (returns (N, 2) positions).
+        """
+        if isinstance(item, slice):
+            return self.get_positions(np.arange(*item.indices(len(self))))
+        if np.ndim(item) == 0:
+            return self.get_positions([item])[0]
+        return self.get_positions(item)
+
+    def iter_chunks(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[np.ndarray]:
+        """
+        :return: iterator over (chunk_size, 2) int32 arrays of consecutive positions.
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self.get_positions(np.arange(start, min(start + chunk_size, len(self))))
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        positions = self.to_array()
+        return positions if dtype is None else positions.astype(dtype)
+
+    def to_array(self) -> np.ndarray:
+        """
+        :return: (N, 2) int32 array of all the positions (materialized).
+        """
+        return self.get_positions(np.arange(len(self)))
+
+    @property
+    def bounds(self) -> Tuple[int, int, int, int]:
+        """
+        :return: (x min, y min, x max, y max) of the tile positions.
+        """
+        x_last = self.origin[0] + int(np.rint((self.matrix[0] - 1) * self.step[0]))
+        y_last = self.origin[1] + int(np.rint((self.matrix[1] - 1) * self.step[1]))
+        return min(self.origin[0], x_last), min(self.origin[1], y_last), max(self.origin[0], x_last), \
+            max(self.origin[1], y_last)
+
+    def translate(self, dx: int, dy: int) -> "LazyGrid":
+        """
+        :return: the same grid moved by (dx, dy), without computing any position.
+        """
+        return LazyGrid(origin=(self.origin[0] + dx, self.origin[1] + dy), matrix=self.matrix, step=self.step,
+                        by_rows=self.by_rows, corner=self.corner)
+
+    def translate_to(self, start_pt: Tuple[int, int]) -> "LazyGrid":
+        """
+        :return: the same grid moved so its first tile is at start_pt.
+        """
+        first_x, first_y = self[0]
+        return self.translate(int(start_pt[0]) - int(first_x), int(start_pt[1]) - int(first_y))
+
+    def __repr__(self):
+        return "LazyGrid(origin={}, matrix={}, step={}, by_rows={}, corner={})".format(
+            self.origin, self.matrix, self.step, self.by_rows, self.corner)
@@ -0,0 +1,239 @@
+import math
+from typing import Tuple, List, Union, Sequence
+
+import numpy as np
+
+from grid.roi import MaskROI
+from grid.scan_order import Serpentine
+from hardware_constants import SLIDE_WIDTH, SLIDE_HEIGHT, SPACE_BETWEEN_SLIDES
+from objectives import OBJECTIVES, ObjectiveProfile
+
+# low magnification objective of the overview pre-scan
+OVERVIEW_OBJECTIVE = OBJECTIVES["x4"]
+# size of a pixel of the overview mosaic in the stage (in µm)
+OVERVIEW_PIXEL_SIZE = 50
+# minimal tissue score (darkness / saturation, or local standard deviation for the texture method) accepted as
+# threshold: on an empty slide, Otsu would split the noise of the background in two classes
+MIN_TISSUE_SCORE = 0.08
+MIN_TISSUE_TEXTURE = 0.02
+TISSUE_DETECTION_METHODS = ("threshold", "texture")
+
+
+def get_slide_rect(slide_index: int) -> Tuple[int, int, int, int]:
+    """
+    :param slide_index: index of the slide on the stage (0 to 3, from the left).
+    :return: (x min, y min, x max, y max) of the slide in the stage (in µm).
+    """
+    x_min = slide_index * (SLIDE_WIDTH + SPACE_BETWEEN_SLIDES)
+    return x_min, 0, x_min + SLIDE_WIDTH, SLIDE_HEIGHT
+
+
+def get_overview_positions(rect: Sequence[float], objective: ObjectiveProfile = OVERVIEW_OBJECTIVE) -> np.ndarray:
+    """
+    Coarse grid covering a rectangle with the overview objective (its overlap is 0: the images are side by side, the
+    overview is only used to find the sample).
+    :param rect: (x min, y min, x max, y max) of the area to cover (in µm).
+    :param objective: profile of the overview objective, its pitch is the step of the grid.
+    :return: (N, 2) int32 array of the positions in serpentine order.
+    """
+    matrix = objective.get_matrix((rect[2] - rect[0], rect[3] - rect[1]))
+    return Serpentine(by_rows=False).get_positions(origin=(int(rect[0]), int(rect[1])), matrix=matrix,
+                                                   step=objective.pitch)
+
+
+def get_gray_and_saturation(frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param frame: (height, width) gray or (height, width, 3 or 4) color image (values in [0, 255]), the order of the
+                  color channels does not matter (BGR, RGBA...).
+    :return: brightness and saturation (max - min of the channels) of each pixel as float32 arrays in [0, 1].
+    """
+    frame = np.asarray(frame, dtype=np.float32) / 255
+    if frame.ndim == 2:
+        return frame, np.zeros_like(frame)
+    channels = frame[..., :3]
+    maximum = channels.max(axis=2)
+    return channels.mean(axis=2), maximum - channels.min(axis=2)
+
+
+def block_reduce(image: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Downsample an image (gray or color) by averaging blocks of factor x factor pixels (the last incomplete blocks are
+    dropped).
+    """
+    if factor <= 1:
+        return image
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    image = image[:height * factor, :width * factor]
+    return image.reshape(height, factor, width, factor, *image.shape[2:]).mean(axis=(1, 3), dtype=np.float32)
+
+
+def box_sum(image: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Sum of each (2 * radius + 1) x (2 * radius + 1) window (clipped on the borders) with a summed-area table.
+    """
+    height, width = image.shape
+    integral = np.zeros((height + 1, width + 1), dtype=np.float64)
+    integral[1:, 1:] = np.asarray(image, dtype=np.float64).cumsum(axis=0).cumsum(axis=1)
+    rows = np.arange(height)
+    columns = np.arange(width)
+    top = np.clip(rows - radius, 0, height)[:, np.newaxis]
+    bottom = np.clip(rows + radius + 1, 0, height)[:, np.newaxis]
+    left = np.clip(columns - radius, 0, width)[np.newaxis, :]
+    right = np.clip(columns + radius + 1, 0, width)[np.newaxis, :]
+    return integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+
+
+def otsu_threshold(values: np.ndarray, bins: int = 256) -> float:
+    """
+    Threshold maximizing the between-class variance of the values (Otsu).
+    """
+    histogram, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight_low = np.cumsum(histogram)
+    weight_high = weight_low[-1] - weight_low
+    sum_low = np.cumsum(histogram * centers)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_low = sum_low / weight_low
+        mean_high = (sum_low[-1] - sum_low) / weight_high
+        between_variance = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return float(edges[np.nanargmax(between_variance) + 1])
+
+
+def detect_tissue(gray: np.ndarray, saturation: np.ndarray, method: str = "threshold", window: int = 2,
+                  despeckle: int = 1, margin: int = 1) -> np.ndarray:
+    """
+    Segment the sample from the bright background of a brightfield overview.
+    :param gray: brightness of the pixels in [0, 1].
+    :param saturation: saturation of the pixels in [0, 1] (stained tissue is colored, the background is not).
+    :param method: "threshold": Otsu threshold on the darkness / saturation of the pixels, "texture": Otsu threshold on
+                   the local standard deviation of the brightness (for weakly stained samples).
+    :param window: radius (in pixels) of the window of the texture measure.
+    :param despeckle: radius (in pixels) of the opening removing the dust and the isolated pixels (0 to keep them).
+    :param margin: dilation (in pixels) of the detected tissue so its edges are not missed (0 to disable).
+    :return: boolean mask, True on the sample.
+    """
+    if method == "threshold":
+        score = np.maximum(1 - gray, saturation)
+        min_score = MIN_TISSUE_SCORE
+    elif method == "texture":
+        area = box_sum(np.ones_like(gray), window)
+        mean = box_sum(gray, window) / area
+        score = np.sqrt(np.maximum(box_sum(gray * gray, window) / area - mean * mean, 0))
+        min_score = MIN_TISSUE_TEXTURE
+    else:
+        raise ValueError("Unknown tissue detection method {}, expected one of {}".format(
+            method, TISSUE_DETECTION_METHODS))
+
+    mask = score > max(otsu_threshold(score), min_score)
+    if despeckle > 0:
+        area = box_sum(np.ones(mask.shape), despeckle)
+        eroded = box_sum(mask.astype(np.float64), despeckle) == area
+        mask = box_sum(eroded.astype(np.float64), despeckle) > 0
+    if margin > 0:
+        mask = box_sum(mask.astype(np.float64), margin) > 0
+    return mask
+
+
+class OverviewMosaic:
+    def __init__(self, rect: Sequence[float], pixel_size: float = OVERVIEW_PIXEL_SIZE):
+        """
+        Low resolution picture of an area of the stage (a slide) built from the frames of the overview pre-scan.
+        :param rect: (x min, y min, x max, y max) of the area (in µm).
+        :param pixel_size: size of a pixel of the mosaic in the stage (in µm).
+        """
+        self.origin = (rect[0], rect[1])
+        self.pixel_size = pixel_size
+        shape = (math.ceil((rect[3] - rect[1]) / pixel_size), math.ceil((rect[2] - rect[0]) / pixel_size))
+        # NaN where no frame was received
+        self.gray = np.full(shape, np.nan, dtype=np.float32)
+        self.saturation = np.full(shape, np.nan, dtype=np.float32)
+
+    @property
+    def coverage(self) -> float:
+        """
+        Fraction of the mosaic covered by the received frames.
+        """
+        return float(np.mean(~np.isnan(self.gray)))
+
+    def add_frame(self, position: Sequence[float], frame: np.ndarray,
+                  image_size: Tuple[float, float] = OVERVIEW_OBJECTIVE.field_of_view) -> None:
+        """
+        :param position: position of the stage when the frame was taken (top left corner of the field of view).
+        :param frame: image of the camera (see get_gray_and_saturation).
+        :param image_size: field of view of the frame in the stage (in µm).
+        """
+        height, width = self.gray.shape
+        first_column = math.floor((position[0] - self.origin[0]) / self.pixel_size)
+        first_row = math.floor((position[1] - self.origin[1]) / self.pixel_size)
+        nb_columns = max(1, round(image_size[0] / self.pixel_size))
+        nb_rows = max(1, round(image_size[1] / self.pixel_size))
+
+        columns = np.arange(first_column, first_column + nb_columns)
+        rows = np.arange(first_row, first_row + nb_rows)
+        kept_columns = (columns >= 0) & (columns < width)
+        kept_rows = (rows >= 0) & (rows < height)
+        if not kept_columns.any() or not kept_rows.any():
+            return
+
+        # average the camera pixels falling in the same mosaic pixel, then pick the nearest block
+        factor = max(1, min(frame.shape[1] // nb_columns, frame.shape[0] // nb_rows))
+        gray, saturation = get_gray_and_saturation(block_reduce(frame, factor))
+        frame_columns = (np.arange(nb_columns) * gray.shape[1] // nb_columns)[kept_columns]
+        frame_rows = (np.arange(nb_rows) * gray.shape[0] // nb_rows)[kept_rows]
+
+        target = np.ix_(rows[kept_rows], columns[kept_columns])
+        source = np.ix_(frame_rows, frame_columns)
+        self.gray[target] = gray[source]
+        self.saturation[target] = saturation[source]
+
+    def get_tissue_roi(self, method: str = "threshold", **kwargs) -> Union[None, MaskROI]:
+        """
+        :param method: tissue detection method (see detect_tissue), the other keyword arguments are given to it.
+        :return: ROI of the sample in stage coordinates, None if no sample was found.
+        """
+        received = ~np.isnan(self.gray)
+        if not received.any():
+            return None
+        # the missing parts are filled with the typical value so they look like background without creating edges
+        gray = np.where(received, self.gray, np.median(self.gray[received]))
+        saturation = np.where(received, self.saturation, np.median(self.saturation[received]))
+        mask = detect_tissue(gray, saturation, method=method, **kwargs) & received
+        if not mask.any():
+            return None
+        return MaskROI(mask=mask, origin=self.origin, pixel_size=float(self.pixel_size))
+
+
+class OverviewScan:
+    def __init__(self, slide_indices: Sequence[int], objective: ObjectiveProfile = OVERVIEW_OBJECTIVE,
+                 pixel_size: float = OVERVIEW_PIXEL_SIZE):
+        """
+        Pre-scan of the slides with the low magnification objective: a coarse grid is imaged on each slide, the frames
+        are assembled into one mosaic per slide and the sample is segmented to give the ROI of the high magnification
+        grids (only the tiles on the sample are then imaged).
+        :param slide_indices: slides to scan (0 to 3).
+        :param objective: profile of the overview objective.
+        :param pixel_size: size of a pixel of the mosaics (in µm).
+        """
+        self.slide_indices = list(slide_indices)
+        self.objective = objective
+        self.mosaics = [OverviewMosaic(get_slide_rect(slide_index), pixel_size=pixel_size)
+                        for slide_index in self.slide_indices]
+
+    def get_positions(self) -> List[np.ndarray]:
+        """
+        :return: positions of the overview frames of each slide.
+        """
+        return [get_overview_positions(get_slide_rect(slide_index), objective=self.objective)
+                for slide_index in self.slide_indices]
+
+    def add_frame(self, slide_number: int, position: Sequence[float], frame: np.ndarray) -> None:
+        """
+        :param slide_number: index of the slide in slide_indices.
+        """
+        self.mosaics[slide_number].add_frame(position, frame, image_size=self.objective.field_of_view)
+
+    def get_rois(self, method: str = "threshold", **kwargs) -> List[Union[None, MaskROI]]:
+        """
+        :return: ROI of the sample of each slide (None if the slide is empty).
+        """
+        return [mosaic.get_tissue_roi(method=method, **kwargs) for mosaic in self.mosaics]
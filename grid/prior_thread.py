@@ -1,6 +1,5 @@
 from time import sleep
 from threading import Thread, Event
-from app.ui import locked_thread, lock
 from main import PriorController
 
 
@@ -28,20 +27,14 @@ class RefreshPriorCoordsThread(Thread):
     def stop(self):
         self.running = False
 
-    # @locked_thread
     def get_coords(self):
-        lock.acquire(blocking=True)
-        response_coords = self.prior.coords
-        # print("get coords")
-        # print(response_coords)
-        lock.release()
-        try:
-            return [int(x) for x in response_coords.split(",")]
-
-        except:
+        # PriorController.query serializes the commands (I/O engine or lock of the controller): no global lock needed
+        position = self.prior.get_position()
+        if position is None:
             # if we raise an error, we return the previous coordinates value
-            print("error with report_xyz_values function / coords value = {}".format(response_coords))
+            print("error with report_xyz_values function / no position received")
             return self.coords
+        return list(position)
 
 
 
@@ -0,0 +1,170 @@
+import hashlib
+import math
+from typing import Tuple, Union, Sequence
+
+import numpy as np
+
+# pixels per tile side used to rasterize a polygon ROI
+POLYGON_RASTER_RESOLUTION = 8
+
+
+class MaskROI:
+    def __init__(self, mask: np.ndarray, origin: Tuple[float, float] = (0, 0),
+                 pixel_size: Union[float, Tuple[float, float]] = 1.):
+        """
+        Region of interest given by a binary image in stage coordinates (sample / background segmentation...).
+        :param mask: (height, width) boolean array, True on the sample. mask[row, column] covers the stage area
+                     [x0 + column * pixel width, x0 + (column + 1) * pixel width) x [y0 + row * pixel height, ...).
+        :param origin: stage position (x0, y0) of the top left corner of the mask (in µm).
+        :param pixel_size: size of a pixel of the mask in the stage (in µm), same along both axes or (width, height).
+        """
+        self.mask = np.asarray(mask, dtype=bool)
+        self.origin = origin
+        self.pixel_size = pixel_size if isinstance(pixel_size, tuple) else (pixel_size, pixel_size)
+        # summed-area table: number of ROI pixels in any rectangle with 4 lookups, built for the mask of _integral_key
+        self._integral = None
+        self._integral_key = None
+
+    @property
+    def key(self) -> Tuple:
+        """
+        Hashable summary of the content of the ROI (cache key): it changes when the mask is edited in place, and it
+        does not keep the mask alive.
+        """
+        digest = hashlib.blake2b(np.packbits(self.mask), digest_size=16).digest()
+        return "mask", self.mask.shape, tuple(self.origin), self.pixel_size, digest
+
+    @property
+    def bounding_box(self) -> Union[None, Tuple[float, float, float, float]]:
+        """
+        :return: (x min, y min, x max, y max) of the ROI in the stage, None if the mask is empty.
+        """
+        rows = np.flatnonzero(self.mask.any(axis=1))
+        columns = np.flatnonzero(self.mask.any(axis=0))
+        if len(rows) == 0:
+            return None
+        return (self.origin[0] + columns[0] * self.pixel_size[0], self.origin[1] + rows[0] * self.pixel_size[1],
+                self.origin[0] + (columns[-1] + 1) * self.pixel_size[0],
+                self.origin[1] + (rows[-1] + 1) * self.pixel_size[1])
+
+    def get_integral(self) -> np.ndarray:
+        """
+        :return: summed-area table of the mask, built again if the mask was edited in place.
+        """
+        key = self.key
+        if key != self._integral_key:
+            self._integral = np.zeros((self.mask.shape[0] + 1, self.mask.shape[1] + 1), dtype=np.int64)
+            self._integral[1:, 1:] = self.mask.cumsum(axis=0).cumsum(axis=1)
+            self._integral_key = key
+        return self._integral
+
+    def intersects(self, x: np.ndarray, y: np.ndarray, width: float, height: float) -> np.ndarray:
+        """
+        Vectorized test of the rectangles [x, x + width) x [y, y + height) against the ROI.
+        :param x: array of the left sides of the rectangles (in µm).
+        :param y: array of the top sides of the rectangles (in µm), same shape as x.
+        :return: boolean array (shape of x), True if the rectangle contains at least one pixel of the ROI.
+        """
+        height_px, width_px = self.mask.shape
+        first_column = np.clip(np.floor((x - self.origin[0]) / self.pixel_size[0]), 0, width_px).astype(np.int64)
+        last_column = np.clip(np.ceil((x + width - self.origin[0]) / self.pixel_size[0]), 0, width_px).astype(np.int64)
+        first_row = np.clip(np.floor((y - self.origin[1]) / self.pixel_size[1]), 0, height_px).astype(np.int64)
+        last_row = np.clip(np.ceil((y + height - self.origin[1]) / self.pixel_size[1]), 0, height_px).astype(np.int64)
+        integral = self.get_integral()
+        counts = integral[last_row, last_column] - integral[first_row, last_column] - \
+            integral[last_row, first_column] + integral[first_row, first_column]
+        return counts > 0
+
+
+class PolygonROI:
+    def __init__(self, vertices: Sequence[Tuple[float, float]]):
+        """
+        Region of interest given by a polygon in stage coordinates.
+        :param vertices: (x, y) vertices of the polygon (in µm), the last one is linked to the first one.
+        """
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+
+    @property
+    def key(self) -> Tuple:
+        """
+        Hashable summary of the content of the ROI (cache key), see MaskROI.key.
+        """
+        return "polygon", self.vertices.shape, self.vertices.tobytes()
+
+    @property
+    def bounding_box(self) -> Tuple[float, float, float, float]:
+        x_min, y_min = self.vertices.min(axis=0)
+        x_max, y_max = self.vertices.max(axis=0)
+        return x_min, y_min, x_max, y_max
+
+    def to_mask(self, pixel_size: float) -> MaskROI:
+        """
+        Rasterize the polygon (even-odd rule on the pixel centers, one scanline per row of pixels). The pixels holding
+        a vertex are also set so that features thinner than a pixel are not lost.
+        :param pixel_size: size of a pixel of the mask (in µm).
+        """
+        x_min, y_min, x_max, y_max = self.bounding_box
+        width = max(1, math.ceil((x_max - x_min) / pixel_size))
+        height = max(1, math.ceil((y_max - y_min) / pixel_size))
+
+        x0, y0 = self.vertices[:, 0], self.vertices[:, 1]
+        x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+        centers_y = y_min + (np.arange(height)[:, np.newaxis] + 0.5) * pixel_size
+
+        # (rows, edges): edges crossed by the scanline of each row
+        crossed = ((y0 <= centers_y) & (y1 > centers_y)) | ((y1 <= centers_y) & (y0 > centers_y))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing_x = x0 + (centers_y - y0) / (y1 - y0) * (x1 - x0)
+        rows, edges = np.nonzero(crossed)
+        # first pixel whose center is on the right of the crossing
+        columns = np.clip(np.ceil((crossing_x[rows, edges] - x_min) / pixel_size - 0.5), 0, width).astype(np.int64)
+        toggles = np.zeros((height, width + 1), dtype=np.int32)
+        np.add.at(toggles, (rows, columns), 1)
+        mask = (np.cumsum(toggles, axis=1)[:, :width] & 1).astype(bool)
+
+        vertex_columns = np.clip(((x0 - x_min) / pixel_size).astype(np.int64), 0, width - 1)
+        vertex_rows = np.clip(((y0 - y_min) / pixel_size).astype(np.int64), 0, height - 1)
+        mask[vertex_rows, vertex_columns] = True
+        return MaskROI(mask=mask, origin=(x_min, y_min), pixel_size=pixel_size)
+
+
+def get_roi_matrix(roi: Union[MaskROI, PolygonROI], step: Tuple[int, int], tile_size: Tuple[int, int],
+                   origin: Union[None, Tuple[int, int]] = None) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    Smallest matrix of tiles covering the bounding box of the ROI.
+    :param step: distance between two neighbouring tiles along x and y.
+    :param tile_size: footprint of a tile (image size).
+    :param origin: position of a tile the grid has to be aligned with, the top left corner of the ROI if None.
+    :return: position of the top left tile, number of tiles (columns, rows).
+    :raise ValueError: the ROI is empty (mask without any pixel set).
+    """
+    bounding_box = roi.bounding_box
+    if bounding_box is None:
+        raise ValueError("The ROI is empty: there is no tile to image")
+    x_min, y_min, x_max, y_max = bounding_box
+    if origin is None:
+        origin = (int(math.floor(x_min)), int(math.floor(y_min)))
+    else:
+        # first tile of the aligned grid whose footprint reaches the ROI
+        origin = tuple(int(origin[axis] + math.floor((bound - tile_size[axis] - origin[axis]) / step[axis] + 1) *
+                           step[axis]) for axis, bound in enumerate((x_min, y_min)))
+    matrix = tuple(max(1, math.ceil((bound - tile_size[axis] - origin[axis]) / step[axis]) + 1)
+                   for axis, bound in enumerate((x_max, y_max)))
+    return origin, matrix
+
+
+def get_tile_mask(roi: Union[MaskROI, PolygonROI], origin: Tuple[int, int], matrix: Tuple[int, int],
+                  step: Tuple[int, int], tile_size: Tuple[int, int]) -> np.ndarray:
+    """
+    :param origin: position of the top left tile.
+    :param matrix: number of tiles (columns, rows).
+    :param step: distance between two neighbouring tiles along x and y.
+    :param tile_size: footprint of a tile (image size).
+    :return: (columns, rows) boolean array, True for the tiles whose footprint intersects the ROI.
+    """
+    if isinstance(roi, PolygonROI):
+        roi = roi.to_mask(pixel_size=min(tile_size) / POLYGON_RASTER_RESOLUTION)
+    x = origin[0] + np.arange(matrix[0])[:, np.newaxis] * step[0]
+    y = origin[1] + np.arange(matrix[1])[np.newaxis, :] * step[1]
+    x, y = np.broadcast_arrays(x, y)
+    return roi.intersects(x, y, tile_size[0], tile_size[1])
@@ -0,0 +1,266 @@
+from typing import Tuple, List, Union, Sequence
+
+import numpy as np
+
+from motion_model import StageKinematics
+
+# entry corners of a grid: (x reversed, y reversed)
+TOP_LEFT = (False, False)
+TOP_RIGHT = (True, False)
+BOTTOM_LEFT = (False, True)
+BOTTOM_RIGHT = (True, True)
+CORNERS = (TOP_LEFT, TOP_RIGHT, BOTTOM_LEFT, BOTTOM_RIGHT)
+
+
+def get_serpentine_indices(matrix: Tuple[int, int], by_rows: bool = False) -> np.ndarray:
+    """
+    :param matrix: number of tiles (columns, rows).
+    :param by_rows: if False, the columns are scanned one after the other (down, up, down...), otherwise the rows
+                    (right, left, right...).
+    :return: (columns * rows, 2) int32 array of the (column, row) indices of the tiles in visiting order.
+    """
+    columns, rows = matrix
+    outer, inner = (rows, columns) if by_rows else (columns, rows)
+
+    inner_indices = np.tile(np.arange(inner, dtype=np.int32), (outer, 1))
+    # every other line is scanned backwards
+    inner_indices[1::2] = inner_indices[1::2, ::-1]
+
+    indices = np.empty((outer * inner, 2), dtype=np.int32)
+    outer_axis, inner_axis = (1, 0) if by_rows else (0, 1)
+    indices[:, outer_axis] = np.repeat(np.arange(outer, dtype=np.int32), inner)
+    indices[:, inner_axis] = inner_indices.ravel()
+    return indices
+
+
+def get_tile_positions(indices: np.ndarray, origin: Sequence[float], step: Sequence[float]) -> np.ndarray:
+    """
+    :param indices: (N, 2) int32 (column, row) indices of the tiles, modified in place when the step is an integer.
+    :param origin: position of the tile (0, 0).
+    :param step: distance between two neighbouring tiles along x and y, it may be fractional (exact pitch of an
+                 objective): each position is then rounded on its own so the rounding error does not add up.
+    :return: (N, 2) int32 positions of the tiles.
+    """
+    if all(float(value).is_integer() for value in tuple(step) + tuple(origin)):
+        indices *= np.array(step, dtype=np.int32)
+        indices += np.array(origin, dtype=np.int32)
+        return indices
+    return (np.rint(indices * np.array(step, dtype=np.float64)) + np.rint(np.array(origin, dtype=np.float64))) \
+        .astype(np.int32)
+
+
+class ScanOrder:
+    """
+    Strategy giving the visiting order of the tiles of a grid. Subclasses implement get_indices.
+    """
+    name = None
+    # False if the course does not depend on the entry corner (it starts from the center...)
+    uses_corner = True
+
+    def get_indices(self, matrix: Tuple[int, int]) -> np.ndarray:
+        """
+        :param matrix: number of tiles (columns, rows).
+        :return: (N, 2) int32 array of the (column, row) indices of the tiles in visiting order, starting from the top
+                 left corner.
+        """
+        raise NotImplementedError
+
+    def get_positions(self, origin: Tuple[int, int], matrix: Tuple[int, int], step: Tuple[int, int],
+                      corner: Tuple[bool, bool] = TOP_LEFT, tile_mask: Union[None, np.ndarray] = None) -> np.ndarray:
+        """
+        :param origin: position of the top left tile.
+        :param matrix: number of tiles (columns, rows).
+        :param step: distance between two neighbouring tiles along x and y.
+        :param corner: entry corner: the course is mirrored so it starts from this corner.
+        :param tile_mask: (columns, rows) boolean array of the tiles to image (see grid.roi), all the tiles if None.
+                          The other tiles are skipped without changing the order of the remaining ones.
+        :return: (N, 2) int32 array of the tile positions in visiting order.
+        """
+        indices = self.get_indices(matrix)
+        for axis, reversed_axis in enumerate(corner):
+            if reversed_axis and self.uses_corner:
+                indices[:, axis] = matrix[axis] - 1 - indices[:, axis]
+        if tile_mask is not None:
+            indices = indices[tile_mask[indices[:, 0], indices[:, 1]]]
+        return get_tile_positions(indices, origin=origin, step=step)
+
+    def __repr__(self):
+        return "{name}()".format(name=type(self).__name__)
+
+
+class Serpentine(ScanOrder):
+    def __init__(self, by_rows: bool = False):
+        """
+        Boustrophedon course: columns scanned down, up, down... (or rows right, left, right... if by_rows).
+        """
+        self.by_rows = by_rows
+        self.name = "row serpentine" if by_rows else "column serpentine"
+
+    def get_indices(self, matrix: Tuple[int, int]) -> np.ndarray:
+        return get_serpentine_indices(matrix=matrix, by_rows=self.by_rows)
+
+    def __repr__(self):
+        return "Serpentine(by_rows={})".format(self.by_rows)
+
+
+class Raster(ScanOrder):
+    def __init__(self, by_rows: bool = False):
+        """
+        Unidirectional course: every column is scanned downwards (or every row rightwards if by_rows) with a return
+        move between two lines. Slower than the serpentine but each tile is approached from the same direction, so the
+        backlash of the stage does not shift one line out of two.
+        """
+        self.by_rows = by_rows
+        self.name = "row raster" if by_rows else "column raster"
+
+    def get_indices(self, matrix: Tuple[int, int]) -> np.ndarray:
+        columns, rows = matrix
+        outer, inner = (rows, columns) if self.by_rows else (columns, rows)
+        outer_axis, inner_axis = (1, 0) if self.by_rows else (0, 1)
+        indices = np.empty((outer * inner, 2), dtype=np.int32)
+        indices[:, outer_axis] = np.repeat(np.arange(outer, dtype=np.int32), inner)
+        indices[:, inner_axis] = np.tile(np.arange(inner, dtype=np.int32), outer)
+        return indices
+
+    def __repr__(self):
+        return "Raster(by_rows={})".format(self.by_rows)
+
+
+class Spiral(ScanOrder):
+    """
+    Square spiral starting from the central tile: the center of the sample is imaged first, so the focus can be
+    established there before moving to the edges.
+    """
+    name = "spiral"
+    uses_corner = False
+
+    def get_indices(self, matrix: Tuple[int, int]) -> np.ndarray:
+        columns, rows = matrix
+        center_x, center_y = (columns - 1) // 2, (rows - 1) // 2
+        nb_rings = max(center_x, columns - 1 - center_x, center_y, rows - 1 - center_y)
+
+        rings = [np.array([[center_x, center_y]], dtype=np.int32)]
+        for ring in range(1, nb_rings + 1):
+            side = np.arange(2 * ring, dtype=np.int32)
+            left, right = center_x - ring, center_x + ring
+            top, bottom = center_y - ring, center_y + ring
+            rings.append(np.concatenate([
+                np.stack([np.full_like(side, right), top + 1 + side], axis=1),  # down the right side
+                np.stack([right - 1 - side, np.full_like(side, bottom)], axis=1),  # left along the bottom side
+                np.stack([np.full_like(side, left), bottom - 1 - side], axis=1),  # up the left side
+                np.stack([left + 1 + side, np.full_like(side, top)], axis=1),  # right along the top side
+            ]))
+        indices = np.concatenate(rings)
+        inside = (indices[:, 0] >= 0) & (indices[:, 0] < columns) & (indices[:, 1] >= 0) & (indices[:, 1] < rows)
+        return np.ascontiguousarray(indices[inside])
+
+
+def _sign(value: int) -> int:
+    return (value > 0) - (value < 0)
+
+
+def _fill_gilbert(indices: List[Tuple[int, int]], x: int, y: int, ax: int, ay: int, bx: int, by: int) -> None:
+    """
+    Generalized Hilbert curve ("gilbert", J. Cervený) of the rectangle starting at (x, y) with major axis (ax, ay) and
+    minor axis (bx, by): the rectangle is split like a Hilbert square, the odd splits being shifted by one tile so
+    every sub-rectangle keeps an even side when possible.
+    :param indices: list the (column, row) indices of the tiles are appended to, in visiting order.
+    """
+    width, height = abs(ax + ay), abs(bx + by)
+    dax, day = _sign(ax), _sign(ay)
+    dbx, dby = _sign(bx), _sign(by)
+
+    if height == 1:
+        indices.extend((x + i * dax, y + i * day) for i in range(width))
+        return
+    if width == 1:
+        indices.extend((x + i * dbx, y + i * dby) for i in range(height))
+        return
+
+    ax2, ay2 = ax // 2, ay // 2
+    bx2, by2 = bx // 2, by // 2
+    if 2 * width > 3 * height:
+        # long rectangle: split in two along the major axis
+        if abs(ax2 + ay2) % 2 and width > 2:
+            ax2, ay2 = ax2 + dax, ay2 + day
+        _fill_gilbert(indices, x, y, ax2, ay2, bx, by)
+        _fill_gilbert(indices, x + ax2, y + ay2, ax - ax2, ay - ay2, bx, by)
+    else:
+        # up the first half of the minor axis, along the major axis, back down
+        if abs(bx2 + by2) % 2 and height > 2:
+            bx2, by2 = bx2 + dbx, by2 + dby
+        _fill_gilbert(indices, x, y, bx2, by2, ax2, ay2)
+        _fill_gilbert(indices, x + bx2, y + by2, ax, ay, bx - bx2, by - by2)
+        _fill_gilbert(indices, x + (ax - dax) + (bx2 - dbx), y + (ay - day) + (by2 - dby), -bx2, -by2,
+                      -(ax - ax2), -(ay - ay2))
+
+
+class Hilbert(ScanOrder):
+    """
+    Generalized Hilbert curve covering the rectangle of the grid directly (no clipping of a power of two square): the
+    course stays local (neighbouring regions of the sample are imaged close in time, which limits the focus and thermal
+    drifts between neighbouring tiles). Consecutive tiles are neighbours, except for a single diagonal step in some
+    grids with an odd number of columns or rows.
+    """
+    name = "hilbert"
+
+    def get_indices(self, matrix: Tuple[int, int]) -> np.ndarray:
+        columns, rows = matrix
+        indices = []
+        if columns >= rows:
+            _fill_gilbert(indices, 0, 0, columns, 0, 0, rows)
+        else:
+            _fill_gilbert(indices, 0, 0, 0, rows, columns, 0)
+        return np.array(indices, dtype=np.int32).reshape(-1, 2)
+
+
+SCAN_ORDERS = {scan_order.name: scan_order for scan_order in
+               [Serpentine(by_rows=False), Serpentine(by_rows=True), Raster(by_rows=False), Raster(by_rows=True),
+                Spiral(), Hilbert()]}
+
+
+class TravelCostModel:
+    def __init__(self, kinematics: Union[None, StageKinematics] = None, tile_time: float = 0.):
+        """
+        Estimation of the run time of a course: travel time of the stage between the tiles (speed and acceleration of
+        the axes) plus a fixed time per tile (settling, exposure...).
+        :param kinematics: travel time model of the stage.
+        :param tile_time: time spent on each tile (in s).
+        """
+        self.kinematics = StageKinematics() if kinematics is None else kinematics
+        self.tile_time = tile_time
+
+    def estimate(self, positions: np.ndarray, start_position: Union[None, Sequence] = None) -> float:
+        """
+        :param positions: (N, 2) tile positions in visiting order.
+        :param start_position: position of the stage before the first tile (None to ignore the approach).
+        :return: estimated run time (in s).
+        """
+        run_time = self.kinematics.path_time(positions) + self.tile_time * len(positions)
+        if start_position is not None and len(positions) > 0:
+            run_time += self.kinematics.move_time(start_position, positions[0])
+        return run_time
+
+
+def rank_scan_orders(origin: Tuple[int, int], matrix: Tuple[int, int], step: Tuple[int, int],
+                     cost_model: Union[None, TravelCostModel] = None,
+                     scan_orders: Union[None, Sequence[ScanOrder]] = None,
+                     start_position: Union[None, Sequence] = None,
+                     tile_mask: Union[None, np.ndarray] = None) -> List[Tuple[float, ScanOrder, Tuple]]:
+    """
+    Estimate the run time of each scan order (entered by each corner) for one grid.
+    :param scan_orders: strategies to compare, all the SCAN_ORDERS if None.
+    :param tile_mask: tiles to image (see ScanOrder.get_positions).
+    :return: list of (run time, scan order, corner) from the fastest to the slowest.
+    """
+    cost_model = TravelCostModel() if cost_model is None else cost_model
+    scan_orders = list(SCAN_ORDERS.values()) if scan_orders is None else scan_orders
+
+    ranking = []
+    for scan_order in scan_orders:
+        for corner in (CORNERS if scan_order.uses_corner else (TOP_LEFT,)):
+            positions = scan_order.get_positions(origin=origin, matrix=matrix, step=step, corner=corner,
+                                                 tile_mask=tile_mask)
+            ranking.append((cost_model.estimate(positions, start_position=start_position), scan_order, corner))
+    ranking.sort(key=lambda element: element[0])
+    return ranking
@@ -0,0 +1,151 @@
+import itertools
+from typing import Tuple, List, Union, Sequence
+
+import numpy as np
+
+from grid.scan_order import ScanOrder, Serpentine, TravelCostModel, CORNERS, TOP_LEFT
+
+# above this number of grids, the visiting order is chosen greedily instead of trying all the permutations
+MAX_EXHAUSTIVE_GRIDS = 7
+
+
+class PlannedGrid:
+    def __init__(self, index: int, corner: Tuple[bool, bool], scan_order: ScanOrder, positions: np.ndarray,
+                 travel_time: float):
+        """
+        Course chosen for one grid.
+        :param index: index of the grid given to the planner (see ScanPlanner.plan grid_indices), kept whatever the
+                      visiting order.
+        :param corner: entry corner (TOP_LEFT, TOP_RIGHT, BOTTOM_LEFT or BOTTOM_RIGHT).
+        :param scan_order: strategy ordering the tiles of the grid.
+        :param positions: (N, 2) int32 array of the tile positions in visiting order.
+        :param travel_time: estimated run time of the grid (in s).
+        """
+        self.index = index
+        self.corner = corner
+        self.scan_order = scan_order
+        self.positions = positions
+        self.travel_time = travel_time
+
+    @property
+    def entry(self) -> np.ndarray:
+        return self.positions[0]
+
+    @property
+    def exit(self) -> np.ndarray:
+        return self.positions[-1]
+
+
+class ScanPlanner:
+    def __init__(self, cost_model: Union[None, TravelCostModel] = None,
+                 scan_orders: Union[None, Sequence[ScanOrder]] = None):
+        """
+        Plan the acquisition of several grids (one per slide) to minimize the travel time of the stage: for each grid
+        the scan order and its entry corner are chosen, together with the order in which the grids are visited. The
+        costs are travel times given by the speed and acceleration of the stage, not distances: a long move is cheaper
+        than several short ones of the same total length.
+        :param cost_model: run time model of the courses.
+        :param scan_orders: strategies which can be chosen for each grid (column and row serpentines if None).
+        """
+        self.cost_model = TravelCostModel() if cost_model is None else cost_model
+        self.kinematics = self.cost_model.kinematics
+        self.scan_orders = [Serpentine(by_rows=False), Serpentine(by_rows=True)] if scan_orders is None \
+            else scan_orders
+
+    def get_candidates(self, index: int, origin: Tuple[int, int], matrix: Tuple[int, int], step: Tuple[int, int],
+                       tile_mask: Union[None, np.ndarray] = None) -> List[PlannedGrid]:
+        """
+        :return: every course of the grid (scan order and entry corner), empty if the grid has no tile to image.
+        """
+        candidates = []
+        for scan_order in self.scan_orders:
+            for corner in (CORNERS if scan_order.uses_corner else (TOP_LEFT,)):
+                positions = scan_order.get_positions(origin=origin, matrix=matrix, step=step, corner=corner,
+                                                     tile_mask=tile_mask)
+                if len(positions) == 0:
+                    return []
+                candidates.append(PlannedGrid(index=index, corner=corner, scan_order=scan_order, positions=positions,
+                                              travel_time=self.cost_model.estimate(positions)))
+        return candidates
+
+    def plan(self, origins: Sequence[Tuple[int, int]], matrices: Sequence[Tuple[int, int]], step: Tuple[int, int],
+             start_position: Tuple[int, int] = (0, 0),
+             tile_masks: Union[None, Sequence[Union[None, np.ndarray]]] = None,
+             grid_indices: Union[None, Sequence[int]] = None) -> List[PlannedGrid]:
+        """
+        :param origins: top left tile of each grid.
+        :param matrices: number of tiles (columns, rows) of each grid.
+        :param step: distance between two neighbouring tiles along x and y.
+        :param start_position: position of the stage before the acquisition.
+        :param tile_masks: tiles to image in each grid (see grid.roi.get_tile_mask), None for all the tiles. The grids
+                           without any tile to image are left out of the plan.
+        :param grid_indices: index of each grid kept on its PlannedGrid (slide or grid number of the caller), its
+                             position in origins if None.
+        :return: grids in visiting order with their courses.
+        """
+        if tile_masks is None:
+            tile_masks = [None] * len(origins)
+        if grid_indices is None:
+            grid_indices = range(len(origins))
+        candidates = [self.get_candidates(index, origin, matrix, step, tile_mask) for index, origin, matrix, tile_mask
+                      in zip(grid_indices, origins, matrices, tile_masks)]
+        candidates = [grid_candidates for grid_candidates in candidates if grid_candidates]
+        if not candidates:
+            return []
+
+        if len(candidates) <= MAX_EXHAUSTIVE_GRIDS:
+            orders = itertools.permutations(range(len(candidates)))
+        else:
+            orders = [self.get_greedy_order(candidates, start_position)]
+
+        best_plan, best_time = None, np.inf
+        for order in orders:
+            plan, travel_time = self.choose_courses([candidates[index] for index in order], start_position)
+            if travel_time < best_time:
+                best_plan, best_time = plan, travel_time
+        return best_plan
+
+    def plan_time(self, plan: Sequence[PlannedGrid], start_position: Tuple[int, int] = (0, 0)) -> float:
+        """
+        :return: total travel time of a plan (in s): moves between the grids and inside the grids.
+        """
+        travel_time = 0.
+        position = start_position
+        for planned_grid in plan:
+            travel_time += self.kinematics.move_time(position, planned_grid.entry) + planned_grid.travel_time
+            position = planned_grid.exit
+        return travel_time
+
+    def choose_courses(self, ordered_candidates: Sequence[List[PlannedGrid]], start_position: Tuple[int, int]) \
+            -> Tuple[List[PlannedGrid], float]:
+        """
+        Dynamic programming on the course of each grid for a given visiting order.
+        :param ordered_candidates: candidate courses of each grid, in visiting order.
+        :return: best course of each grid, total travel time.
+        """
+        # best (travel time, plan) ending with each candidate of the current grid
+        best = [(self.kinematics.move_time(start_position, candidate.entry) + candidate.travel_time, [candidate])
+                for candidate in ordered_candidates[0]]
+        for candidates in ordered_candidates[1:]:
+            best = [min(((travel_time + self.kinematics.move_time(plan[-1].exit, candidate.entry) +
+                          candidate.travel_time, plan + [candidate]) for travel_time, plan in best),
+                        key=lambda element: element[0])
+                    for candidate in candidates]
+        travel_time, plan = min(best, key=lambda element: element[0])
+        return plan, travel_time
+
+    def get_greedy_order(self, candidates: Sequence[List[PlannedGrid]], start_position: Tuple[int, int]) \
+            -> List[int]:
+        """
+        Visiting order going each time to the grid whose nearest corner is the fastest to reach.
+        """
+        remaining = list(range(len(candidates)))
+        order = []
+        position = start_position
+        while remaining:
+            index, course = min(((index, candidate) for index in remaining for candidate in candidates[index]),
+                                key=lambda element: self.kinematics.move_time(position, element[1].entry))
+            order.append(index)
+            remaining.remove(index)
+            position = course.exit
+        return order
@@ -7,7 +7,7 @@ from PyQt5 import QtGui, QtCore
 from PyQt5.QtCore import pyqtSignal, Qt, QSize
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QComboBox, QApplication, QSpinBox, QHBoxLayout, QPushButton, \
-    QAbstractSpinBox, QGroupBox, QMessageBox, QWidgetItem, QLayout
+    QAbstractSpinBox, QGroupBox, QMessageBox, QWidgetItem, QLayout, QCheckBox, QLineEdit, QFileDialog
 
 from app.LogoSGS import Logo
 from grid.share_serial import X_LIMIT, Y_LIMIT
@@ -22,8 +22,15 @@ def transform_matrix_text2value(matrix_text: str) -> int:
 
 
 class GridDefinition(object):
-    def __init__(self, start_position: Tuple[int, int], matrix_definition: Union[str, int]):
+    def __init__(self, start_position: Tuple[int, int], matrix_definition: Union[str, int], roi=None):
+        """
+        :param start_position: position of the top left tile.
+        :param matrix_definition: number of tiles per side of the square grid ("5 x 5" or 5).
+        :param roi: optional MaskROI / PolygonROI (grid.roi) in stage coordinates. If set, only the tiles intersecting
+                    it are imaged, the square matrix is ignored.
+        """
         self.start_position = start_position
+        self.roi = roi
 
         self.matrix_length = matrix_definition
 
@@ -211,6 +218,7 @@ class GridsHandler(QWidget):
     grids_starting_points_signal = pyqtSignal(object)
     change_matrix_signal = pyqtSignal(int)
     acquisition_status_change_signal = pyqtSignal(bool)
+    overview_request_signal = pyqtSignal()
 
     def __init__(self, parent=None):
         # self.parent = parent
@@ -240,6 +248,36 @@ class GridsHandler(QWidget):
 
         layout.addLayout(h_layout)
 
+        self.focus_map_check_box = QCheckBox("Focus map")
+        self.focus_map_check_box.setToolTip("Autofocus on a few points of each grid and predict the Z of every tile")
+        layout.addWidget(self.focus_map_check_box)
+
+        h_layout = QHBoxLayout()
+        self.output_folder_input = QLineEdit()
+        self.output_folder_input.setReadOnly(True)
+        self.output_folder_input.setPlaceholderText("Tiles not saved")
+        self.output_folder_input.setToolTip("Folder of the tiles and of the journal of the run: an unfinished run "
+                                            "saved in it is resumed at its first missing tiles")
+        h_layout.addWidget(self.output_folder_input)
+        self.output_folder_btn = QPushButton(qta.icon('mdi.folder-open', color="white"), "")
+        self.output_folder_btn.setToolTip("Choose the output folder (cancel to move without saving the tiles)")
+        h_layout.addWidget(self.output_folder_btn)
+        layout.addLayout(h_layout)
+
+        self.fly_scan_check_box = QCheckBox("Fly scan")
+        self.fly_scan_check_box.setToolTip("Sweep the columns of each grid at constant speed and take the frames on "
+                                           "the fly (needs an output folder)")
+        layout.addWidget(self.fly_scan_check_box)
+
+        self.streaming_check_box = QCheckBox("Stream motions")
+        self.streaming_check_box.setToolTip("Queue the next movements in the controller instead of sending them one "
+                                            "by one (without output folder)")
+        layout.addWidget(self.streaming_check_box)
+
+        self.overview_btn = QPushButton("Overview")
+        self.overview_btn.setToolTip("Pre-scan the slides at low magnification to place the grids on the sample")
+        layout.addWidget(self.overview_btn)
+
         self.start_btn = QPushButton("Start")
         layout.addWidget(self.start_btn)
 
@@ -258,7 +296,25 @@ class GridsHandler(QWidget):
             if isinstance(widget, GridStartPosition):
                 widget.start_position_grid_signal.connect(self.generate_one_grid)
 
+        self.output_folder_btn.clicked.connect(self.choose_output_folder)
         self.start_btn.clicked.connect(lambda: setattr(self, "on_acquisition", True))
+        self.overview_btn.clicked.connect(self.overview_request_signal.emit)
+
+    def choose_output_folder(self) -> None:
+        folder = QFileDialog.getExistingDirectory(self, "Output folder of the tiles", self.output_folder_input.text())
+        self.output_folder_input.setText(folder)
+
+    @property
+    def acquisition_options(self) -> dict:
+        """
+        Options of the acquisition chosen by the user, as keyword arguments of AcquisitionWorker: with an output
+        folder, the tiles are imaged, saved and journaled (stop and shoot or fly scan); without, the stage only moves
+        (one movement after the other or streamed).
+        """
+        output_folder = self.output_folder_input.text() or None
+        return {"output_folder": output_folder,
+                "fly_scan": output_folder is not None and self.fly_scan_check_box.isChecked(),
+                "streaming": output_folder is None and self.streaming_check_box.isChecked()}
 
     @property
     def on_acquisition(self):
@@ -279,9 +335,9 @@ class GridsHandler(QWidget):
                 widget = element.widget()
                 widget.setEnabled(status)
             elif isinstance(element, QLayout):
-                layout = element.layout()
-                for index in range(layout.count()):
-                    layout.itemAt(index).widget().setEnabled(status)
+                sub_layout = element.layout()
+                for index in range(sub_layout.count()):
+                    sub_layout.itemAt(index).widget().setEnabled(status)
 
     def generate_one_grid(self, value: Union[Tuple[int, int], None]):
         nb_grid = self.sender().nb_position
@@ -294,6 +350,13 @@ class GridsHandler(QWidget):
         self.refresh_possibility_start_acquisition()
         self.grids_starting_points_signal.emit(self._grids_starting_points)
 
+    def set_overview_grids(self, grids: List[Union[None, GridDefinition]]) -> None:
+        """
+        Grids placed by the overview pre-scan (one per slide, None for the empty slides).
+        """
+        self.grids_starting_points = grids
+        self.refresh_possibility_start_acquisition()
+
     def change_matrix(self, value):
         self.change_matrix_signal.emit(transform_matrix_text2value(value))
         for grid in self.grids_starting_points:
@@ -1,7 +1,10 @@
+import os
 import sys
+import time
 from datetime import datetime
-from typing import Union
+from typing import Union, List
 
+import numpy as np
 import qdarkstyle
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import *
@@ -13,15 +16,28 @@ from app.utils.UI.GraphicItems.arrow import Arrow
 from app.utils.UI.GraphicItems.clickable_graphics_scene import ClickableGraphicsScene
 from app.utils.UI.GraphicItems.cross import CrossItem
 from app.utils.position import Position
+from acquisition_journal import AcquisitionJournal, JOURNAL_FILE_NAME, acquire_journaled
 from automatic_prior_detector import PriorSearcher
 from camera.idscamwindow import IDSCamWindow
+from camera.settle_detection import SettleDetector
+from fly_scan import FlyScanner, DEFAULT_EXPOSURE, get_fly_speed
 from grid.display import Display
-from grid.grid_movement import GridMovement, Course, get_bounding_rec_grid
+from grid.grid_movement import GridCache, Course, get_bounding_rec_grid
+from grid.focus_map import FocusMap, NB_FOCUS_POINTS, select_focus_points, get_sweep_positions, get_best_focus, \
+    attach_focus_maps
 from grid.grid_verif_qt import GridVerification
+from grid.overview import OverviewScan
+from grid.roi import get_roi_matrix, get_tile_mask
+from grid.scan_order import TravelCostModel
+from grid.scan_planner import ScanPlanner, PlannedGrid
 from grid.several_grid_handler import GridsHandler, GridDefinition, transform_matrix_text2value
-from grid.share_serial import Y_LIMIT, X_LIMIT
-from hardware_constants import OVERLAP, IMAGE_SIZE, SLIDE_WIDTH, SPACE_BETWEEN_SLIDES, SLIDE_HEIGHT
+from grid.share_serial import Y_LIMIT
+from hardware_constants import SLIDE_WIDTH, SPACE_BETWEEN_SLIDES, SLIDE_HEIGHT
 from main import PriorController
+from motion_model import StageKinematics
+from motion_stream import MotionStreamer
+from objectives import OBJECTIVES, DEFAULT_OBJECTIVE
+from sharpness.metrics import variance_of_sobel
 from test_prior_read_write import PriorHandler, MicroscopeHandler
 
 
@@ -34,6 +50,13 @@ class myWindow(QMainWindow):
         self.grids = None
         self._x = None
         self._y = None
+        self._z = None
+        # index in self.grids of each planned grid, in visiting order
+        self.planned_grid_indices = []
+        # geometry of the grids: regenerated only when the matrix or the ROI changes, translated otherwise
+        self.grid_cache = GridCache()
+        # tiling of the grids: field of view and overlap (in µm along x and y) of the objective
+        self.objective = OBJECTIVES[DEFAULT_OBJECTIVE]
 
         self.graphics_view = Display()
 
@@ -55,17 +78,21 @@ class myWindow(QMainWindow):
         docked.setWidget(self.grids_setup)
         self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, docked)
 
+        # the capture after each movement is released as soon as the live image is still
+        self.settle_detector = SettleDetector()
+
         ps = PriorSearcher(baudrate_list=[9600])
-        self.prior = PriorController(port=ps.port, baudrate=9600, timeout=0.1)
+        self.prior = PriorController(port=ps.port, baudrate=9600, timeout=0.1, target_baudrate=115200)
 
         docked = CustomDockWidget("Grid viewer")
-        self.grid_verification = GridVerification()
+        self.grid_verification = GridVerification(tile_size=self.objective.field_of_view)
         # self.dockedWidget.setParent(self)
         docked.setWidget(self.grid_verification)
         self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, docked)
 
         docked = CustomDockWidget("Camera display")
         self.ids_cam_window = IDSCamWindow()
+        self.ids_cam_window.settle_detector = self.settle_detector
         # self.dockedWidget.setParent(self)
         docked.setWidget(self.ids_cam_window)
         self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, docked)
@@ -92,36 +119,124 @@ class myWindow(QMainWindow):
         self._acquisition_status = value
         if self._acquisition_status:
             # self.timer.start(2000, self)
+            plan = self.plan_acquisition()
+            grids_pts = [planned_grid.positions for planned_grid in plan]
+            self.planned_grid_indices = [planned_grid.index for planned_grid in plan]
 
-            self.thread = QThread()
-
-            grids_pts = []
-            for grid in self.grids:
-                if grid is not None:
-                    grids_pts.append(self.get_grid_points(grid))
-
-            self.worker = AcquisitionWorker(parent=self, grids=grids_pts)
-            self.worker.moveToThread(self.thread)
-
-            self.thread.started.connect(self.worker.run)
-            self.worker.finished_signal.connect(self.thread.quit)
-            self.worker.finished_signal.connect(self.worker.deleteLater)
-            self.thread.finished.connect(self.thread.deleteLater)
-            self.worker.progression_change_signal.connect(self.report_progress)
-            self.worker.acquisition_grid_change_signal.connect(self.report_new_grid_acquisition)
-            # Step 6: Start the thread
-            self.thread.start()
+            if self.grids_setup.focus_map_check_box.isChecked():
+                # the acquisition starts when the Z of the tiles are predicted
+                self.start_focus_map(grids_pts)
+            else:
+                self.start_acquisition_worker(grids_pts)
 
             self.show_acquisition_window()
 
         else:
             self.grids_setup.on_acquisition = value
 
+    def start_focus_map(self, grids_pts: List) -> None:
+        self.focus_map_thread = QThread()
+        self.focus_map_worker = FocusMapWorker(parent=self, grids=grids_pts, start_z=self._z or 0)
+        self.focus_map_worker.moveToThread(self.focus_map_thread)
+
+        self.focus_map_thread.started.connect(self.focus_map_worker.run)
+        self.focus_map_worker.finished_signal.connect(self.focus_map_thread.quit)
+        self.focus_map_worker.finished_signal.connect(self.focus_map_worker.deleteLater)
+        self.focus_map_thread.finished.connect(self.focus_map_thread.deleteLater)
+        self.focus_map_worker.finished_signal.connect(self.start_acquisition_worker)
+        self.focus_map_thread.start()
+
+    def start_acquisition_worker(self, grids_pts: List) -> None:
+        """
+        :param grids_pts: positions (x, y) or (x, y, z) of the tiles of each grid in acquisition order.
+        """
+        self.thread = QThread()
+
+        self.worker = AcquisitionWorker(parent=self, grids=grids_pts, grid_indices=self.planned_grid_indices,
+                                        **self.grids_setup.acquisition_options)
+        self.worker.moveToThread(self.thread)
+
+        self.thread.started.connect(self.worker.run)
+        self.worker.finished_signal.connect(self.thread.quit)
+        self.worker.finished_signal.connect(self.worker.deleteLater)
+        self.thread.finished.connect(self.thread.deleteLater)
+        self.worker.progression_change_signal.connect(self.report_progress)
+        self.worker.acquisition_grid_change_signal.connect(self.report_new_grid_acquisition)
+        # Step 6: Start the thread
+        self.thread.start()
+
+    def plan_acquisition(self) -> List[PlannedGrid]:
+        """
+        Order of the defined grids, entry corner and serpentine direction of each one minimizing the travel time of the
+        stage from its current position.
+        """
+        step, tile_size = self.objective.pitch, self.objective.field_of_view
+        origins, matrices, tile_masks, grid_indices = [], [], [], []
+        for grid_index, grid in enumerate(self.grids):
+            if grid is None:
+                continue
+            if grid.roi is None:
+                origins.append(grid.start_position)
+                matrices.append((grid.matrix_length, grid.matrix_length))
+                tile_masks.append(None)
+            else:
+                # only the tiles intersecting the region of interest, aligned on the start position of the grid
+                try:
+                    origin, matrix = get_roi_matrix(grid.roi, step=step, tile_size=tile_size,
+                                                    origin=grid.start_position)
+                except ValueError as e:
+                    print("The grid {index} is left out: {error}".format(index=grid_index + 1, error=e))
+                    continue
+                origins.append(origin)
+                matrices.append(matrix)
+                tile_masks.append(get_tile_mask(grid.roi, origin=origin, matrix=matrix, step=step,
+                                                tile_size=tile_size))
+            grid_indices.append(grid_index)
+
+        planner = ScanPlanner(cost_model=TravelCostModel(kinematics=StageKinematics.from_controller(self.prior)))
+        start_position = (0, 0) if self._x is None else (self._x, self._y)
+        return planner.plan(origins=origins, matrices=matrices, step=step, start_position=start_position,
+                            tile_masks=tile_masks, grid_indices=grid_indices)
+
+    def start_overview(self) -> None:
+        """
+        Overview pre-scan of the 4 slides (the low magnification objective has to be in place): the grids are then
+        placed on the detected sample instead of by hand.
+        """
+        self.grids_setup.toggle_enable_lawhole_layout(layout=self.grids_setup.layout(), status=False)
+
+        self.overview_thread = QThread()
+        self.overview_worker = OverviewWorker(parent=self, overview_scan=OverviewScan(slide_indices=range(4)))
+        self.overview_worker.moveToThread(self.overview_thread)
+
+        self.overview_thread.started.connect(self.overview_worker.run)
+        self.overview_worker.finished_signal.connect(self.overview_thread.quit)
+        self.overview_worker.finished_signal.connect(self.overview_worker.deleteLater)
+        self.overview_thread.finished.connect(self.overview_thread.deleteLater)
+        self.overview_worker.finished_signal.connect(self.place_grids_on_rois)
+        self.overview_thread.start()
+
+    def place_grids_on_rois(self, rois) -> None:
+        """
+        :param rois: ROI of the sample detected on each slide by the overview (None if the slide is empty).
+        """
+        self.grids_setup.toggle_enable_lawhole_layout(layout=self.grids_setup.layout(), status=True)
+        grids = []
+        for roi in rois:
+            if roi is None or roi.bounding_box is None:
+                grids.append(None)
+            else:
+                x_min, y_min, _, _ = roi.bounding_box
+                grids.append(GridDefinition(start_position=(round(x_min), round(y_min)),
+                                            matrix_definition=self.matrix_length, roi=roi))
+        self.grids_setup.set_overview_grids(grids)
+
     def report_progress(self, progress_value):
         self.acquisition_window.progression = progress_value
 
-    def report_new_grid_acquisition(self, new_grid_nb: int):
-        self.acquisition_window.nb_completed_grids = new_grid_nb
+    def report_new_grid_acquisition(self, nb_completed_grids: int, grid_index: int):
+        self.acquisition_window.current_grid = grid_index
+        self.acquisition_window.nb_completed_grids = nb_completed_grids
 
     def show_acquisition_window(self):
         self.acquisition_window = StartAcquisitionMessageBox(nb_grids=self.get_nb_defined_grids())
@@ -153,8 +268,7 @@ class myWindow(QMainWindow):
         self.grid_verification.grid = self.get_grid_points(grid_definition=GridDefinition(
             start_position=(0, 0), matrix_definition=value))
 
-    @staticmethod
-    def get_grid_points(grid_definition: GridDefinition):
+    def get_grid_points(self, grid_definition: GridDefinition):
         start_pt_x = grid_definition.start_position[0]
         start_pt_y = grid_definition.start_position[1]
         matrix = grid_definition.matrix_length
@@ -162,11 +276,11 @@ class myWindow(QMainWindow):
         # width_grid = round(IMAGE_SIZE[0] * (1 + matrix * (OVERLAP / 100)))
         # length_grid = round(IMAGE_SIZE[1] * (1 + matrix * (OVERLAP / 100)))
 
-        gm = GridMovement(x=0, y=0, img_size=IMAGE_SIZE, x_lim=(0, X_LIMIT), y_lim=(0, Y_LIMIT))
-        gm.course = Course().V_RIGHT
-        grid_points = gm.get_grid_from_matrix(start_pt=(start_pt_x, start_pt_y), matrix=(matrix, matrix),
-                                              percentage_non_overlap=(OVERLAP / 100, OVERLAP / 100))
-        return grid_points
+        if grid_definition.roi is not None:
+            return self.grid_cache.get_roi_grid(roi=grid_definition.roi, start_pt=(start_pt_x, start_pt_y),
+                                                objective=self.objective)
+        return self.grid_cache.get_grid(start_pt=(start_pt_x, start_pt_y), matrix=(matrix, matrix),
+                                        objective=self.objective, course=Course().V_RIGHT, lazy=True)
 
     def connect_actions(self):
         self.grids_setup.grids_starting_points_signal.connect(self.generate_grids)
@@ -175,6 +289,7 @@ class myWindow(QMainWindow):
         self.grids_setup.acquisition_status_change_signal.connect(
             lambda value: setattr(self, "acquisition_status", value))
         self.scene.position_clicked_signal.connect(self.distribute_clicked_position)
+        self.grids_setup.overview_request_signal.connect(self.start_overview)
 
     def distribute_clicked_position(self, position: Position, object_name: str) -> None:
         if object_name.startswith("grid_"):
@@ -215,9 +330,14 @@ class myWindow(QMainWindow):
 
         for grid in grids:
             if grid is not None:
-                grid_points = self.get_grid_points(grid_definition=grid)
-
-                bounding_rect = list(get_bounding_rec_grid(grid=grid_points, img_size=IMAGE_SIZE))
+                try:
+                    grid_points = self.get_grid_points(grid_definition=grid)
+                except ValueError as e:
+                    # empty ROI
+                    print(str(e))
+                    continue
+
+                bounding_rect = list(get_bounding_rec_grid(grid=grid_points, img_size=self.objective.field_of_view))
                 self.draw_bounding_rect_grid(bounding_rect)
 
     def draw_bounding_rect_grid(self, bounding_rect):
@@ -265,6 +385,7 @@ class myWindow(QMainWindow):
             # self.prior.wait4available()
             self.initialize_prior()
             self.microscope_handler = MicroscopeHandler(self._prior)
+            self.microscope_handler.settle_detector = self.settle_detector
             self.prior_movement = PriorHandler(microscope_handler=self.microscope_handler, parent=self)
             # self.dockedWidget.setParent(self)
             # self.prior.busy = False
@@ -416,25 +537,153 @@ class myWindow(QMainWindow):
 
 class AcquisitionWorker(QObject):
     progression_change_signal = pyqtSignal(int)
-    acquisition_grid_change_signal = pyqtSignal(int)
+    # number of grids already acquired, index (in the grids defined by the user) of the grid being acquired, -1 once
+    # every grid is acquired
+    acquisition_grid_change_signal = pyqtSignal(int, int)
     finished_signal = pyqtSignal()
 
-    def __init__(self, parent, grids):
+    def __init__(self, parent, grids, grid_indices: Union[None, List[int]] = None, streaming: bool = False,
+                 streaming_depth: int = 4, output_folder: Union[None, str] = None, image_extension: str = ".png",
+                 fly_scan: bool = False, exposure: float = DEFAULT_EXPOSURE):
+        """
+        :param parent: main window owning the microscope handler.
+        :param grids: list of grids (list of positions) acquired one after the other.
+        :param grid_indices: index of each grid in the grids defined by the user (the planner reorders them), its
+                             position in grids if None.
+        :param streaming: if True, the waypoints of each grid are streamed into the controller queue (MotionStreamer)
+                          instead of being sent one by one after each "R".
+        :param streaming_depth: maximum number of movements queued in the controller in streaming mode.
+        :param output_folder: if given, a frame is taken at each tile and saved in this folder (one subfolder per grid)
+                              by an AcquisitionPipeline: the move to the next tile starts as soon as the frame is
+                              taken, while the previous frames are encoded and written in background threads.
+                              The frame of each tile is taken once the settle detector of the window finds the live
+                              image still.
+        :param image_extension: format of the saved tiles (pipeline mode).
+        :param fly_scan: if True (pipeline mode), the columns of each grid are swept at constant speed and the frames
+                         are taken when the stage crosses the tiles (FlyScanner) instead of stopping at each tile.
+        :param exposure: exposure time of the camera in fly scan mode (in s), it sets the speed of the sweeps.
+        """
         super().__init__(parent)
         print("timer event")
 
         self._position_counter = 0
+        self.grids = grids
+        self.grid_indices = list(range(len(grids))) if grid_indices is None else list(grid_indices)
         self.grid_counter = 0
         self.progress = 0
 
-        self.grids = grids
         self.microscope_handler = self.parent().microscope_handler
 
-        self.microscope_handler.reach_position_signal.connect(self.go_to_next_position)
+        self.streaming = streaming
+        self.streaming_depth = streaming_depth
+        self.motion_streamer = None
+
+        self.output_folder = output_folder
+        self.image_extension = image_extension
+
+        self.fly_scan = fly_scan
+        self.exposure = exposure
+
+        if not self.streaming and self.output_folder is None:
+            self.microscope_handler.reach_position_signal.connect(self.go_to_next_position)
 
     def run(self):
         self.position_counter = 0
-        self.acquire_grid()
+        if self.output_folder is not None:
+            self.run_pipeline()
+        elif self.streaming:
+            self.stream_grid()
+        else:
+            self.acquire_grid()
+
+    def acquire_tile(self, index: int, position) -> np.ndarray:
+        """
+        Move to a tile and take its frame (acquisition stage of the pipeline, blocking).
+        """
+        handle = self.microscope_handler.engine.submit("G, " + ", ".join(str(int(value)) for value in position))
+        settle_detector = self.parent().settle_detector
+        handle.wait()
+        if not handle.reached:
+            raise IOError("The tile {index} at {position} was not reached".format(index=index, position=position))
+        settle_time = time.perf_counter()
+        settle_detector.arm()
+        settle_detector.wait()
+        self.position_counter = index + 1
+        return self.capture(newer_than=settle_time)
+
+    def locate(self) -> Union[None, tuple]:
+        """
+        :return: position of the stage read back from the controller, None if the answer is not a position.
+        """
+        return self.microscope_handler.engine.get_position()
+
+    def capture(self, newer_than: Union[None, float] = None) -> np.ndarray:
+        """
+        :param newer_than: time (time.perf_counter): take a frame received after it.
+        :return: (H, W, 4) BGRA frame of the camera, handed over by the GUI thread (see IDSCamWindow.get_frame).
+        """
+        return self.parent().ids_cam_window.get_frame(newer_than=newer_than)
+
+    def get_fly_scanner(self) -> FlyScanner:
+        objective = self.parent().objective
+        speed = get_fly_speed(pitch=objective.pitch[1], pixel_scale=objective.pixel_scale, exposure=self.exposure)
+        self.parent().ids_cam_window.change_exp_time(self.exposure * 1e3)
+        return FlyScanner(engine=self.microscope_handler.engine,
+                          capture=lambda: self.capture(newer_than=time.perf_counter()), exposure=self.exposure,
+                          speed=speed)
+
+    def run_pipeline(self) -> None:
+        scan = None
+        if self.fly_scan:
+            # checked before anything moves: the exposure may make the fly scan slower than stop-and-shoot
+            try:
+                scanner = self.get_fly_scanner()
+            except ValueError as e:
+                print("[ERROR] : fly scan - {error}".format(error=e))
+                self.finished_signal.emit()
+                return
+            scan = lambda grid, indices: scanner.scan(grid, indices=indices)
+
+        # an unfinished run journaled in the output folder is resumed at its first tiles not written yet
+        os.makedirs(self.output_folder, exist_ok=True)
+        journal = AcquisitionJournal.open_or_create(
+            os.path.join(self.output_folder, JOURNAL_FILE_NAME), grids=self.grids, objective=self.parent().objective,
+            metadata={"fly_scan": self.fly_scan, "image_extension": self.image_extension,
+                      "grid_indices": self.grid_indices})
+        self.grids = journal.grids
+        self.grid_indices = journal.plan["metadata"].get("grid_indices", list(range(len(self.grids))))
+        if journal.nb_completed:
+            print("resume the acquisition: {done} / {total} tiles already written".format(
+                done=journal.nb_completed, total=journal.nb_tiles))
+
+        if acquire_journaled(journal, self.output_folder, acquire=self.acquire_tile, scan=scan,
+                             image_extension=self.image_extension, on_grid=self.start_grid, locate=self.locate):
+            print("success")
+        journal.close()
+        self.finished_signal.emit()
+
+    def start_grid(self, grid_counter: int) -> None:
+        self.grid_counter = grid_counter
+        self.position_counter = 0
+
+    def stream_grid(self) -> None:
+        self.motion_streamer = MotionStreamer(engine=self.microscope_handler.engine,
+                                              waypoints=self.grids[self.grid_counter], depth=self.streaming_depth,
+                                              on_waypoint_reached=self.on_streamed_waypoint_reached,
+                                              on_finished=self.on_streamed_grid_finished)
+        self.motion_streamer.start()
+
+    def on_streamed_waypoint_reached(self, index: int, waypoint) -> None:
+        self.position_counter = index + 1
+
+    def on_streamed_grid_finished(self) -> None:
+        self.grid_counter += 1
+        if self.grid_counter < len(self.grids):
+            self.position_counter = 0
+            self.stream_grid()
+        else:
+            print("success")
+            self.finished_signal.emit()
 
     def go_to_first_point(self, start_position: Position) -> None:
         self.microscope_handler.go_to_absolute_position(start_position)
@@ -477,7 +726,158 @@ class AcquisitionWorker(QObject):
     @grid_counter.setter
     def grid_counter(self, value):
         self._grid_counter = value
-        self.acquisition_grid_change_signal.emit(self._grid_counter)
+        grid_index = self.grid_indices[value] if value < len(self.grid_indices) else -1
+        self.acquisition_grid_change_signal.emit(self._grid_counter, grid_index)
+
+
+class FocusMapWorker(QObject):
+    progression_change_signal = pyqtSignal(int)
+    finished_signal = pyqtSignal(object)
+
+    def __init__(self, parent, grids, surface: str = "plane", nb_points: int = NB_FOCUS_POINTS, start_z: int = 0,
+                 coarse_sweep=(100, 20), fine_sweep=(20, 5), settle_time: float = 0.1):
+        """
+        Autofocus on a few well-spread tiles of each grid (a coarse then a fine Z sweep maximizing the sharpness of the
+        camera frame) and fit a focus map per grid. finished_signal sends the grids with the predicted Z of each tile.
+        :param parent: main window owning the microscope handler and the camera.
+        :param grids: (N, 2) positions of the tiles of each grid.
+        :param surface: model of the focus map (see grid.focus_map.FocusMap).
+        :param nb_points: number of autofocus points per grid.
+        :param start_z: center of the first sweep, the next sweeps are centered on the Z predicted by the points
+                        already measured.
+        :param coarse_sweep: (half range, step) of the coarse sweep.
+        :param fine_sweep: (half range, step) of the fine sweep around the best Z of the coarse one.
+        :param settle_time: time (in s) waited at each Z so the displayed frame is taken after the movement.
+        """
+        super().__init__(parent)
+        self.grids = grids
+        self.focus_maps = [FocusMap(surface=surface) for _ in grids]
+        self.focus_points = [np.asarray(grid)[select_focus_points(grid, nb_points), :2] for grid in grids]
+        self.start_z = start_z
+        self.coarse_sweep = coarse_sweep
+        self.fine_sweep = fine_sweep
+        self.settle_time = settle_time
+        self.camera_window = self.parent().ids_cam_window
+        self.microscope_handler = self.parent().microscope_handler
+
+        self.grid_counter = 0
+        self.point_counter = 0
+        self.sweep = None
+        self.sweep_counter = 0
+        self.sharpness_values = []
+        self.fine = False
+        self._nb_points = sum(len(points) for points in self.focus_points)
+        self._nb_done_points = 0
+
+    def run(self):
+        # grids without tile have no focus point
+        while self.grid_counter < len(self.grids) and len(self.focus_points[self.grid_counter]) == 0:
+            self.grid_counter += 1
+        if self.grid_counter == len(self.grids):
+            self.finished_signal.emit(self.grids)
+            return
+        self.microscope_handler.reach_position_signal.connect(self.take_frame)
+        self.start_sweep(center=self.get_estimated_z(), fine=False)
+
+    def get_estimated_z(self) -> float:
+        focus_map = self.focus_maps[self.grid_counter]
+        if focus_map.nb_points == 0:
+            return self.start_z
+        return float(focus_map.predict(self.focus_points[self.grid_counter][self.point_counter][np.newaxis])[0])
+
+    def start_sweep(self, center: float, fine: bool) -> None:
+        half_range, step = self.fine_sweep if fine else self.coarse_sweep
+        self.fine = fine
+        self.sweep = get_sweep_positions(center=center, half_range=half_range, step=step)
+        self.sweep_counter = 0
+        self.sharpness_values = []
+        self.go_to_sweep_position()
+
+    def go_to_sweep_position(self) -> None:
+        x, y = self.focus_points[self.grid_counter][self.point_counter]
+        self.microscope_handler.write_to_port(Position(int(x), int(y), int(self.sweep[self.sweep_counter])),
+                                              delay=self.settle_time)
+
+    def take_frame(self) -> None:
+        frame = self.camera_window.get_frame()
+        self.sharpness_values.append(variance_of_sobel(np.ascontiguousarray(frame[..., :3])))
+        self.sweep_counter += 1
+        if self.sweep_counter < len(self.sweep):
+            self.go_to_sweep_position()
+            return
+
+        best_z = get_best_focus(self.sweep, self.sharpness_values)
+        if not self.fine:
+            self.start_sweep(center=best_z, fine=True)
+            return
+
+        x, y = self.focus_points[self.grid_counter][self.point_counter]
+        self.focus_maps[self.grid_counter].add_point(x, y, best_z)
+        self._nb_done_points += 1
+        self.progression_change_signal.emit(round(self._nb_done_points / self._nb_points * 100))
+
+        self.point_counter += 1
+        while self.grid_counter < len(self.grids) and \
+                self.point_counter == len(self.focus_points[self.grid_counter]):
+            self.grid_counter += 1
+            self.point_counter = 0
+        if self.grid_counter < len(self.grids):
+            self.start_sweep(center=self.get_estimated_z(), fine=False)
+        else:
+            self.microscope_handler.reach_position_signal.disconnect(self.take_frame)
+            self.finished_signal.emit(attach_focus_maps(
+                [grid for grid, points in zip(self.grids, self.focus_points) if len(points) > 0],
+                [focus_map for focus_map, points in zip(self.focus_maps, self.focus_points) if len(points) > 0]))
+
+
+class OverviewWorker(QObject):
+    progression_change_signal = pyqtSignal(int)
+    finished_signal = pyqtSignal(object)
+
+    def __init__(self, parent, overview_scan: OverviewScan, settle_time: float = 0.1):
+        """
+        Move the stage on the coarse grid of each slide and give the frame of the camera taken at each position to the
+        overview scan. finished_signal sends the ROI of the sample of each slide.
+        :param parent: main window owning the microscope handler and the camera.
+        :param settle_time: time (in s) waited at each position so the displayed frame is taken after the movement.
+        """
+        super().__init__(parent)
+        self.overview_scan = overview_scan
+        self.positions = overview_scan.get_positions()
+        self.settle_time = settle_time
+        self.camera_window = self.parent().ids_cam_window
+        self.microscope_handler = self.parent().microscope_handler
+
+        self.slide_counter = 0
+        self.position_counter = 0
+        self._nb_positions = sum(len(positions) for positions in self.positions)
+        self._nb_done_positions = 0
+
+    def run(self):
+        self.microscope_handler.reach_position_signal.connect(self.take_frame)
+        self.go_to_current_position()
+
+    def go_to_current_position(self) -> None:
+        self.microscope_handler.write_to_port(
+            Position(*self.positions[self.slide_counter][self.position_counter]), delay=self.settle_time)
+
+    def take_frame(self) -> None:
+        frame = self.camera_window.get_frame()
+        self.overview_scan.add_frame(self.slide_counter, self.positions[self.slide_counter][self.position_counter],
+                                     frame)
+        self._nb_done_positions += 1
+        self.progression_change_signal.emit(round(self._nb_done_positions / self._nb_positions * 100))
+
+        self.position_counter += 1
+        if self.position_counter == len(self.positions[self.slide_counter]):
+            self.slide_counter += 1
+            self.position_counter = 0
+        if self.slide_counter < len(self.positions):
+            self.go_to_current_position()
+        else:
+            # the acquisition worker listens to the same signal afterwards
+            self.microscope_handler.reach_position_signal.disconnect(self.take_frame)
+            self.finished_signal.emit(self.overview_scan.get_rois())
 
 
 class StartAcquisitionMessageBox(QDialog):
@@ -489,6 +889,8 @@ class StartAcquisitionMessageBox(QDialog):
 
         self._nb_grids = nb_grids
         self._nb_completed_grids = 0
+        # index of the grid being acquired in the grids defined by the user, -1 if none
+        self._current_grid = -1
         self._progression = 0
         self._acquisition_status = False
         self._acquisition_possibility = False
@@ -539,7 +941,22 @@ class StartAcquisitionMessageBox(QDialog):
     @nb_completed_grids.setter
     def nb_completed_grids(self, value: int) -> None:
         self._nb_completed_grids = value
-        self.progression_on_grids_label.setText(f"{self._nb_completed_grids} / {self._nb_grids}")
+        self.update_progression_on_grids()
+
+    @property
+    def current_grid(self) -> int:
+        return self._current_grid
+
+    @current_grid.setter
+    def current_grid(self, value: int) -> None:
+        self._current_grid = value
+        self.update_progression_on_grids()
+
+    def update_progression_on_grids(self) -> None:
+        text = f"{self._nb_completed_grids} / {self._nb_grids}"
+        if self._current_grid >= 0:
+            text += f" (grid {self._current_grid + 1})"
+        self.progression_on_grids_label.setText(text)
 
     @property
     def acquisition_possibility(self) -> bool:
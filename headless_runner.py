@@ -0,0 +1,331 @@
+"""
+Headless acquisition: the grids of a run spec file are imaged without any Qt widget nor event loop, for unattended
+batches and machines without display.
+
+    python headless_runner.py run_spec.yaml
+    python headless_runner.py run_spec.yaml --simulate   # ProScan simulator and blank camera (dry run)
+
+See examples/run_spec.yaml for the format of the run spec. An interrupted run is resumed by running the same spec again:
+the journal of its output folder gives the tiles already written.
+"""
+import argparse
+import os
+import sys
+import time
+import typing
+
+import numpy as np
+import yaml
+
+from acquisition_journal import AcquisitionJournal, JOURNAL_FILE_NAME, acquire_journaled
+from automatic_prior_detector import PriorSearcher
+from camera.settle_detection import SettleDetector
+from fly_scan import FlyScanner, DEFAULT_EXPOSURE, get_fly_speed
+from grid.focus_map import FocusMap, NB_FOCUS_POINTS, select_focus_points, find_best_focus
+from grid.lazy_grid import LazyGrid
+from grid.scan_order import TOP_LEFT, TOP_RIGHT, BOTTOM_LEFT, BOTTOM_RIGHT
+from main import PriorController
+from objectives import OBJECTIVES, DEFAULT_OBJECTIVE, ObjectiveProfile
+from sharpness.metrics import variance_of_sobel
+
+CORNER_NAMES = {"top_left": TOP_LEFT, "top_right": TOP_RIGHT, "bottom_left": BOTTOM_LEFT,
+                "bottom_right": BOTTOM_RIGHT}
+AUTOFOCUS_POLICIES = ("none", "fixed", "focus_map")
+ACQUISITION_MODES = ("stop", "fly")
+CAMERAS = ("ids", "blank")
+
+
+class RunSpec:
+    def __init__(self, output: str, grids: typing.List[typing.Dict], objective: typing.Union[str, typing.Dict] =
+                 DEFAULT_OBJECTIVE, overlap: typing.Union[None, typing.Sequence[float]] = None,
+                 autofocus: typing.Union[None, typing.Dict] = None, mode: str = "stop", settle: str = "detector",
+                 settle_time: float = 0.1, exposure: typing.Union[None, float] = None, image_extension: str = ".png",
+                 encoders: int = 1, port: typing.Union[None, str] = None, baudrate: int = 9600,
+                 target_baudrate: typing.Union[None, int] = 115200, camera: str = "ids",
+                 metadata: typing.Union[None, typing.Dict] = None):
+        """
+        Description of a headless run, read from a YAML (or JSON) file with the same keys.
+        :param output: output folder (tiles of the grid g in output/grid_g, journal of the run).
+        :param grids: grids to image, each one {"start": [x, y], "matrix": [columns, rows]} or
+                      {"start": [x, y], "size": [width, height]} (area in µm), with optional "by_rows" (bool) and
+                      "corner" ("top_left"...) of the serpentine.
+        :param objective: name of an objective of OBJECTIVES or {"name", "pixel_scale", "sensor_size", "overlap"}.
+        :param overlap: overlap along x and y (in % of the field of view), replaces the one of the objective.
+        :param autofocus: {"policy": "none"} (default), {"policy": "fixed", "z": z} or {"policy": "focus_map",
+                          "surface": "plane", "points": 9, "start_z": 0, "coarse": [100, 20], "fine": [20, 5]}.
+        :param mode: "stop" (stop and shoot) or "fly" (continuous motion, see FlyScanner).
+        :param settle: "detector" (wait for a still image, see SettleDetector) or "time" (wait settle_time).
+        :param settle_time: fixed settle time after each movement (in s).
+        :param exposure: exposure time of the camera (in s), DEFAULT_EXPOSURE in fly mode.
+        :param image_extension: format of the tiles.
+        :param encoders: number of encoding threads.
+        :param port: serial port of the controller, found by PriorSearcher if None.
+        :param baudrate: baud rate of the controller at power on.
+        :param target_baudrate: baud rate negotiated with the controller.
+        :param camera: "ids" or "blank" (black frames, dry run without camera: the settle time is then fixed).
+        :param metadata: information written in the journal of the run.
+        """
+        self.output = output
+        self.grids = grids
+        self.objective = objective
+        self.overlap = overlap
+        self.autofocus = dict(autofocus or {"policy": "none"})
+        self.mode = mode
+        self.settle = settle
+        self.settle_time = settle_time
+        self.exposure = exposure
+        self.image_extension = image_extension
+        self.encoders = encoders
+        self.port = port
+        self.baudrate = baudrate
+        self.target_baudrate = target_baudrate
+        self.camera = camera
+        self.metadata = metadata or {}
+
+        if self.autofocus.get("policy", "none") not in AUTOFOCUS_POLICIES:
+            raise ValueError("Unknown autofocus policy {}, expected one of {}".format(self.autofocus.get("policy"),
+                                                                                      AUTOFOCUS_POLICIES))
+        if self.mode not in ACQUISITION_MODES:
+            raise ValueError("Unknown acquisition mode {}, expected one of {}".format(self.mode, ACQUISITION_MODES))
+        if self.settle not in ("detector", "time"):
+            raise ValueError("Unknown settle {}, expected detector or time".format(self.settle))
+        if self.camera not in CAMERAS:
+            raise ValueError("Unknown camera {}, expected one of {}".format(self.camera, CAMERAS))
+
+    @classmethod
+    def from_file(cls, path: str) -> "RunSpec":
+        with open(path, "r") as file:
+            content = yaml.safe_load(file)
+        try:
+            return cls(**content)
+        except TypeError as e:
+            raise ValueError("Invalid run spec {}: {}".format(path, e))
+
+    def get_objective(self) -> ObjectiveProfile:
+        if isinstance(self.objective, str):
+            objective = OBJECTIVES[self.objective]
+        else:
+            objective = ObjectiveProfile(**self.objective)
+        if self.overlap is None:
+            return objective
+        return ObjectiveProfile.from_overlap_percentage(name=objective.name, pixel_scale=objective.pixel_scale,
+                                                        sensor_size=objective.sensor_size,
+                                                        overlap_percentage=tuple(self.overlap))
+
+    def get_grids(self) -> typing.List[np.ndarray]:
+        """
+        :return: (N, 2) tile positions of each grid in acquisition order.
+        """
+        objective = self.get_objective()
+        grids = []
+        for grid in self.grids:
+            matrix = grid["matrix"] if "matrix" in grid else objective.get_matrix(grid["size"])
+            grids.append(LazyGrid(origin=grid["start"], matrix=matrix, step=objective.pitch,
+                                  by_rows=grid.get("by_rows", False),
+                                  corner=CORNER_NAMES[grid.get("corner", "top_left")]).to_array())
+        return grids
+
+
+class BlankCamera:
+    def __init__(self, size: typing.Tuple[int, int]):
+        """
+        Camera giving black frames, for dry runs of the stage without camera.
+        :param size: width and height of the frames.
+        """
+        self.size = size
+        self.settle_detector = None
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def change_exp_time(self, value: float) -> None:
+        pass
+
+    def get_frame(self, newer_than: typing.Union[None, float] = None, timeout: float = 5.) -> np.ndarray:
+        return np.zeros((self.size[1], self.size[0], 4), dtype=np.uint8)
+
+
+class HeadlessRunner:
+    def __init__(self, spec: RunSpec, prior: PriorController, camera):
+        """
+        Stage and camera I/O of a run without any widget: movements go through the I/O engine of the controller
+        (MotionHandle), frames are taken from the camera grabbing in the background (IDSCamera).
+        :param spec: run spec.
+        :param prior: connected controller.
+        :param camera: IDSCamera or BlankCamera.
+        """
+        self.spec = spec
+        self.prior = prior
+        self.camera = camera
+        self.engine = prior.start_engine()
+        self.objective = spec.get_objective()
+
+        self.settle_detector = None
+        if spec.settle == "detector" and not isinstance(camera, BlankCamera):
+            self.settle_detector = SettleDetector()
+            camera.settle_detector = self.settle_detector
+
+    def move(self, position: typing.Sequence) -> None:
+        handle = self.engine.submit("G, " + ", ".join(str(int(value)) for value in position))
+        handle.wait()
+        if not handle.reached:
+            raise IOError("The position {} was not reached".format(tuple(position)))
+
+    def locate(self) -> typing.Union[None, typing.Tuple[int, ...]]:
+        """
+        :return: position of the stage read back from the controller, None if the answer is not a position.
+        """
+        return self.engine.get_position()
+
+    def settle(self) -> float:
+        """
+        Wait until the stage is still after a movement.
+        :return: time (time.perf_counter) after which the frames are still.
+        """
+        if self.settle_detector is None:
+            time.sleep(self.spec.settle_time)
+            return time.perf_counter()
+        arm_time = time.perf_counter()
+        self.settle_detector.arm()
+        self.settle_detector.wait()
+        return arm_time
+
+    def acquire_tile(self, index: int, position: typing.Sequence) -> np.ndarray:
+        self.move(position)
+        return self.camera.get_frame(newer_than=self.settle())
+
+    def measure_sharpness(self, x: int, y: int, z: int) -> float:
+        self.move((x, y, z))
+        frame = self.camera.get_frame(newer_than=self.settle())
+        return variance_of_sobel(np.ascontiguousarray(frame[..., :3]))
+
+    def attach_focus(self, grids: typing.List[np.ndarray]) -> typing.List[np.ndarray]:
+        """
+        :return: (N, 3) positions of each grid with the Z given by the autofocus policy of the run spec.
+        """
+        autofocus = self.spec.autofocus
+        policy = autofocus.get("policy", "none")
+        if policy == "none":
+            return grids
+        if policy == "fixed":
+            return [np.column_stack([grid, np.full(len(grid), int(autofocus["z"]))]).astype(np.int32)
+                    for grid in grids]
+
+        focused_grids = []
+        for grid_index, grid in enumerate(grids):
+            focus_map = FocusMap(surface=autofocus.get("surface", "plane"))
+            for x, y in grid[select_focus_points(grid, autofocus.get("points", NB_FOCUS_POINTS))]:
+                center = autofocus.get("start_z", 0) if focus_map.nb_points == 0 else \
+                    float(focus_map.predict(np.array([[x, y]]))[0])
+                best_z = find_best_focus(lambda z: self.measure_sharpness(int(x), int(y), z), center=center,
+                                         coarse_sweep=tuple(autofocus.get("coarse", (100, 20))),
+                                         fine_sweep=tuple(autofocus.get("fine", (20, 5))))
+                focus_map.add_point(x, y, best_z)
+                print("grid {grid}: focus at ({x}, {y}) = {z:.1f}".format(grid=grid_index, x=x, y=y, z=best_z))
+            focused_grids.append(focus_map.attach_z(grid))
+        return focused_grids
+
+    def open_journal(self) -> AcquisitionJournal:
+        """
+        Resume the run of the output folder, or plan a new one (autofocus included). Running a spec again is
+        idempotent: the run of a finished journal acquires nothing.
+        """
+        os.makedirs(self.spec.output, exist_ok=True)
+        path = os.path.join(self.spec.output, JOURNAL_FILE_NAME)
+        if os.path.exists(path):
+            journal = AcquisitionJournal.open(path)
+            if journal.finished:
+                print("the acquisition is already finished: {total} tiles written".format(total=journal.nb_tiles))
+            else:
+                print("resume the acquisition: {done} / {total} tiles already written".format(
+                    done=journal.nb_completed, total=journal.nb_tiles))
+            return journal
+        grids = self.attach_focus(self.spec.get_grids())
+        return AcquisitionJournal.create(path, grids, objective=self.objective,
+                                         metadata=dict(self.spec.metadata, mode=self.spec.mode,
+                                                       autofocus=self.spec.autofocus))
+
+    @property
+    def exposure(self) -> typing.Union[None, float]:
+        """
+        Exposure time of the camera (in s), None to keep the one of the camera.
+        """
+        if self.spec.exposure is None and self.spec.mode == "fly":
+            return DEFAULT_EXPOSURE
+        return self.spec.exposure
+
+    def get_fly_scanner(self) -> FlyScanner:
+        return FlyScanner(engine=self.engine, capture=lambda: self.camera.get_frame(newer_than=time.perf_counter()),
+                          exposure=self.exposure, speed=get_fly_speed(pitch=self.objective.pitch[1],
+                                                                      pixel_scale=self.objective.pixel_scale,
+                                                                      exposure=self.exposure))
+
+    def run(self) -> bool:
+        """
+        :return: True if every tile of the run is written.
+        """
+        if self.exposure is not None:
+            self.camera.change_exp_time(self.exposure * 1e3)
+
+        scan = None
+        if self.spec.mode == "fly":
+            # raises before anything moves if the exposure makes the fly scan slower than stop-and-shoot
+            scanner = self.get_fly_scanner()
+            scan = lambda grid, indices: scanner.scan(grid, indices=indices)
+
+        start = time.time()
+        with self.open_journal() as journal:
+            finished = acquire_journaled(journal, self.spec.output, acquire=self.acquire_tile, scan=scan,
+                                         image_extension=self.spec.image_extension, encoders=self.spec.encoders,
+                                         on_grid=lambda grid_index: print("grid {}".format(grid_index)),
+                                         locate=self.locate)
+            print("{done} / {total} tiles written in {duration:.1f} s".format(
+                done=journal.nb_completed, total=journal.nb_tiles, duration=time.time() - start))
+        return finished
+
+
+def main(argv: typing.Union[None, typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Headless acquisition of the grids of a run spec (no Qt).")
+    parser.add_argument("spec", help="run spec file (YAML or JSON), see examples/run_spec.yaml")
+    parser.add_argument("--simulate", action="store_true",
+                        help="dry run on the ProScan simulator with a blank camera")
+    args = parser.parse_args(argv)
+    spec = RunSpec.from_file(args.spec)
+
+    simulator = None
+    if args.simulate:
+        # the simulator needs a POSIX pseudo-terminal: only imported for dry runs
+        from simulator.proscan_simulator import ProScanSimulator
+
+        simulator = ProScanSimulator()
+        simulator.start()
+        spec.port, spec.camera = simulator.port, "blank"
+    elif spec.port is None:
+        spec.port = PriorSearcher(baudrate_list=[spec.baudrate]).port
+
+    if spec.camera == "ids":
+        # the IDS peak SDK is only needed with the camera
+        from camera.ids_camera import IDSCamera
+
+        camera = IDSCamera()
+    else:
+        camera = BlankCamera(spec.get_objective().sensor_size)
+
+    prior = PriorController(port=spec.port, baudrate=spec.baudrate, timeout=0.1,
+                            target_baudrate=spec.target_baudrate)
+    try:
+        camera.start()
+        finished = HeadlessRunner(spec, prior, camera).run()
+    finally:
+        camera.close()
+        prior.close()
+        if simulator is not None:
+            simulator.stop()
+    return 0 if finished else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
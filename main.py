@@ -6,9 +6,20 @@ import typing
 
 import serial
 
+from prior_engine import PriorIOEngine, MotionHandle, MOTION_COMMANDS, get_mnemonic, get_error_code
+from prior_protocol import ResponseFramer, Message, Position
+from serial_profiler import SerialProfiler
+
 X_DIRECTION = -1
 Y_DIRECTION = -1
 
+# baud rate of the controller at power on (used by the COM port discovery)
+DEFAULT_BAUDRATE = 9600
+# argument of ProScan "BAUD" command for each supported baud rate
+BAUDRATE_CODES = {9600: 96, 19200: 19, 38400: 38, 57600: 57, 115200: 115}
+# time let to the controller to switch its baud rate after acknowledging "BAUD"
+BAUDRATE_SWITCH_DELAY = 0.05
+
 
 def decode(l):
     if isinstance(l, list):
@@ -124,36 +135,53 @@ class ZAxis:
         self.prior_controller = parent
 
         self._z_position = None
+        # settings cache: None means unknown, the next read asks the controller. The setters always write (see
+        # PriorController)
+        self._speed = None
+        self._acceleration = None
+
         self.speed = 100
         self.acceleration = 70
 
+    def refresh(self) -> None:
+        """
+        Forget the cached settings: they will be read again from the controller.
+        """
+        self._speed = None
+        self._acceleration = None
+
     @property
     def speed(self):
-        self.prior_controller.write_cmd(cmd="SMZ")
-        answer = self.prior_controller.cmd_answer()
+        if self._speed is not None:
+            return self._speed
+
+        answer = self.prior_controller.query(cmd="SMZ")
         try:
             answer = int(answer)
         except:
             Error(feature=sys._getframe().f_code.co_name, response=answer)
         assert 4 <= answer <= 100, "Speed value is not in range [4 - 100]"
+        self._speed = answer
         return answer
 
     @speed.setter
     def speed(self, value: int):
         assert 4 <= value <= 100, "Speed value should to be in range [4 - 100]"
         cmd = "SMZ, {z}".format(z=value)
-        self.prior_controller.write_cmd(cmd)
-
-        answer = self.prior_controller.cmd_answer()
+        answer = self.prior_controller.query(cmd)
         if answer == "0":
+            self._speed = value
             Success(feature=sys._getframe().f_code.co_name, axis=2, value=value)
         else:
+            self._speed = None
             Error(feature=sys._getframe().f_code.co_name, response=answer)
 
     @property
     def acceleration(self):
-        self.prior_controller.write_cmd(cmd="SAZ")
-        answer = self.prior_controller.cmd_answer()
+        if self._acceleration is not None:
+            return self._acceleration
+
+        answer = self.prior_controller.query(cmd="SAZ")
         try:
             answer = int(answer)
         except:
@@ -161,25 +189,25 @@ class ZAxis:
 
         # print("acceleration" 9answer)
         assert 4 <= answer <= 100, "Acceleration value is not in range [4 - 100]"
+        self._acceleration = answer
         return answer
 
     @acceleration.setter
     def acceleration(self, value: int):
         assert 4 <= value <= 100, "Acceleration value should to be in range [4 - 100]"
         cmd = "SAZ, {z}".format(z=value)
-        self.prior_controller.write_cmd(cmd)
-
-        answer = self.prior_controller.cmd_answer()
+        answer = self.prior_controller.query(cmd)
         if answer == "0":
+            self._acceleration = value
             Success(feature=sys._getframe().f_code.co_name, axis=2, value=value)
         else:
+            self._acceleration = None
             Error(feature=sys._getframe().f_code.co_name, response=answer)
 
 
     @property
     def z_position(self) -> int:
-        self.prior_controller.write_cmd("PZ")
-        z_position = self.prior_controller.cmd_answer()
+        z_position = self.prior_controller.query("PZ")
         try:
             return int(z_position.strip())
         except:
@@ -190,22 +218,32 @@ class ZAxis:
 
     @z_position.setter
     def z_position(self, value: int):
-        cmd = "V, {z}\r".format(z=value).encode()
-        self.prior_controller.write(cmd)
+        cmd = "V, {z}".format(z=value)
+        self.prior_controller.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis=2, value=value)
 
-        self.prior_controller.looking_for_position(feature=sys._getframe().f_code.co_name, axis=2, value=value)
+    def move_to(self, z: int) -> MotionHandle:
+        """
+        Non-blocking absolute movement of the Z axis.
+        """
+        return self.prior_controller.start_motion("V, {z}".format(z=z), feature="z_position", axis=2, value=z)
+
+    def move_relative(self, value: int) -> MotionHandle:
+        """
+        Non-blocking relative movement of the Z axis: up if value is positive, down otherwise.
+        """
+        if value <= 0:
+            cmd = "D, {z}".format(z=abs(value))
+        else:
+            cmd = "U, {z}".format(z=value)
+        return self.prior_controller.start_motion(cmd, feature="move_relative", axis="Z", value=value)
 
     def move_relative_down(self, value):
         cmd = "D, {z}".format(z=value)
-        self.prior_controller.write_cmd(cmd)
-
-        self.prior_controller.looking_for_position(feature=sys._getframe().f_code.co_name, axis="Z", value=value)
+        self.prior_controller.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis="Z", value=value)
 
     def move_relative_up(self, value):
         cmd = "U, {z}".format(z=value)
-        self.prior_controller.write_cmd(cmd)
-
-        self.prior_controller.looking_for_position(feature=sys._getframe().f_code.co_name, axis="Z", value=value)
+        self.prior_controller.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis="Z", value=value)
 
 
 
@@ -219,14 +257,48 @@ class PriorController(serial.Serial):
 
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, target_baudrate: typing.Union[None, int] = None, **kwargs):
+        """
+        :param target_baudrate: if not None, baud rate negotiated with the controller right after the connection
+                                (see upgrade_baudrate). The port has to be opened at the current baud rate of the
+                                controller (9600 at power on).
+        :param kwargs: arguments of serial.Serial (port, baudrate, timeout...).
+        """
+        # settings cache, updated by the setters and emptied by refresh() (reconnection, reset of the controller).
+        # None means unknown: the next read asks the controller. The setters always write to the controller: a
+        # controller reset without reconnection would otherwise silently keep its defaults.
+        self._speed = None
+        self._acceleration = None
+        self._s_curve = None
+        self._step_size = None
+        self._resolution = None
+        self._x_direction = None
+        self._y_direction = None
+        self.z_controller = None
+        # opt-in serial traffic profiler (see enable_profiling)
+        self.profiler = None
+        self._profiled_write = None
+        # frames the answers read on the port (merged or fragmented answers)
+        self._framer = ResponseFramer()
+
         super().__init__(**kwargs)
         # self.std_mode = self.standard_mode()
-        self._write_lock = threading.Lock()
-        self._read_lock = threading.Lock()
+        # serializes write + read of one command when the port is not owned by an I/O engine
+        self._io_lock = threading.RLock()
+        self.engine = None
+
+        requested_baudrate = self.baudrate
+        if self.find_link_baudrate() and self.baudrate != requested_baudrate \
+                and requested_baudrate in BAUDRATE_CODES:
+            # left at another baud rate by a session which was not closed cleanly: back to the requested one before
+            # the usual negotiation
+            self.set_link_baudrate(requested_baudrate)
 
         self.peripherals_info = self.initialization()
 
+        if target_baudrate is not None:
+            self.upgrade_baudrate(max_baudrate=target_baudrate)
+
         self.acceleration = 50
         self.speed = 50
         self.resolution = 0.1
@@ -238,18 +310,10 @@ class PriorController(serial.Serial):
 
         self._scale = None
 
-        self._speed = None
-        self._acceleration = None
-        self._s_curve = None
-
         self._busy_controller = False
 
-        self._step_size = None
-
         self._home_coords = None
 
-        self._resolution = None
-
         self.set_x_direction(direction=X_DIRECTION)
         self.set_y_direction(direction=Y_DIRECTION)
 
@@ -261,22 +325,19 @@ class PriorController(serial.Serial):
 
     def move_relative_down(self, value):
         cmd = "D, {z}".format(z=value)
-        self.write_cmd(cmd)
-
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis="Z", value=value)
+        self.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis="Z", value=value)
 
     def move_relative_up(self, value):
         cmd = "U, {z}".format(z=value)
-        self.write_cmd(cmd)
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis="Z", value=value)
+        self.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis="Z", value=value)
 
     @property
     def busy_controller(self):
-        self.reset_input_buffer()
-        self.reset_output_buffer()
+        if self.engine is None:
+            self.reset_input_buffer()
+            self.reset_output_buffer()
 
-        self.write_cmd("$")
-        answer = self.cmd_answer()
+        answer = self.query("$")
         if len(answer) >= 1:
             if answer == '3':
                 return True
@@ -284,8 +345,9 @@ class PriorController(serial.Serial):
                 return False
             elif answer == 'R':
                 return False
-            elif answer == '3\rR':
-                return False
+            elif answer.isdigit():
+                # bits of the moving axes: 1 -> X, 2 -> Y, 4 -> Z
+                return int(answer) != 0
             else:
                 raise ("New value for busy function : {value}".format(value=answer))
         else:
@@ -296,16 +358,64 @@ class PriorController(serial.Serial):
         pass
 
     def cmd_answer(self):
-        # full_answer = self.readline().decode().strip()
-        full_answer = self.read_until(b'\r').decode().strip()
-        return full_answer
-        # self.readline().decode().strip()
-        # return full_answer.split("\r", 1)[0]
+        message = self.read_answer()
+        return "" if message is None else message.text
+
+    def read_answer(self) -> typing.Union[None, Message]:
+        """
+        :return: typed answer of the last written command (recorded by the profiler if enabled), None if nothing was
+                 received before the timeout of the port.
+        """
+        if self.profiler is not None and self._profiled_write is not None:
+            return self._profiled_read_answer()
+        return self.read_message()
+
+    def read_message(self) -> typing.Union[None, Message]:
+        """
+        :return: next typed answer of the controller (Ready, Ack, Position, Error, Limits or Value), None if nothing
+                 was received before the timeout of the port.
+        """
+        return self._framer.read_message(self)
+
+    def reset_input_buffer(self):
+        super().reset_input_buffer()
+        # answers already framed are dropped with the bytes of the port
+        self._framer.clear()
+
+    def refresh(self) -> None:
+        """
+        Forget all the cached settings (XY and Z axes): they will be read again from the controller. To call when the
+        controller was reset or configured by another program.
+        """
+        self._speed = None
+        self._acceleration = None
+        self._s_curve = None
+        self._step_size = None
+        self._resolution = None
+        self._x_direction = None
+        self._y_direction = None
+        if self.z_controller is not None:
+            self.z_controller.refresh()
+
+    def open(self):
+        super().open()
+        # new connection: the controller may have been reset or reconfigured meanwhile
+        self.refresh()
+
+    @staticmethod
+    def parse_setting(answer: str):
+        try:
+            return int(answer)
+        except ValueError:
+            try:
+                return float(answer)
+            except ValueError:
+                return answer
 
     @property
     def s_curve(self):
-        self.write_cmd(cmd="SCS")
-        self._s_curve = self.cmd_answer()
+        if self._s_curve is None:
+            self._s_curve = self.parse_setting(self.query(cmd="SCS"))
         return self._s_curve
 
     def go2limit_switch(self, step: int = 500) -> None:
@@ -329,8 +439,7 @@ class PriorController(serial.Serial):
         self.set_relative_position_steps(x=2 * step, y=2 * step)
         answer_limit = ''
         while answer_limit != '0A':
-            self.write_cmd("LMT")
-            answer_limit = self.cmd_answer()
+            answer_limit = self.query("LMT")
 
             # -X is reached
             if answer_limit == '02':
@@ -347,49 +456,51 @@ class PriorController(serial.Serial):
     @s_curve.setter
     def s_curve(self, value: int):
 
-        self.write_cmd(cmd="SCS,{value}".format(value=value))
         # limit 0 - 100
-        response = self.cmd_answer()
+        response = self.query(cmd="SCS,{value}".format(value=value))
         if response == '0':
+            self._s_curve = value
             Success(feature=sys._getframe().f_code.co_name, value=value)
         else:
+            self._s_curve = None
             Error(feature=sys._getframe().f_code.co_name, response=response)
 
     @property
     def acceleration(self):
-        self.write_cmd(cmd="SAS")
-        self._acceleration = int(self.cmd_answer())
+        if self._acceleration is None:
+            self._acceleration = int(self.query(cmd="SAS"))
         return self._acceleration
 
     @acceleration.setter
     def acceleration(self, value: int) -> None:
-        self.write_cmd(cmd="SAS, {acceleration}".format(acceleration=value))
         # limit 0 - 100
-        response = self.cmd_answer()
+        response = self.query(cmd="SAS, {acceleration}".format(acceleration=value))
         if response == '0':
-            # self._acceleration = value
+            self._acceleration = value
             Success(feature=sys._getframe().f_code.co_name, value=value)
 
         else:
+            self._acceleration = None
             print("error " + sys._getframe().f_code.co_name)
 
     @property
     def resolution(self):
-        self.write_cmd(cmd="RES,s")
-        return self.read(100).decode().strip()
+        if self._resolution is None:
+            self._resolution = self.parse_setting(self.query(cmd="RES,s"))
+        return self._resolution
 
     @resolution.setter
     def resolution(self, value: float):
-        self.write_cmd(cmd="RES,s,{resolution}".format(resolution=value))
-        response = self.cmd_answer()
-        if int(response) == 0:
+        response = self.query(cmd="RES,s,{resolution}".format(resolution=value))
+        if response == '0':
+            self._resolution = value
             Success(feature = sys._getframe().f_code.co_name, value=value)
         else:
+            self._resolution = None
             print("error " + sys._getframe().f_code.co_name)
 
     def set_position_as_home(self):
-        self.write_cmd(cmd="Z")
-        answer = self.cmd_answer()
+        answer = self.query(cmd="Z")
         if answer == '0':
             Success(feature="New home coordinates")
         else:
@@ -403,9 +514,7 @@ class PriorController(serial.Serial):
 
         """
         ##### a chercher
-        self.write_cmd(cmd="SIS")
-
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis="ALL", value=None)
+        self.send_motion(cmd="SIS", feature=sys._getframe().f_code.co_name, axis="ALL", value=None)
 
     @property
     def home_coords(self):
@@ -415,34 +524,296 @@ class PriorController(serial.Serial):
     def home_coords(self, value):
         self._home_coords = (value[0], value[1])
 
-    def write_cmd(self, cmd: str):
+    def write_cmd(self, cmd: str, queue_time: float = 0.):
+        """
+        :param cmd: command without carriage return.
+        :param queue_time: time spent waiting for the port before writing (in s), recorded by the profiler.
+        """
+        # the answers read afterwards are typed according to this command (see prior_protocol.parse_frame)
+        self._framer.mnemonic = get_mnemonic(cmd)
+        if self.profiler is None:
+            self.write((cmd + "\r").encode())
+            return
+
+        write_start = time.perf_counter()
         self.write((cmd + "\r").encode())
+        self._profiled_write = (get_mnemonic(cmd), queue_time, write_start, time.perf_counter())
+
+    def _profiled_read_answer(self) -> typing.Union[None, Message]:
+        """
+        Read the answer of the last written command and record its timings.
+        """
+        mnemonic, queue_time, write_start, write_end = self._profiled_write
+        message = self.read_message()
+        if message is None:
+            full_answer = ""
+            first_byte_time = end_time = time.perf_counter()
+        else:
+            full_answer = message.text
+            first_byte_time, end_time = message.first_byte_time, message.end_time
+
+        if full_answer == "" and mnemonic in MOTION_COMMANDS:
+            # the "R" of the movement has not arrived yet, the next read is timed from the same write
+            return message
+
+        self._profiled_write = None
+        self.profiler.record(mnemonic=mnemonic, queue=queue_time, write=write_end - write_start,
+                             first_byte=first_byte_time - write_start, terminator=end_time - write_start,
+                             response=full_answer)
+        return message
+
+    def enable_profiling(self, profiler: typing.Union[None, SerialProfiler] = None) -> SerialProfiler:
+        """
+        Record the timings of every command (write, first byte and end of the answer) with its answer class, whether
+        the command goes through the I/O engine or not.
+        Usage:
+            profiler = prior.enable_profiling()
+            ...
+            profiler.print_summary()
+            profiler.to_json("serial_profile.json")
+        :param profiler: profiler to fill, a new one is created if None.
+        :return: profiler.
+        """
+        self.profiler = profiler if profiler is not None else SerialProfiler()
+        if self.engine is not None:
+            self.engine.profiler = self.profiler
+        return self.profiler
+
+    def disable_profiling(self) -> typing.Union[None, SerialProfiler]:
+        """
+        :return: profiler which was recording.
+        """
+        profiler = self.profiler
+        self.profiler = None
+        self._profiled_write = None
+        if self.engine is not None:
+            self.engine.profiler = None
+        return profiler
+
+    def query(self, cmd: str, timeout: typing.Union[None, float] = None) -> str:
+        """
+        Write a command and return the answer of the controller. When an I/O engine owns the port, the command goes
+        through its queue, otherwise the write and the read are done in the caller's thread under a lock so two threads
+        can't mix their answers.
+        :param cmd: command without carriage return.
+        :param timeout: maximum waiting time of the answer through the I/O engine (in s), the answer timeout of the
+                        engine if None (derived from the timeout of the port). Without engine, the timeout of the port
+                        applies.
+        :return: answer of the controller, "" if it did not answer in time (as a read timeout of the port).
+        """
+        if self.engine is not None:
+            try:
+                return self.engine.query(cmd, timeout=timeout)
+            except TimeoutError:
+                return ""
+
+        request_time = time.perf_counter()
+        with self._io_lock:
+            self.write_cmd(cmd, queue_time=time.perf_counter() - request_time)
+            return self.cmd_answer()
+
+    def send_motion(self, cmd: str, feature, axis, value, timeout: typing.Union[None, float] = None) -> None:
+        """
+        Write a movement command and wait for the "R" sent by the controller at the end of the movement.
+        :param timeout: maximum duration of the movement (in s), the motion timeout of the engine if None.
+        """
+        self.start_motion(cmd, feature=feature, axis=axis, value=value, timeout=timeout).wait()
+
+    def start_motion(self, cmd: str, feature, axis, value, timeout: typing.Union[None, float] = None) -> MotionHandle:
+        """
+        Write a movement command without waiting for its end. The answer of the controller is read by the I/O engine
+        (started if needed) which resolves the returned handle, so the caller can keep querying the position or queue
+        the next command while the stage moves.
+        :param cmd: movement command ("G", "GR", "M", "U", "D", "V"...).
+        :param feature: name of the feature reported at the end of the movement.
+        :param axis: axis reported at the end of the movement.
+        :param value: value reported at the end of the movement.
+        :param timeout: maximum duration of the movement (in s), the motion timeout of the engine if None. The handle
+                        is failed with a TimeoutError if the "R" does not arrive in time.
+        :return: handle with wait(timeout), done() and add_done_callback().
+        """
+        engine = self.start_engine()
+        self.busy = True
+        handle = engine.submit(cmd, timeout=timeout)
+        handle.add_done_callback(lambda done_handle: self._on_motion_done(done_handle, feature, axis, value))
+        return handle
+
+    def _on_motion_done(self, handle: MotionHandle, feature, axis, value) -> None:
+        engine = self.engine
+        self.busy = engine is not None and engine.router.count_motions() > 0
+        if handle.cancelled():
+            return
+        if handle.exception() is not None:
+            Error(feature=feature, response=str(handle.exception()))
+            return
+        self.report_motion(answer=handle.result(), feature=feature, axis=axis, value=value)
+
+    def move_to(self, x: int, y: int, z: typing.Union[int, None] = None) -> MotionHandle:
+        """
+        Non-blocking absolute movement of the stage.
+        """
+        if z is None:
+            cmd = "G, {x}, {y}".format(x=x, y=y)
+        else:
+            cmd = "G, {x}, {y}, {z}".format(x=x, y=y, z=z)
+        return self.start_motion(cmd, feature="coords", axis="XY", value=(x, y))
+
+    def move_relative(self, x: int = 0, y: int = 0) -> MotionHandle:
+        """
+        Non-blocking relative movement of the stage.
+        """
+        cmd = "GR, {x_value}, {y_value}".format(x_value=x, y_value=y)
+        return self.start_motion(cmd, feature="relative position", axis="XY", value=(x, y))
+
+    def move_home(self) -> MotionHandle:
+        """
+        Non-blocking return to the home position.
+        """
+        return self.start_motion("M", feature="return2home", axis="ALL", value=None)
+
+    def start_engine(self, read_timeout: float = 0.005) -> PriorIOEngine:
+        """
+        Give the serial port to a dedicated I/O thread. Afterwards, every command of this object goes through the
+        command queue of the engine.
+        :param read_timeout: see PriorIOEngine.
+        :return: running engine.
+        """
+        if self.engine is None:
+            self.engine = PriorIOEngine(port=self, read_timeout=read_timeout)
+            self.engine.profiler = self.profiler
+            self.engine.start()
+        return self.engine
+
+    def stop_engine(self) -> None:
+        # getattr: close() can be called by serial.Serial before the end of __init__
+        if getattr(self, "engine", None) is not None:
+            self.engine.stop()
+            self.engine = None
+
+    def close(self):
+        self.stop_engine()
+        # getattr: close() can be called by serial.Serial before the end of __init__
+        if self.is_open and getattr(self, "_io_lock", None) is not None and self.baudrate != DEFAULT_BAUDRATE:
+            # the next connection (COM port discovery) expects the default baud rate
+            self.set_link_baudrate(DEFAULT_BAUDRATE)
+        super().close()
+
+    def upgrade_baudrate(self, max_baudrate: int = max(BAUDRATE_CODES)) -> int:
+        """
+        Negotiate the fastest baud rate supported by the controller up to max_baudrate: each rate is tried from the
+        fastest one and kept if the controller still answers once both ends switched. The link stays on the current
+        baud rate if no faster one works.
+        :param max_baudrate: fastest baud rate to try.
+        :return: baud rate of the link.
+        """
+        for baudrate in sorted(BAUDRATE_CODES, reverse=True):
+            if baudrate > max_baudrate or baudrate <= self.baudrate:
+                continue
+            if self.set_link_baudrate(baudrate):
+                break
+        return self.baudrate
+
+    def set_link_baudrate(self, baudrate: int) -> bool:
+        """
+        Switch the baud rate of the controller ("BAUD" command) then of the port, and check that the controller still
+        answers. On failure the link falls back to the default baud rate (9600).
+        :param baudrate: one of BAUDRATE_CODES.
+        :return: True if the link works at this baud rate.
+        """
+        assert baudrate in BAUDRATE_CODES, "Baud rate should be in {}".format(sorted(BAUDRATE_CODES))
+        # the port is reconfigured: the I/O engine can't read or write meanwhile
+        engine_was_running = self.engine is not None
+        self.stop_engine()
+        try:
+            with self._io_lock:
+                answer = self.query("BAUD, {code}".format(code=BAUDRATE_CODES[baudrate]))
+                if answer == "0":
+                    time.sleep(BAUDRATE_SWITCH_DELAY)
+                    self.baudrate = baudrate
+                    if self.check_link():
+                        Success(feature="baud rate", value=baudrate)
+                        return True
+                    self._fall_back_to_default_baudrate()
+                    answer = "no answer at {baudrate} bauds".format(baudrate=baudrate)
+                elif get_error_code(answer) is None:
+                    # no answer or garbage: the controller may have switched without its acknowledgement being read
+                    self._fall_back_to_default_baudrate()
+
+                Error(feature="baud rate", response=answer)
+                return False
+        finally:
+            if engine_was_running:
+                self.start_engine()
+
+    def find_link_baudrate(self) -> bool:
+        """
+        Find the baud rate of the controller when it does not answer at the one of the port. The controller keeps a
+        negotiated baud rate until a power cycle: a session which crashed or was killed before close() leaves it at
+        this rate, so every rate of BAUDRATE_CODES is probed.
+        :return: True if the controller answers (the port is then at the baud rate of the controller).
+        """
+        if self.check_link():
+            return True
+
+        port_baudrate = self.baudrate
+        for baudrate in sorted(BAUDRATE_CODES, reverse=True):
+            if baudrate == port_baudrate:
+                continue
+            self.baudrate = baudrate
+            if self.check_link():
+                Success(feature="link baud rate", value=baudrate)
+                return True
+
+        self.baudrate = port_baudrate
+        print("[ERROR] : baud rate / the controller does not answer at any baud rate")
+        return False
+
+    def check_link(self) -> bool:
+        """
+        :return: True if the controller answers its serial number at the current baud rate.
+        """
+        self.reset_input_buffer()
+        return self.query("SERIAL").isdigit()
+
+    def _fall_back_to_default_baudrate(self) -> None:
+        # the controller is either on the requested baud rate or still on the previous one: ask it to go back to the
+        # default baud rate at the current rate of the port, then at the default one (harmless if already there)
+        if self.baudrate != DEFAULT_BAUDRATE:
+            self.write_cmd("BAUD, {code}".format(code=BAUDRATE_CODES[DEFAULT_BAUDRATE]))
+            time.sleep(BAUDRATE_SWITCH_DELAY)
+            self.baudrate = DEFAULT_BAUDRATE
+        self.reset_input_buffer()
+        if not self.check_link():
+            print("[ERROR] : baud rate / the controller does not answer at {baudrate} bauds".format(
+                baudrate=DEFAULT_BAUDRATE))
 
     @property
     def step_size(self):
-        self.write_cmd(cmd="X")
-        return self.read(100).decode().strip()
+        if self._step_size is None:
+            self._step_size = self.query(cmd="X")
+        return self._step_size
 
     @step_size.setter
     def step_size(self, value: typing.Tuple):
-        self.write_cmd(cmd="X , {u}, {v}".format(u=value[0], v=value[1]))
-        if int(self.read(100).decode().strip()) == 0:
+        if self.query(cmd="X , {u}, {v}".format(u=value[0], v=value[1])) == '0':
+            self._step_size = "{u},{v}".format(u=value[0], v=value[1])
             print("Change step size success")
         else:
+            self._step_size = None
             print("Error")
 
     def standard_mode(self):
-        self.write(('COMP {value}\r'.format(value=0)).encode())
-
-        if int(self.read(100).decode().strip()) == 0:
+        if int(self.query('COMP {value}'.format(value=0))) == 0:
             return True
         else:
             return False
 
     @property
     def speed(self):
-        self.write(("SMS" + "\r").encode())
-        response = self.cmd_answer()
+        if self._speed is not None:
+            return self._speed
+
+        response = self.query("SMS")
         speed = int(response)
 
         if (speed >= 0) and (speed <= 100):
@@ -453,12 +824,12 @@ class PriorController(serial.Serial):
     def speed(self, value):
         # https://stackoverflow.com/questions/74182624/two-threads-reading-writing-on-the-same-serial-port-at-the-same-time
         cmd = "SMS, {speed}".format(speed=value)
-        self.write_cmd(cmd)
-
-        response = self.cmd_answer()
+        response = self.query(cmd)
         if response == '0':
+            self._speed = value
             Success(feature="speed", value=value)
         else:
+            self._speed = None
             Error(feature=sys._getframe().f_code.co_name, response=response)
 
     @property
@@ -469,9 +840,7 @@ class PriorController(serial.Serial):
         # thread_return2home= threading.Thread(target=self.return2home_with_thread)
         # thread_return2home.start()
         cmd = "M"
-        self.write_cmd(cmd)
-
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis="ALL", value=None)
+        self.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis="ALL", value=None)
 
     def return2home_with_thread(self):
 
@@ -489,16 +858,30 @@ class PriorController(serial.Serial):
 
     @property
     def coords(self) -> str:
-        self.write_cmd("P")
-        pos_coords = self.cmd_answer()
+        pos_coords = self.query("P")
         return pos_coords
 
+    def get_position(self) -> typing.Union[None, typing.Tuple[int, ...]]:
+        """
+        Position of the stage typed by the framer (see prior_protocol.parse_frame): the answer is not parsed again.
+        :return: tuple of coordinates (x, y, z), None if the controller did not answer a position in time.
+        """
+        if self.engine is not None:
+            try:
+                return self.engine.get_position()
+            except TimeoutError:
+                return None
+
+        request_time = time.perf_counter()
+        with self._io_lock:
+            self.write_cmd("P", queue_time=time.perf_counter() - request_time)
+            message = self.read_answer()
+        return message.coords if isinstance(message, Position) else None
+
     @coords.setter
     def coords(self, value: typing.Tuple[int]):
         cmd = "G, {x}, {y}".format(x=value[0], y=value[1])
-        self.write_cmd(cmd)
-
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis="XY", value=value)
+        self.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis="XY", value=value)
 
         # response = self.cmd_answer()
         # if response == 'R':
@@ -509,8 +892,7 @@ class PriorController(serial.Serial):
 
     @property
     def x_position(self) -> int:
-        self.write(("PX" + "\r").encode())
-        x_position = self.cmd_answer()
+        x_position = self.query("PX")
         try:
             return int(x_position.strip())
         except:
@@ -522,9 +904,7 @@ class PriorController(serial.Serial):
     @x_position.setter
     def x_position(self, value: int):
         cmd = "G, {x}, {y}".format(x=value, y=self._y_position)
-        self.write_cmd(cmd=cmd)
-
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis=0, value=value)
+        self.send_motion(cmd=cmd, feature=sys._getframe().f_code.co_name, axis=0, value=value)
 
     def looking_for_position(self, feature, axis, value):
         self.flushOutput()
@@ -536,17 +916,19 @@ class PriorController(serial.Serial):
             answer = self.cmd_answer()
             # time.sleep(2 * self.timeout)
 
+        self.report_motion(answer=answer, feature=feature, axis=axis, value=value)
+        self.busy = False
+
+    @staticmethod
+    def report_motion(answer: str, feature, axis, value) -> None:
         if answer == 'R':
             Success(feature=feature, axis=axis, value=value)
         else:
             Error(feature=feature, response=answer)
 
-        self.busy = False
-
     @property
     def y_position(self) -> int:
-        self.write(("PY" + "\r").encode())
-        y_position = self.cmd_answer()
+        y_position = self.query("PY")
         try:
             return int(y_position.strip())
         except:
@@ -558,9 +940,7 @@ class PriorController(serial.Serial):
     @y_position.setter
     def y_position(self, value: int):
         cmd = "G, {x}, {y}".format(x=self._x_position, y=value)
-        self.write_cmd(cmd)
-
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis=1, value=value)
+        self.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis=1, value=value)
         # if self.cmd_answer() == 'R':
         #     Success(feature="position", axis=1, value=value)
         # else:
@@ -569,12 +949,10 @@ class PriorController(serial.Serial):
     @active_joystick.setter
     def active_joystick(self, value: bool) -> None:
         if value:
-            self.write_cmd("J")
-            if self.cmd_answer() == 0:
+            if self.query("J") == 0:
                 self._active_joystick = True
         else:
-            self.write_cmd("H")
-            if self.cmd_answer() == 0:
+            if self.query("H") == 0:
                 self._active_joystick = False
 
     def initialization(self):
@@ -589,9 +967,9 @@ class PriorController(serial.Serial):
         return info.decode('unicode-escape').encode('unicode-escape').decode()
 
     def emergency_stop(self):
-        self.flushOutput()
-        self.write_cmd("K")
-        response = self.cmd_answer()
+        if self.engine is None:
+            self.flushOutput()
+        response = self.query("K")
 
         if response == 'R' or response == '':
             Success(feature="Emergency stop", value=None)
@@ -600,8 +978,7 @@ class PriorController(serial.Serial):
             Error(feature=sys._getframe().f_code.co_name, response=response)
 
     def stop_movement(self):
-        self.write(("I" + "\r").encode())
-        response = self.read(100).decode().strip()
+        response = self.query("I")
         if response == 'R':
             print("Stop movement")
         else:
@@ -618,33 +995,47 @@ class PriorController(serial.Serial):
             axis = "Y"
             value = y
 
-        self.write_cmd(cmd="GR, {x_value}, {y_value}".format(x_value=x, y_value=y))
+        cmd = "GR, {x_value}, {y_value}".format(x_value=x, y_value=y)
         # response = self.cmd_answer()
         # if response == 'R':
         #     Success(feature="x position, y_position", value=("+" + str(x), "+" + str(y)))
         # else:
         #     Error(feature=sys._getframe().f_code.co_name, response=response)
 
-        self.looking_for_position(feature=sys._getframe().f_code.co_name, axis=axis, value=value)
+        self.send_motion(cmd, feature=sys._getframe().f_code.co_name, axis=axis, value=value)
 
     def wait4available(self):
         while self.busy_controller:
             time.sleep(0.01)
 
+    @property
+    def x_direction(self) -> int:
+        if self._x_direction is None:
+            self._x_direction = self.parse_setting(self.query(cmd="XD"))
+        return self._x_direction
+
+    @property
+    def y_direction(self) -> int:
+        if self._y_direction is None:
+            self._y_direction = self.parse_setting(self.query(cmd="YD"))
+        return self._y_direction
+
     def set_x_direction(self, direction):
-        self.write_cmd(cmd="XD, {}".format(direction))
-        response = self.cmd_answer()
+        response = self.query(cmd="XD, {}".format(direction))
         if response == '0':
+            self._x_direction = direction
             Success(feature="Direction", value=direction, axis="X")
         else:
+            self._x_direction = None
             Error(feature=sys._getframe().f_code.co_name, response=response)
 
     def set_y_direction(self, direction):
-        self.write_cmd(cmd="YD, {}".format(direction))
-        response = self.cmd_answer()
+        response = self.query(cmd="YD, {}".format(direction))
         if response == '0':
+            self._y_direction = direction
             Success(feature="Direction", value=direction, axis="Y")
         else:
+            self._y_direction = None
             Error(feature=sys._getframe().f_code.co_name, response=response)
 
 
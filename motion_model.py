@@ -0,0 +1,100 @@
+import math
+from typing import Sequence
+
+import numpy as np
+
+# 100 % speed of the XY stage (Max_speed: 8mm/s, see PriorController)
+MAX_XY_SPEED = 8000  # µm/s
+MAX_XY_ACCELERATION = 40000  # µm/s²
+MAX_Z_SPEED = 1000  # µm/s
+MAX_Z_ACCELERATION = 5000  # µm/s²
+
+
+def get_travel_time(distance: float, speed: float, acceleration: float) -> float:
+    """
+    Duration of a trapezoidal (or triangular for short distances) velocity profile.
+    :param distance: absolute distance (in µm).
+    :param speed: maximum speed (in µm/s).
+    :param acceleration: acceleration and deceleration (in µm/s²).
+    :return: duration of the movement (in s).
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0.
+    if distance <= speed ** 2 / acceleration:
+        return 2 * math.sqrt(distance / acceleration)
+    return distance / speed + speed / acceleration
+
+
+def get_travelled_distance(elapsed: float, distance: float, speed: float, acceleration: float) -> float:
+    """
+    Distance covered after elapsed seconds following the velocity profile of get_travel_time.
+    """
+    distance = abs(distance)
+    duration = get_travel_time(distance, speed, acceleration)
+    if elapsed >= duration:
+        return distance
+    # peak speed reached (lower than speed for a triangular profile)
+    peak_speed = min(speed, math.sqrt(distance * acceleration))
+    ramp_time = peak_speed / acceleration
+    if elapsed <= ramp_time:
+        return acceleration * elapsed ** 2 / 2
+    ramp_distance = peak_speed ** 2 / (2 * acceleration)
+    if elapsed <= duration - ramp_time:
+        return ramp_distance + peak_speed * (elapsed - ramp_time)
+    remaining = duration - elapsed
+    return distance - acceleration * remaining ** 2 / 2
+
+
+def get_travel_times(distances: np.ndarray, speed: float, acceleration: float) -> np.ndarray:
+    """
+    Vectorized get_travel_time.
+    :param distances: array of distances (in µm).
+    :return: array of durations (in s).
+    """
+    distances = np.abs(np.asarray(distances, dtype=np.float64))
+    triangular = 2 * np.sqrt(distances / acceleration)
+    trapezoidal = distances / speed + speed / acceleration
+    return np.where(distances <= speed ** 2 / acceleration, triangular, trapezoidal)
+
+
+class StageKinematics:
+    def __init__(self, speed: float = MAX_XY_SPEED / 2, acceleration: float = MAX_XY_ACCELERATION / 2):
+        """
+        Travel time model of the XY stage: both axes move at the same time, each one with a trapezoidal velocity
+        profile, so a movement lasts as long as its slowest axis.
+        :param speed: maximum speed of each axis (in µm/s).
+        :param acceleration: acceleration of each axis (in µm/s²).
+        """
+        self.speed = speed
+        self.acceleration = acceleration
+
+    @classmethod
+    def from_settings(cls, speed: int, acceleration: int):
+        """
+        :param speed: speed setting of the controller ("SMS", percentage of the maximum speed).
+        :param acceleration: acceleration setting of the controller ("SAS", percentage of the maximum acceleration).
+        """
+        return cls(speed=MAX_XY_SPEED * speed / 100, acceleration=MAX_XY_ACCELERATION * acceleration / 100)
+
+    @classmethod
+    def from_controller(cls, prior):
+        """
+        :param prior: PriorController (its cached speed and acceleration are used).
+        """
+        return cls.from_settings(speed=prior.speed, acceleration=prior.acceleration)
+
+    def move_time(self, source: Sequence, destination: Sequence) -> float:
+        return max(get_travel_time(destination[0] - source[0], self.speed, self.acceleration),
+                   get_travel_time(destination[1] - source[1], self.speed, self.acceleration))
+
+    def path_time(self, positions: np.ndarray) -> float:
+        """
+        :param positions: (N, 2) array of positions visited one after the other.
+        :return: travel time of the whole path (in s), stops included.
+        """
+        if len(positions) < 2:
+            return 0.
+        moves = np.diff(np.asarray(positions), axis=0)
+        times = get_travel_times(moves, self.speed, self.acceleration)
+        return float(times.max(axis=1).sum())
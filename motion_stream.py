@@ -0,0 +1,139 @@
+import collections
+import threading
+import typing
+
+from prior_engine import PriorIOEngine, MotionHandle, get_error_code
+
+QUEUE_FULL_ERROR = 18
+# probe sent after each streamed movement: its answer tells that the movement was accepted by the controller
+ACCEPTANCE_PROBE = "$"
+
+
+class MotionStreamer:
+    def __init__(self, engine: PriorIOEngine, waypoints: typing.Sequence, depth: int = 4,
+                 on_waypoint_reached: typing.Union[None, typing.Callable] = None,
+                 on_finished: typing.Union[None, typing.Callable] = None):
+        """
+        Stream the waypoints of a grid into the command queue of the ProScan controller. Instead of waiting for the
+        "R" of each movement before sending the next one, the controller queue is kept topped up with the upcoming
+        waypoints so the stage chains the movements without any host round trip between two tiles.
+        Waypoints are sent one at a time and followed by a "$" probe: the answer of the probe proves that the
+        movement was accepted, so a refused movement can be sent again without changing the order of the waypoints.
+        When the controller answers QUEUE FULL, the depth is reduced to the number of movements it accepted and the
+        refused waypoint is sent again at the next "R".
+        :param engine: running I/O engine of the controller.
+        :param waypoints: sequence of (x, y) or (x, y, z) positions.
+        :param depth: maximum number of movements queued in the controller.
+        :param on_waypoint_reached: function called with (index, waypoint) when a waypoint is reached.
+        :param on_finished: function called without argument when the last waypoint is reached or the stream stopped.
+        """
+        self.engine = engine
+        self.waypoints = waypoints
+        self.depth = depth
+        self.on_waypoint_reached = on_waypoint_reached
+        self.on_finished = on_finished
+
+        self._lock = threading.Lock()
+        self._next_index = 0
+        self._queued = collections.deque()
+        self._probing = False
+        self._running = False
+        self._finished = threading.Event()
+
+        self.reached_count = 0
+        self.queue_full_count = 0
+
+    @property
+    def queue_fill(self) -> int:
+        """
+        Number of movements accepted by the controller and not finished yet.
+        """
+        return len(self._queued)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def start(self) -> None:
+        self._running = True
+        self._fill()
+
+    def stop(self) -> None:
+        """
+        Stop feeding the controller. Movements already queued by the controller are still executed.
+        """
+        with self._lock:
+            self._running = False
+            finished = not self._queued and not self._probing
+        if finished:
+            self._finish()
+
+    def wait(self, timeout: typing.Union[float, None] = None) -> bool:
+        return self._finished.wait(timeout=timeout)
+
+    @staticmethod
+    def get_command(waypoint) -> str:
+        if len(waypoint) > 2 and waypoint[2] is not None:
+            return "G, {x}, {y}, {z}".format(x=waypoint[0], y=waypoint[1], z=waypoint[2])
+        return "G, {x}, {y}".format(x=waypoint[0], y=waypoint[1])
+
+    def _fill(self) -> None:
+        with self._lock:
+            if not self._running or self._probing or len(self._queued) >= self.depth:
+                return
+            if self._next_index >= len(self.waypoints):
+                return
+            index = self._next_index
+            self._next_index += 1
+            self._probing = True
+
+        handle = self.engine.submit(self.get_command(self.waypoints[index]))
+        handle.add_done_callback(lambda done_handle: self._on_motion_answer(index, done_handle))
+        probe = self.engine.submit(ACCEPTANCE_PROBE)
+        probe.add_done_callback(lambda _: self._on_probe_answer(index, handle))
+
+    def _on_probe_answer(self, index: int, handle: MotionHandle) -> None:
+        with self._lock:
+            self._probing = False
+            if not handle.done():
+                self._queued.append(index)
+        self._fill()
+
+    def _on_motion_answer(self, index: int, handle: MotionHandle) -> None:
+        if handle.cancelled() or handle.exception() is not None:
+            self._finish()
+            return
+
+        answer = handle.result()
+        if answer == "R":
+            with self._lock:
+                if self._queued and self._queued[0] == index:
+                    self._queued.popleft()
+                self.reached_count += 1
+                last = self.reached_count >= len(self.waypoints) or \
+                    (not self._running and not self._queued and not self._probing)
+            if self.on_waypoint_reached is not None:
+                self.on_waypoint_reached(index, self.waypoints[index])
+            if last:
+                self._finish()
+            else:
+                self._fill()
+
+        elif get_error_code(answer) == QUEUE_FULL_ERROR:
+            with self._lock:
+                # the controller holds as many movements as it accepted: send the refused waypoint again later
+                self.queue_full_count += 1
+                self.depth = max(1, len(self._queued))
+                self._next_index = index
+
+        else:
+            print("[ERROR] : streamed waypoint {index} / {answer}".format(index=index, answer=answer))
+            with self._lock:
+                self._running = False
+            self._finish()
+
+    def _finish(self) -> None:
+        if not self._finished.is_set():
+            self._finished.set()
+            if self.on_finished is not None:
+                self.on_finished()
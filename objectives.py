@@ -0,0 +1,83 @@
+import math
+from typing import Tuple, Dict
+
+import numpy as np
+
+
+class ObjectiveProfile:
+    def __init__(self, name: str, pixel_scale: float, sensor_size: Tuple[int, int], overlap: Tuple[float, float]):
+        """
+        Tiling of an objective: field of view given by the camera and independent overlap along x and y.
+        :param name: name of the objective ("x40"...).
+        :param pixel_scale: number of camera pixels per µm in the sample plane.
+        :param sensor_size: width and height of the camera image (in pixels).
+        :param overlap: overlap between two neighbouring tiles along x and y (in µm).
+        """
+        self.name = name
+        self.pixel_scale = pixel_scale
+        self.sensor_size = sensor_size
+        self.overlap = overlap
+        if any(self.overlap[axis] >= self.field_of_view[axis] or self.overlap[axis] < 0 for axis in range(2)):
+            raise ValueError("The overlap of {name} has to be in [0, field of view {fov}) µm".format(
+                name=name, fov=self.field_of_view))
+
+    @classmethod
+    def from_overlap_percentage(cls, name: str, pixel_scale: float, sensor_size: Tuple[int, int],
+                                overlap_percentage: Tuple[float, float]) -> "ObjectiveProfile":
+        """
+        :param overlap_percentage: overlap along x and y (in % of the field of view).
+        """
+        field_of_view = (sensor_size[0] / pixel_scale, sensor_size[1] / pixel_scale)
+        return cls(name=name, pixel_scale=pixel_scale, sensor_size=sensor_size,
+                   overlap=(field_of_view[0] * overlap_percentage[0] / 100,
+                            field_of_view[1] * overlap_percentage[1] / 100))
+
+    @property
+    def field_of_view(self) -> Tuple[float, float]:
+        """
+        Width and height of a tile in the sample (in µm).
+        """
+        return self.sensor_size[0] / self.pixel_scale, self.sensor_size[1] / self.pixel_scale
+
+    @property
+    def pitch(self) -> Tuple[float, float]:
+        """
+        Exact distance between two neighbouring tiles along x and y (in µm). It is not rounded: the positions are
+        rounded one by one (see get_positions) so the rounding error does not add up along a row.
+        """
+        field_of_view = self.field_of_view
+        return field_of_view[0] - self.overlap[0], field_of_view[1] - self.overlap[1]
+
+    @property
+    def overlap_percentage(self) -> Tuple[float, float]:
+        field_of_view = self.field_of_view
+        return self.overlap[0] / field_of_view[0] * 100, self.overlap[1] / field_of_view[1] * 100
+
+    def get_positions(self, start_pt: Tuple[int, int], indices: np.ndarray) -> np.ndarray:
+        """
+        :param start_pt: position of the tile (0, 0).
+        :param indices: (N, 2) (column, row) indices of the tiles.
+        :return: (N, 2) int32 positions of the tiles (in µm).
+        """
+        return (np.rint(np.asarray(indices) * np.array(self.pitch)) + np.array(start_pt)).astype(np.int32)
+
+    def get_matrix(self, area_size: Tuple[float, float]) -> Tuple[int, int]:
+        """
+        :param area_size: width and height of the area to image (in µm).
+        :return: smallest number of tiles (columns, rows) covering the area.
+        """
+        return tuple(max(1, math.ceil((area_size[axis] - self.field_of_view[axis]) / self.pitch[axis]) + 1)
+                     for axis in range(2))
+
+    def __repr__(self):
+        return "ObjectiveProfile(name={!r}, pixel_scale={}, sensor_size={}, overlap={})".format(
+            self.name, self.pixel_scale, self.sensor_size, self.overlap)
+
+
+# Olympus x40 on the IDS camera (2448 x 2048 pixels): 11.6372 px/µm, the overlap is the 40 % used so far
+OBJECTIVES: Dict[str, ObjectiveProfile] = {
+    "x40": ObjectiveProfile.from_overlap_percentage(name="x40", pixel_scale=11.6372, sensor_size=(2448, 2048),
+                                                    overlap_percentage=(40, 40)),
+    "x4": ObjectiveProfile(name="x4", pixel_scale=1.16372, sensor_size=(2448, 2048), overlap=(0, 0)),
+}
+DEFAULT_OBJECTIVE = "x40"
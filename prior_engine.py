@@ -0,0 +1,437 @@
+import collections
+import queue
+import threading
+import time
+import typing
+from concurrent.futures import Future, TimeoutError
+
+from prior_protocol import Message, Position, ResponseFramer, parse_frame
+
+# Commands whose answer is the "R" sent by the controller once the movement is finished.
+MOTION_COMMANDS = ("G", "GR", "M", "U", "D", "V", "SIS", "K", "I")
+# Commands whose answer spans several lines, associated with the line closing the answer.
+MULTILINE_COMMANDS = {"?": "END"}
+# a command which is not answered within ANSWER_TIMEOUT_FACTOR times the timeout of the port (at least
+# MIN_ANSWER_TIMEOUT s) after its writing is failed with a TimeoutError, so a lost answer never blocks its caller
+ANSWER_TIMEOUT_FACTOR = 10
+MIN_ANSWER_TIMEOUT = 0.5
+# maximum duration of a movement (in s) before its handle is failed with a TimeoutError
+MOTION_TIMEOUT = 120.
+
+
+def get_mnemonic(cmd: str) -> str:
+    """
+    Extract the mnemonic of a ProScan command: "G, 100, 200" -> "G", "RES,s" -> "RES".
+    :param cmd: command written on the serial port (without the carriage return).
+    :return: upper case mnemonic of the command.
+    """
+    return cmd.split(",")[0].strip().upper()
+
+
+def get_error_code(answer: str) -> typing.Union[None, int]:
+    """
+    :param answer: answer of the controller.
+    :return: code of the error if the answer is an error like "E,18", None otherwise.
+    """
+    if not answer.startswith("E"):
+        return None
+    try:
+        return int(answer.split(",")[-1])
+    except ValueError:
+        return None
+
+
+def get_answer_timeout(port_timeout: typing.Union[None, float]) -> float:
+    """
+    :param port_timeout: read timeout of the serial port (in s), None for a blocking port.
+    :return: maximum waiting time of the answer of a command once written (in s).
+    """
+    if not port_timeout:
+        return MIN_ANSWER_TIMEOUT
+    return max(MIN_ANSWER_TIMEOUT, ANSWER_TIMEOUT_FACTOR * port_timeout)
+
+
+class MotionHandle(Future):
+    def __init__(self, cmd: str):
+        """
+        Completion handle of a movement, resolved with the answer of the controller ("R" or "E,n") by the thread which
+        reads the serial port. The caller can wait for it, poll it with done() or add callbacks, and keep sending
+        commands (position requests, next movement...) while the stage moves.
+        :param cmd: movement command.
+        """
+        super().__init__()
+        self.cmd = cmd
+        self.start_time = time.monotonic()
+        self.end_time = None
+        self.add_done_callback(self._set_end_time)
+
+    def _set_end_time(self, _) -> None:
+        self.end_time = time.monotonic()
+
+    def wait(self, timeout: typing.Union[float, None] = None) -> bool:
+        """
+        Block until the end of the movement.
+        :param timeout: maximum waiting time (in s). With None, the wait is bounded by the motion timeout of the
+                        engine, which fails the handle when the "R" does not arrive.
+        :return: True if the movement is finished (successfully or not), False if the timeout expired.
+        """
+        try:
+            self.exception(timeout=timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    @property
+    def reached(self) -> bool:
+        return self.done() and not self.cancelled() and self.exception() is None and self.result() == "R"
+
+    @property
+    def duration(self) -> typing.Union[float, None]:
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+class PendingCommand:
+    def __init__(self, cmd: str, timeout: typing.Union[None, float] = None, typed: bool = False):
+        """
+        :param timeout: maximum waiting time of the answer once the command is written (in s), None for no limit.
+        :param typed: resolve the future with the typed answer (see prior_protocol.parse_frame) instead of its text.
+                      Movements and multi-line answers are always resolved with text.
+        """
+        self.cmd = cmd
+        self.timeout = timeout
+        self.typed = typed
+        # time (time.monotonic) after which the command is failed, known once written
+        self.deadline = None
+        self.mnemonic = get_mnemonic(cmd)
+        self.waits_ready = self.mnemonic in MOTION_COMMANDS
+        self.future = MotionHandle(cmd) if self.waits_ready else Future()
+        # movements only: the controller took the movement into account (no error sent back)
+        self.accepted = False
+        # failed by ResponseRouter.expire: the command stays pending to absorb its late answer
+        self.expired = False
+        self.last_line = MULTILINE_COMMANDS.get(self.mnemonic)
+        self.lines = []
+        # time stamps (time.perf_counter) used by the serial profiler
+        self.submit_time = time.perf_counter()
+        self.write_start = None
+        self.write_end = None
+        self.first_byte_time = None
+
+
+class ResponseRouter:
+    def __init__(self):
+        """
+        The router matches each answer of the controller with the command which asked it. The controller answers the
+        commands in the order they were sent, except for the movements whose "R" arrives once the stage has stopped:
+        - "R" resolves the oldest pending movement;
+        - any other answer ("0", "x,y,z", "E,n", values...) goes to the oldest pending command in sending order,
+          skipping the movements already accepted by the controller. A movement is accepted as soon as an answer
+          which is not an error arrives after it: an "E,n" reaching a movement which is not accepted yet is its
+          refusal (QUEUE FULL, VALUE OUT OF RANGE...). An error without any candidate is sent back to the oldest
+          movement (error during the movement).
+        Answers that do not match any command are given to unsolicited_callback.
+        A command whose answer is late is failed but stays pending until its answer arrives, the answer is then
+        dropped: otherwise it would be given to the next command and every later answer would be shifted by one.
+        """
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self.unsolicited_callback = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def register(self, pending_command: PendingCommand) -> None:
+        with self._lock:
+            self._pending.append(pending_command)
+
+    def route(self, frame: bytes) -> typing.Tuple[typing.Union[None, PendingCommand], Message]:
+        """
+        Match an answer with its command and type it by the mnemonic of this command (positions and limit switches are
+        only recognized for the commands which asked them, see prior_protocol.parse_frame).
+        :param frame: answer without the carriage return nor surrounding spaces.
+        :return: command answered (None if the answer is unsolicited or late) and typed answer.
+        """
+        is_error = frame[:1] == b"E"
+        with self._lock:
+            if frame == b"R":
+                pending_command = self._first_motion()
+            else:
+                pending_command = self._first_answering(is_error)
+                if pending_command is None and is_error:
+                    pending_command = self._first_motion()
+            message = parse_frame(frame, None if pending_command is None else pending_command.mnemonic)
+
+            if pending_command is not None:
+                if pending_command.last_line is not None:
+                    pending_command.lines.append(message.text)
+                    if message.text != pending_command.last_line:
+                        # multi-line answer which is not finished yet
+                        return pending_command, message
+                self._pending.remove(pending_command)
+
+        if pending_command is None:
+            if self.unsolicited_callback is not None:
+                self.unsolicited_callback(message.text)
+        elif pending_command.expired:
+            # late answer of a command already failed
+            return None, message
+        elif not pending_command.future.done():
+            if pending_command.last_line is not None:
+                pending_command.future.set_result("\r".join(pending_command.lines))
+            elif pending_command.typed:
+                pending_command.future.set_result(message)
+            else:
+                pending_command.future.set_result(message.text)
+
+        return pending_command, message
+
+    def expire(self, now: float) -> typing.List[PendingCommand]:
+        """
+        Fail with a TimeoutError the commands whose answer did not arrive before their deadline. They are kept pending
+        for one more timeout to absorb their late answer, and forgotten after it (answer lost).
+        :param now: current time (time.monotonic).
+        :return: commands failed by this call.
+        """
+        with self._lock:
+            late = [pending_command for pending_command in self._pending
+                    if pending_command.deadline is not None and now > pending_command.deadline]
+            expired = []
+            for pending_command in late:
+                if pending_command.expired:
+                    self._pending.remove(pending_command)
+                else:
+                    pending_command.expired = True
+                    pending_command.deadline = now + pending_command.timeout
+                    expired.append(pending_command)
+        for pending_command in expired:
+            if not pending_command.future.done():
+                pending_command.future.set_exception(TimeoutError("No answer to {cmd} after {timeout} s".format(
+                    cmd=pending_command.cmd, timeout=pending_command.timeout)))
+        return expired
+
+    def count_motions(self) -> int:
+        with self._lock:
+            return sum(pending_command.waits_ready and not pending_command.expired for pending_command in self._pending)
+
+    def _first_motion(self) -> typing.Union[None, PendingCommand]:
+        for pending_command in self._pending:
+            if pending_command.waits_ready:
+                return pending_command
+        return None
+
+    def _first_answering(self, is_error: bool) -> typing.Union[None, PendingCommand]:
+        for pending_command in self._pending:
+            if not pending_command.waits_ready:
+                return pending_command
+            if not pending_command.accepted:
+                if is_error:
+                    return pending_command
+                pending_command.accepted = True
+        return None
+
+    def cancel_all(self, reason: str) -> None:
+        with self._lock:
+            pending_commands = list(self._pending)
+            self._pending.clear()
+        for pending_command in pending_commands:
+            if not pending_command.future.done():
+                pending_command.future.set_exception(ConnectionError(reason))
+
+
+class PriorIOEngine(threading.Thread):
+    def __init__(self, port, read_timeout: float = 0.005, answer_timeout: typing.Union[None, float] = None,
+                 motion_timeout: float = MOTION_TIMEOUT):
+        """
+        Dedicated thread which owns the serial port of the PRIOR controller. Callers never touch the port: they submit
+        commands and get back futures which are resolved by the response router when the answer arrives. Only this
+        thread writes and reads, so there is no lock nor busy loop on in_waiting anymore.
+        Callbacks added on the futures are called in this thread: they have to be short (emit a Qt signal, set a
+        value...).
+        :param port: opened serial port (PriorController or serial.Serial).
+        :param read_timeout: maximum time (in s) the thread blocks on the port when nothing is received. It is the
+                             worst latency before sending a newly submitted command.
+        :param answer_timeout: maximum waiting time of an answer once its command is written (in s), derived from the
+                               timeout of the port if None (see get_answer_timeout). The future of a command which is
+                               not answered in time is failed with a TimeoutError.
+        :param motion_timeout: maximum waiting time of the "R" of a movement once written (in s).
+        The profiler attribute can be set to a SerialProfiler to record the timings of each answered command.
+        """
+        super().__init__(daemon=True)
+        self.port = port
+        self.read_timeout = read_timeout
+        self.answer_timeout = get_answer_timeout(port.timeout) if answer_timeout is None else answer_timeout
+        self.motion_timeout = motion_timeout
+
+        self.router = ResponseRouter()
+        self._outgoing = queue.Queue()
+        self._framer = ResponseFramer()
+        self._running = False
+        # submit and the end of run are exclusive: a command is either refused or drained by run
+        self._submit_lock = threading.Lock()
+        self.profiler = None
+
+        self._position_callback = None
+        self._polling_period = None
+        self._next_poll = 0.
+        self._poll_in_flight = False
+
+    @property
+    def unsolicited_callback(self):
+        return self.router.unsolicited_callback
+
+    @unsolicited_callback.setter
+    def unsolicited_callback(self, value) -> None:
+        self.router.unsolicited_callback = value
+
+    def submit(self, cmd: str, timeout: typing.Union[None, float] = None, typed: bool = False) -> Future:
+        """
+        Queue a command to be written by the I/O thread.
+        :param cmd: command without carriage return like "G, 100, 200".
+        :param timeout: maximum waiting time of the answer once the command is written (in s), answer_timeout (or
+                        motion_timeout for movements) if None.
+        :param typed: resolve the future with the typed answer (Position, Ack, Error... see prior_protocol) instead of
+                      its text, so it is not parsed again.
+        :return: future resolved with the answer of the controller ("0", "x,y,z", "E,n"...). Movements get a
+                 MotionHandle resolved with "R" at the end of the movement. The future is failed with a TimeoutError
+                 if the answer does not arrive in time, with a ConnectionError if the engine stops.
+        """
+        if timeout is None:
+            timeout = self.motion_timeout if get_mnemonic(cmd) in MOTION_COMMANDS else self.answer_timeout
+        pending_command = PendingCommand(cmd, timeout=timeout, typed=typed)
+        with self._submit_lock:
+            if self._running:
+                self._outgoing.put(pending_command)
+                return pending_command.future
+        pending_command.future.set_exception(ConnectionError("The serial I/O engine is not running"))
+        return pending_command.future
+
+    def query(self, cmd: str, timeout: typing.Union[float, None] = None) -> str:
+        """
+        Blocking helper: submit a command and wait for its answer.
+        :param timeout: maximum waiting time of the answer once written (in s), answer_timeout if None.
+        :raise TimeoutError: no answer in time.
+        """
+        return self.submit(cmd, timeout=timeout).result()
+
+    def get_position(self, timeout: typing.Union[float, None] = None) -> typing.Union[None, typing.Tuple[int, ...]]:
+        """
+        Blocking helper: position of the stage ("P" command).
+        :return: tuple of coordinates (x, y, z), None if the answer is not a position.
+        :raise TimeoutError: no answer in time.
+        """
+        message = self.submit("P", timeout=timeout, typed=True).result()
+        return message.coords if isinstance(message, Position) else None
+
+    def start_position_polling(self, callback: typing.Callable, period: float = 0.1) -> None:
+        """
+        Ask periodically the position of the stage ("P" command). A new "P" is only sent once the previous one was
+        answered, so position requests never pile up on the serial link.
+        :param callback: function called in the I/O thread with the tuple of coordinates (x, y, z).
+        :param period: time between two position requests (in s).
+        """
+        self._position_callback = callback
+        self._polling_period = period
+        self._next_poll = 0.
+
+    def stop_position_polling(self) -> None:
+        self._polling_period = None
+
+    @property
+    def position_polling(self) -> typing.Tuple[typing.Union[None, typing.Callable], typing.Union[None, float]]:
+        """
+        :return: callback and period of the position polling (period None when the polling is stopped).
+        """
+        return self._position_callback, self._polling_period
+
+    def start(self) -> None:
+        self._running = True
+        super().start()
+
+    def stop(self, timeout: typing.Union[float, None] = 1.) -> None:
+        self._running = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout=timeout)
+
+    def run(self) -> None:
+        port_timeout = self.port.timeout
+        self.port.timeout = self.read_timeout
+        try:
+            while self._running:
+                self._poll_position_if_due()
+                self._write_pending_commands()
+                self._read_available()
+                self.router.expire(time.monotonic())
+        except Exception as e:
+            print("[ERROR] : serial I/O engine / {error}".format(error=str(e)))
+        finally:
+            with self._submit_lock:
+                self._running = False
+                while not self._outgoing.empty():
+                    self.router.register(self._outgoing.get_nowait())
+            self.port.timeout = port_timeout
+            self.router.cancel_all(reason="The serial I/O engine was stopped")
+
+    def _write_pending_commands(self) -> None:
+        while True:
+            try:
+                pending_command = self._outgoing.get_nowait()
+            except queue.Empty:
+                return
+            # register before writing: the answer can't be read before its command is known by the router
+            self.router.register(pending_command)
+            pending_command.write_start = time.perf_counter()
+            self.port.write((pending_command.cmd + "\r").encode())
+            pending_command.write_end = time.perf_counter()
+            if pending_command.timeout is not None:
+                pending_command.deadline = time.monotonic() + pending_command.timeout
+
+    def _read_available(self) -> None:
+        # each answer is typed by the command it answers, known once the previous answers are routed
+        routed = []
+        self._framer.read_from(self.port, typer=lambda frame: self._route(frame, routed))
+        if self.profiler is not None:
+            # the time stamps of the answers are set by the framer once typed
+            for pending_command, message in routed:
+                if pending_command is not None:
+                    self._profile(pending_command, message)
+
+    def _route(self, frame: bytes, routed: list) -> Message:
+        pending_command, message = self.router.route(frame)
+        routed.append((pending_command, message))
+        return message
+
+    def _profile(self, pending_command: PendingCommand, message: Message) -> None:
+        if pending_command.first_byte_time is None:
+            pending_command.first_byte_time = message.first_byte_time
+        if not pending_command.future.done() or pending_command.future.cancelled():
+            # multi-line answer not finished yet
+            return
+        self.profiler.record(mnemonic=pending_command.mnemonic,
+                             queue=pending_command.write_start - pending_command.submit_time,
+                             write=pending_command.write_end - pending_command.write_start,
+                             first_byte=pending_command.first_byte_time - pending_command.write_start,
+                             terminator=message.end_time - pending_command.write_start,
+                             response=message.text)
+
+    def _poll_position_if_due(self) -> None:
+        if self._polling_period is None or self._poll_in_flight:
+            return
+
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+
+        self._next_poll = now + self._polling_period
+        self._poll_in_flight = True
+        self.submit("P", typed=True).add_done_callback(self._on_position_answer)
+
+    def _on_position_answer(self, future: Future) -> None:
+        self._poll_in_flight = False
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        message = future.result()
+        if isinstance(message, Position) and self._position_callback is not None:
+            self._position_callback(message.coords)
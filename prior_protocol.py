@@ -0,0 +1,218 @@
+import collections
+import time
+import typing
+
+# commands answered by a position "x,y,z" (or "x,y"), and by the limit switches "0A"
+POSITION_COMMANDS = ("P",)
+LIMITS_COMMANDS = ("LMT",)
+# bytes stripped around an answer
+WHITESPACE = b" \t\n\x00"
+
+
+class Message:
+    __slots__ = ("raw", "first_byte_time", "end_time")
+
+    def __init__(self, raw: bytes):
+        """
+        Answer of the PRIOR controller, framed by the carriage return.
+        :param raw: bytes of the answer without the carriage return.
+        """
+        self.raw = raw
+        # time.perf_counter() at the reception of the first byte and of the carriage return of the answer
+        self.first_byte_time = None
+        self.end_time = None
+
+    @property
+    def text(self) -> str:
+        return self.raw.decode(errors="replace")
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.raw == other.raw
+
+    def __hash__(self):
+        return hash((type(self), self.raw))
+
+    def __repr__(self):
+        return "{name}({text!r})".format(name=type(self).__name__, text=self.text)
+
+
+class Ready(Message):
+    """
+    "R": end of a movement.
+    """
+    __slots__ = ()
+
+
+class Ack(Message):
+    """
+    "0": command executed (it is also the answer of some queries like "$" when nothing moves).
+    """
+    __slots__ = ()
+
+
+class Position(Message):
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, raw: bytes, x: int, y: int, z: typing.Union[None, int] = None):
+        """
+        "x,y,z" or "x,y": answer of "P" command.
+        """
+        super().__init__(raw)
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @property
+    def coords(self) -> typing.Tuple[int, ...]:
+        if self.z is None:
+            return self.x, self.y
+        return self.x, self.y, self.z
+
+
+class Error(Message):
+    __slots__ = ("code",)
+
+    def __init__(self, raw: bytes, code: int):
+        """
+        "E,n": error of code n.
+        """
+        super().__init__(raw)
+        self.code = code
+
+
+class Limits(Message):
+    __slots__ = ("bits",)
+
+    def __init__(self, raw: bytes, bits: int):
+        """
+        Two hexadecimal digits like "0A": answer of "LMT" command, one bit per limit switch (+X, -X, +Y, -Y...).
+        """
+        super().__init__(raw)
+        self.bits = bits
+
+
+class Value(Message):
+    """
+    Any other answer: value of a setting, status, line of a multi-line answer...
+    """
+    __slots__ = ()
+
+
+def parse_frame(frame: bytes, mnemonic: typing.Union[None, str] = None) -> Message:
+    """
+    Type an answer of the controller. "R", "0" and "E,n" have the same meaning for every command; positions and limit
+    switches are only recognized for the command which asked them, since other answers have the same shape (the step
+    size "1,1", a setting "0A"...). The bytes are parsed directly (int() accepts bytes), they are only decoded when the
+    text of the answer is asked.
+    :param frame: answer without the carriage return nor surrounding spaces.
+    :param mnemonic: mnemonic of the command answered (see prior_engine.get_mnemonic), None if unknown.
+    """
+    if frame == b"R":
+        return Ready(frame)
+    if frame == b"0":
+        return Ack(frame)
+    if frame[:2] == b"E,":
+        try:
+            return Error(frame, int(frame[2:]))
+        except ValueError:
+            return Value(frame)
+    if mnemonic in POSITION_COMMANDS:
+        values = frame.split(b",")
+        if 2 <= len(values) <= 3:
+            try:
+                return Position(frame, *[int(value) for value in values])
+            except ValueError:
+                pass
+    elif mnemonic in LIMITS_COMMANDS:
+        try:
+            return Limits(frame, int(frame, 16))
+        except ValueError:
+            pass
+    return Value(frame)
+
+
+class ResponseFramer:
+    def __init__(self):
+        """
+        Incremental framer of the answers of the controller. The bytes available on the port are read in one call and
+        appended to a reusable buffer, the complete answers (closed by a carriage return) are cut out of it and typed
+        with parse_frame. Answers merged in one read ("3\rR") or fragmented over several reads are framed the same way.
+        """
+        self._buffer = bytearray()
+        self._messages = collections.deque()
+        self._frame_start_time = None
+        # mnemonic of the command whose answers are read (see parse_frame), None if unknown
+        self.mnemonic = None
+
+    @property
+    def pending_bytes(self) -> int:
+        """
+        Number of received bytes of an answer which is not finished yet.
+        """
+        return len(self._buffer)
+
+    def clear(self) -> None:
+        self._buffer.clear()
+        self._messages.clear()
+
+    def feed(self, data: bytes, typer: typing.Union[None, typing.Callable[[bytes], Message]] = None) \
+            -> typing.List[Message]:
+        """
+        :param data: bytes read on the serial port.
+        :param typer: function typing each answer, called in their order of arrival (parse_frame with the mnemonic
+                      attribute if None). The I/O engine types each answer by the command it answers, which is only
+                      known once the previous answers are routed.
+        :return: answers completed by these bytes, in their order of arrival.
+        """
+        now = time.perf_counter()
+        if not self._buffer:
+            self._frame_start_time = now
+        self._buffer += data
+
+        messages = []
+        start = 0
+        end = self._buffer.find(b"\r")
+        # the frames are cut out of a view of the buffer: the bytes of each answer are copied once, into its message
+        with memoryview(self._buffer) as view:
+            while end != -1:
+                frame_start, frame_end = start, end
+                while frame_start < frame_end and view[frame_start] in WHITESPACE:
+                    frame_start += 1
+                while frame_end > frame_start and view[frame_end - 1] in WHITESPACE:
+                    frame_end -= 1
+                if frame_end > frame_start:
+                    frame = view[frame_start:frame_end].tobytes()
+                    message = parse_frame(frame, self.mnemonic) if typer is None else typer(frame)
+                    message.first_byte_time = self._frame_start_time
+                    message.end_time = now
+                    messages.append(message)
+                # the next answer starts in the bytes just read
+                self._frame_start_time = now
+                start = end + 1
+                end = self._buffer.find(b"\r", start)
+        if start:
+            del self._buffer[:start]
+        return messages
+
+    def read_from(self, port, typer: typing.Union[None, typing.Callable[[bytes], Message]] = None) \
+            -> typing.List[Message]:
+        """
+        Read everything the port holds (or wait for one byte up to the timeout of the port).
+        :param typer: see feed.
+        :return: answers completed by the read bytes.
+        """
+        data = port.read(port.in_waiting or 1)
+        if not data:
+            return []
+        return self.feed(data, typer=typer)
+
+    def read_message(self, port) -> typing.Union[None, Message]:
+        """
+        :return: next answer of the controller, None if nothing was received before the timeout of the port.
+        """
+        while not self._messages:
+            data = port.read(port.in_waiting or 1)
+            if not data:
+                return None
+            self._messages.extend(self.feed(data))
+        return self._messages.popleft()
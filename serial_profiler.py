@@ -0,0 +1,161 @@
+import bisect
+import collections
+import csv
+import json
+import threading
+import time
+import typing
+
+METRICS = ("queue", "write", "first_byte", "terminator")
+# upper bounds (in ms) of the histogram buckets, the last bucket gathers everything above
+HISTOGRAM_BOUNDS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+PERCENTILES = (50, 95, 99)
+
+
+def classify_response(answer: str) -> str:
+    """
+    Class of an answer of the controller: "ready" (R), "ack" (0), "error" (E,n), "position" (x,y,z), "value" (number),
+    "empty" or "text".
+    """
+    if answer == "":
+        return "empty"
+    if answer == "R":
+        return "ready"
+    if answer == "0":
+        return "ack"
+    if answer.startswith("E,"):
+        return "error"
+    if answer.count(",") >= 1 and all(part.strip().lstrip("-").isdigit() for part in answer.split(",")):
+        return "position"
+    try:
+        float(answer)
+        return "value"
+    except ValueError:
+        return "text"
+
+
+def percentile(sorted_values: typing.List[float], rank: float) -> typing.Union[None, float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(rank / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class CommandStatistics:
+    def __init__(self, max_samples: int):
+        self.count = 0
+        self.samples = {metric: collections.deque(maxlen=max_samples) for metric in METRICS}
+        self.histograms = {metric: [0] * (len(HISTOGRAM_BOUNDS) + 1) for metric in METRICS}
+        self.response_classes = collections.Counter()
+
+
+class SerialProfiler:
+    def __init__(self, max_samples: int = 10000):
+        """
+        Opt-in instrumentation of the serial traffic with the PRIOR controller. For each command mnemonic (P, G, GR, $,
+        SMS...) it records, in seconds from the moment the command was ready to be written:
+        - queue: waiting time before the write (I/O engine queue or lock of the port);
+        - write: duration of the write;
+        - first_byte: arrival of the first byte of the answer;
+        - terminator: arrival of the carriage return closing the answer;
+        and the class of the answer. Statistics are available live (histograms, p50 / p95 / p99) and can be dumped to
+        CSV (raw samples) or JSON (summary).
+        :param max_samples: number of samples kept per command and per metric to compute the percentiles.
+        """
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._statistics = collections.defaultdict(lambda: CommandStatistics(self.max_samples))
+        self._records = collections.deque(maxlen=max_samples)
+        self.start_time = time.time()
+
+    def record(self, mnemonic: str, queue: float, write: float, first_byte: float, terminator: float,
+               response: str) -> None:
+        """
+        :param mnemonic: mnemonic of the command.
+        :param queue: waiting time before writing the command (in s).
+        :param write: duration of the write (in s).
+        :param first_byte: time between the start of the write and the first byte of the answer (in s).
+        :param terminator: time between the start of the write and the end of the answer (in s).
+        :param response: answer of the controller.
+        """
+        response_class = classify_response(response)
+        values = {"queue": queue, "write": write, "first_byte": first_byte, "terminator": terminator}
+        with self._lock:
+            statistics = self._statistics[mnemonic]
+            statistics.count += 1
+            statistics.response_classes[response_class] += 1
+            for metric, value in values.items():
+                statistics.samples[metric].append(value)
+                statistics.histograms[metric][bisect.bisect_left(HISTOGRAM_BOUNDS, value * 1000)] += 1
+            self._records.append((time.time(), mnemonic, queue, write, first_byte, terminator, response_class))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statistics.clear()
+            self._records.clear()
+            self.start_time = time.time()
+
+    @property
+    def mnemonics(self) -> typing.List[str]:
+        with self._lock:
+            return sorted(self._statistics.keys())
+
+    def percentiles(self, mnemonic: str, metric: str = "terminator") -> typing.Dict[str, typing.Union[None, float]]:
+        """
+        :return: {"p50": ..., "p95": ..., "p99": ...} in ms.
+        """
+        with self._lock:
+            # get(): asking about a command never sent must not add it to the reports
+            statistics = self._statistics.get(mnemonic)
+            values = [] if statistics is None else sorted(statistics.samples[metric])
+        return {"p{}".format(rank): None if not values else percentile(values, rank) * 1000 for rank in PERCENTILES}
+
+    def histogram(self, mnemonic: str, metric: str = "terminator") -> typing.List[typing.Tuple[str, int]]:
+        """
+        :return: list of (bucket label, count) with bucket upper bounds in ms.
+        """
+        with self._lock:
+            statistics = self._statistics.get(mnemonic)
+            counts = [0] * (len(HISTOGRAM_BOUNDS) + 1) if statistics is None else list(statistics.histograms[metric])
+        labels = ["<={}ms".format(bound) for bound in HISTOGRAM_BOUNDS] + [">{}ms".format(HISTOGRAM_BOUNDS[-1])]
+        return list(zip(labels, counts))
+
+    def summary(self) -> typing.Dict[str, typing.Dict]:
+        summary = {}
+        for mnemonic in self.mnemonics:
+            with self._lock:
+                statistics = self._statistics[mnemonic]
+                count = statistics.count
+                response_classes = dict(statistics.response_classes)
+            summary[mnemonic] = {"count": count, "responses": response_classes}
+            for metric in METRICS:
+                summary[mnemonic][metric] = self.percentiles(mnemonic, metric)
+        return summary
+
+    def print_summary(self) -> None:
+        print("{:<8}{:>8}  {:>24}  {:>24}  {:>24}".format("command", "count", "queue p50/p95/p99 (ms)",
+                                                          "1st byte p50/p95/p99", "answer p50/p95/p99"))
+        for mnemonic, statistics in self.summary().items():
+            columns = []
+            for metric in ["queue", "first_byte", "terminator"]:
+                columns.append("/".join("-" if value is None else "{:.1f}".format(value)
+                                        for value in statistics[metric].values()))
+            print("{:<8}{:>8}  {:>24}  {:>24}  {:>24}".format(mnemonic, statistics["count"], *columns))
+
+    def to_csv(self, path: str) -> None:
+        """
+        Dump the last recorded commands (times in s).
+        """
+        with self._lock:
+            records = list(self._records)
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["timestamp", "command", "queue", "write", "first_byte", "terminator", "response"])
+            writer.writerows(records)
+
+    def to_json(self, path: str) -> None:
+        """
+        Dump the summary (counts, answer classes and percentiles in ms) of each command.
+        """
+        with open(path, "w") as json_file:
+            json.dump({"duration": time.time() - self.start_time, "commands": self.summary()}, json_file, indent=4)
@@ -1,4 +1,5 @@
 import os
+import queue
 import sys
 
 import numpy as np
@@ -6,10 +7,11 @@ from PyQt5.QtCore import QBasicTimer
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QApplication
 from matplotlib import pyplot as plt
 
-from camera.idscamwindow import IDSCamWindow, convertQImageToMat
+from acquisition_pipeline import AcquisitionPipeline, Tile, TileWriter
+from camera.idscamwindow import IDSCamWindow
 from main import PriorController
 from sharpness.local_extremas import plot_sharpness_depending_on_z
-from sharpness.test_sharpness import variance_of_laplacian, variance_of_sobel
+from sharpness.metrics import variance_of_laplacian, variance_of_sobel
 
 focal_length = 200000  # focal length of lens (µm)
 s_min = 1 * focal_length
@@ -56,25 +58,33 @@ if __name__ == "__main__":
                                             str(self.prior.x_position) + "_" + str(self.prior.y_position))
             os.mkdir(self.folder_path)
 
+            # the frames are encoded and written by background threads while the stage moves to the next Z
+            self.tiles = queue.Queue()
+            self.pipeline = AcquisitionPipeline(acquire=None, stages=TileWriter(folder=self.folder_path).get_stages())
+            self.pipeline.start_from(iter(self.tiles.get, None))
+
             self.timer.start(1000, self)
 
         def timerEvent(self, e) -> None:
+            # frame of the Z reached at the previous tick
+            frame = self.camera_window.get_frame()
+            self.tiles.put(Tile(index=self.counter, position=(self.list_z_positions[self.counter],), frame=frame))
+            np_img = np.ascontiguousarray(frame[..., :3])
 
-            if self.counter < len(self.list_z_positions):
-                self.prior.z_controller.z_position = self.list_z_positions[self.counter]
-                self.camera_window.capture_png(
-                    picture_path=os.path.join(self.folder_path, str(self.list_z_positions[self.counter]) + ".png"))
-                q_img = self.camera_window.display.scene.get_image()
-                np_img = convertQImageToMat(incoming_image=q_img)
-
-                if sharpness_algorithm == 'sobel':
-                    img_sharpness = variance_of_sobel(np_img)
-                else:
-                    img_sharpness = variance_of_laplacian(np_img)
+            if sharpness_algorithm == 'sobel':
+                img_sharpness = variance_of_sobel(np_img)
+            else:
+                img_sharpness = variance_of_laplacian(np_img)
 
-                self.list_sharpness_values.append(img_sharpness)
+            self.list_sharpness_values.append(img_sharpness)
 
+            self.counter += 1
+            if self.counter < len(self.list_z_positions):
+                self.prior.z_controller.z_position = self.list_z_positions[self.counter]
             else:
+                self.tiles.put(None)
+                self.pipeline.join()
+
                 with open(os.path.join(self.folder_path, 'sobel_values.txt'), 'w+') as f:
                     for line in self.list_sharpness_values:
                         f.write(str(line))
@@ -85,8 +95,6 @@ if __name__ == "__main__":
                                               z_positions=self.list_z_positions, order=3)
                 self.timer.stop()
 
-            self.counter += 1
-
 
     app = QApplication(sys.argv)
 
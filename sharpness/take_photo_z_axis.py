@@ -1,14 +1,15 @@
-import os
+import queue
 import sys
 import time
 
-import cv2
+import numpy as np
 from PyQt5.QtCore import QTimer, QBasicTimer
 from PyQt5.QtWidgets import QWidget, QApplication, QVBoxLayout
 
-from camera.idscamwindow import IDSCamWindow, convertQImageToMat
+from acquisition_pipeline import AcquisitionPipeline, Tile, TileWriter
+from camera.idscamwindow import IDSCamWindow
 from main import PriorController
-from sharpness.test_sharpness import variance_of_laplacian
+from sharpness.metrics import variance_of_laplacian
 
 
 class Window(QWidget):
@@ -32,20 +33,26 @@ class Window(QWidget):
         self.prior = PriorController(port="COM15", baudrate=9600, timeout=0.1)
         self.prior.z_controller.z_position = self.list_z_positions[0]
 
+        # the frames are encoded and written by background threads while the stage moves to the next Z
+        self.tiles = queue.Queue()
+        self.pipeline = AcquisitionPipeline(acquire=None, stages=TileWriter(folder=self.folder_path).get_stages())
+        self.pipeline.start_from(iter(self.tiles.get, None))
+
         self.timer.start(1000, self)
 
     def timerEvent(self, e) -> None:
+        # frame of the Z reached at the previous tick
+        frame = self.camera_window.get_frame()
+        print(variance_of_laplacian(np.ascontiguousarray(frame[..., :3])))
+        self.tiles.put(Tile(index=self.counter, position=(self.list_z_positions[self.counter],), frame=frame))
+
         self.counter += 1
         if self.counter < len(self.list_z_positions):
             self.prior.z_controller.z_position = self.list_z_positions[self.counter]
-            # self.camera_window.capture_photo(
-            #     picture_path=os.path.join(self.folder_path, str(self.list_z_positions[self.counter]) + ".png"))
-            q_img = self.camera_window.display.scene.get_image()
-            np_img = convertQImageToMat(incoming_image=q_img)
-            print(variance_of_laplacian(np_img))
-            cv2.imwrite(os.path.join(self.folder_path, str(self.list_z_positions[self.counter]) + ".png"), np_img)
         else:
             self.timer.stop()
+            self.tiles.put(None)
+            self.pipeline.join()
 
     #
     # def take_pictures(self):
@@ -6,40 +6,11 @@ import numpy as np
 from matplotlib import pyplot as plt
 
 from sharpness.local_extremas import plot_sharpness_depending_on_z, get_sharpest_z
+from sharpness.metrics import variance_of_laplacian, variance_of_sobel
 
 path_folder = r"C:\Users\tristan_cotte\PycharmProjects\prior_controller\output_picture\grid x40"
 
 
-def variance_of_laplacian(rgb_img):
-    """
-    https://www.researchgate.net/publication/315919131_Blur_image_detection_using_Laplacian_operator_and_Open-CV
-    :return:
-    """
-    gray_img = cv2.cvtColor(rgb_img, cv2.COLOR_BGR2GRAY)
-    return cv2.Laplacian(gray_img, cv2.CV_64F).var()
-
-
-def variance_of_sobel(rgb_img, ddepth=cv2.CV_16S):
-    """
-    https://www.researchgate.net/publication/315919131_Blur_image_detection_using_Laplacian_operator_and_Open-CV
-    :return:
-    """
-    scale = 1
-    delta = 0
-    gray_img = cv2.cvtColor(rgb_img, cv2.COLOR_BGR2GRAY)
-
-    grad_x = cv2.Sobel(gray_img, ddepth, 1, 0, ksize=3, scale=scale, delta=delta, borderType=cv2.BORDER_DEFAULT)
-    # Gradient-Y
-    # grad_y = cv.Scharr(gray,ddepth,0,1)
-    grad_y = cv2.Sobel(gray_img, ddepth, 0, 1, ksize=3, scale=scale, delta=delta, borderType=cv2.BORDER_DEFAULT)
-
-    abs_grad_x = cv2.convertScaleAbs(grad_x)
-    abs_grad_y = cv2.convertScaleAbs(grad_y)
-
-    grad = cv2.addWeighted(abs_grad_x, 0.5, abs_grad_y, 0.5, 0)
-    return grad.var()
-
-
 def write_values_in_txtfile(path_file, values):
     with open(os.path.join(path_file), 'w+') as f:
         for line in values:
@@ -0,0 +1,460 @@
+import collections
+import math
+import os
+import random
+import termios
+import threading
+import time
+import tty
+import typing
+
+from motion_model import MAX_XY_SPEED, MAX_XY_ACCELERATION, MAX_Z_SPEED, MAX_Z_ACCELERATION, get_travel_time, \
+    get_travelled_distance
+
+QUEUE_SIZE = 16
+SERIAL_NUMBER = "12345"
+
+# bits of the "$" answer
+MOVING_X = 1
+MOVING_Y = 2
+MOVING_Z = 4
+
+# bits of the "LMT" answer ("02": -X reached, "08": -Y reached, "0A": both)
+LIMIT_PLUS_X = 1
+LIMIT_MINUS_X = 2
+LIMIT_PLUS_Y = 4
+LIMIT_MINUS_Y = 8
+
+# argument of "BAUD" command -> baud rate
+BAUDRATE_CODES = {96: 9600, 19: 19200, 38: 38400, 57: 57600, 115: 115200}
+BAUDRATES = {getattr(termios, "B{}".format(baudrate)): baudrate for baudrate in
+             [1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200] if hasattr(termios, "B{}".format(baudrate))}
+
+
+class Motion:
+    def __init__(self, start: typing.List[float], target: typing.List[float], speeds: typing.List[float],
+                 accelerations: typing.List[float]):
+        """
+        Movement of the 3 axes, each axis following its own trapezoidal profile. The movement ends with the slowest
+        axis.
+        """
+        self.start = start
+        self.target = target
+        self.speeds = speeds
+        self.accelerations = accelerations
+        self.durations = [get_travel_time(target[axis] - start[axis], speeds[axis], accelerations[axis])
+                          for axis in range(3)]
+        self.duration = max(self.durations)
+        self.start_time = None
+
+    def position(self, now: float) -> typing.List[float]:
+        elapsed = now - self.start_time
+        position = []
+        for axis in range(3):
+            distance = self.target[axis] - self.start[axis]
+            travelled = get_travelled_distance(elapsed, distance, self.speeds[axis], self.accelerations[axis])
+            position.append(self.start[axis] + math.copysign(travelled, distance))
+        return position
+
+    def moving_axes(self, now: float) -> int:
+        elapsed = now - self.start_time
+        status = 0
+        for axis, bit in enumerate([MOVING_X, MOVING_Y, MOVING_Z]):
+            if elapsed < self.durations[axis]:
+                status |= bit
+        return status
+
+
+class ProScanSimulator:
+    def __init__(self, latency: float = 0.002, jitter: float = 0., drop_rate: float = 0., emulate_wire: bool = True,
+                 queue_size: int = QUEUE_SIZE, x_limits: typing.Tuple[int, int] = (-125000, 125000),
+                 y_limits: typing.Tuple[int, int] = (-85000, 85000), seed: typing.Union[None, int] = None):
+        """
+        Stand-in for the PRIOR ProScan II controller behind a pseudo-terminal: PriorController(port=simulator.port)
+        opens it like a real COM port (POSIX only). Movements take the time given by the configured speed,
+        acceleration and distance, so throughput changes can be benchmarked and regression-tested off the instrument.
+        :param latency: processing time of the controller before each answer (in s).
+        :param jitter: maximum random time added to the latency (in s).
+        :param drop_rate: probability to lose each byte sent by the controller.
+        :param emulate_wire: if True, each answer also takes its transmission time at the baud rate of the controller
+                             ("BAUD" command, 9600 at start).
+        :param queue_size: number of movements the controller can buffer before answering QUEUE FULL.
+        :param x_limits: limit switches of the X axis (in µm).
+        :param y_limits: limit switches of the Y axis (in µm).
+        :param seed: seed of the random generator used for the jitter and the dropped bytes.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.emulate_wire = emulate_wire
+        self.queue_size = queue_size
+        self.x_limits = x_limits
+        self.y_limits = y_limits
+        self.random = random.Random(seed)
+
+        self.position = [0., 0., 0.]
+        self.speed = 50
+        self.acceleration = 50
+        self.s_curve = 0
+        self.z_speed = 50
+        self.z_acceleration = 50
+        self.resolution = 0.1
+        self.step_size = (1, 1)
+        self.x_direction = 1
+        self.y_direction = 1
+        self.compatibility_mode = 0
+        self.joystick = True
+        # baud rate of the UART of the controller, changed by "BAUD" command
+        self.link_baudrate = 9600
+
+        self.received_commands = []
+        self._injected_errors = collections.defaultdict(collections.deque)
+
+        self._master = None
+        self._slave = None
+        self._running = False
+        self._write_lock = threading.Lock()
+        self._state_lock = threading.RLock()
+
+        self._motions = collections.deque()
+        self._current_motion = None
+        self._motion_event = threading.Condition(self._state_lock)
+        self._stop_motion = threading.Event()
+
+        self._reader_thread = None
+        self._motion_thread = None
+
+    @property
+    def port(self) -> str:
+        """
+        Name of the pseudo-terminal to give to PriorController / serial.Serial.
+        """
+        return os.ttyname(self._slave)
+
+    @property
+    def baudrate(self) -> typing.Union[None, int]:
+        """
+        Baud rate set on the port by the client (None if unknown).
+        """
+        return BAUDRATES.get(termios.tcgetattr(self._slave)[5])
+
+    @property
+    def baudrate_mismatch(self) -> bool:
+        """
+        True if the client and the controller use different baud rates: bytes are then garbled in both directions.
+        """
+        baudrate = self.baudrate
+        return baudrate is not None and baudrate != self.link_baudrate
+
+    def inject_error(self, mnemonic: str, code: int, count: int = 1) -> None:
+        """
+        Answer "E,code" to the next count commands with this mnemonic.
+        """
+        for _ in range(count):
+            self._injected_errors[mnemonic.upper()].append(code)
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self._running = True
+
+        self._reader_thread = threading.Thread(target=self._read_commands, daemon=True)
+        self._motion_thread = threading.Thread(target=self._execute_motions, daemon=True)
+        self._reader_thread.start()
+        self._motion_thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        self._stop_motion.set()
+        with self._state_lock:
+            self._motion_event.notify_all()
+        for fd in [self._master, self._slave]:
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def current_position(self) -> typing.List[float]:
+        with self._state_lock:
+            if self._current_motion is None:
+                return list(self.position)
+            return self._current_motion.position(time.monotonic())
+
+    def moving_status(self) -> int:
+        with self._state_lock:
+            if self._current_motion is None:
+                return MOVING_X | MOVING_Y if self._motions else 0
+            status = self._current_motion.moving_axes(time.monotonic())
+            if self._motions:
+                status |= MOVING_X | MOVING_Y
+            return status
+
+    def _read_commands(self) -> None:
+        buffer = b""
+        while self._running:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            buffer += data
+            while b"\r" in buffer:
+                line, buffer = buffer.split(b"\r", 1)
+                command = line.decode(errors="replace").strip()
+                if self.baudrate_mismatch:
+                    # framing errors: the controller can't read the command
+                    continue
+                if command:
+                    answer = self.handle_command(command)
+                    if answer is not None:
+                        self.send(answer)
+
+    def send(self, answer: str) -> None:
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter > 0 else 0)
+        data = (answer + "\r").encode()
+        if self.emulate_wire:
+            # 1 start bit + 8 data bits + 1 stop bit
+            delay += len(data) * 10 / self.link_baudrate
+        if delay > 0:
+            time.sleep(delay)
+        if self.baudrate_mismatch:
+            data = bytes(self.random.randrange(0x80, 0x100) for _ in data)
+        if self.drop_rate > 0:
+            data = bytes(byte for byte in data if self.random.random() >= self.drop_rate)
+        with self._write_lock:
+            if self._master is not None:
+                try:
+                    os.write(self._master, data)
+                except OSError:
+                    pass
+
+    def handle_command(self, command: str) -> typing.Union[None, str]:
+        """
+        :param command: command received without carriage return.
+        :return: answer of the controller, None if the answer is sent later (movements).
+        """
+        self.received_commands.append(command)
+        mnemonic, *args = [element.strip() for element in command.split(",")]
+        mnemonic = mnemonic.upper()
+
+        if self._injected_errors[mnemonic]:
+            return "E,{code}".format(code=self._injected_errors[mnemonic].popleft())
+
+        handler = getattr(self, "_cmd_" + {"?": "INFO", "$": "STATUS"}.get(mnemonic, mnemonic), None)
+        if handler is None:
+            return "E,5"
+        try:
+            return handler(*args)
+        except (ValueError, TypeError):
+            return "E,4"
+
+    # ------------------------------------------------------------------------------------------------- information
+
+    def _cmd_INFO(self) -> str:
+        return "\r".join(["DRIVE CHIP 0", "JOYSTICK ACTIVE", "STAGE = H117", "FOCUS = FOCUS", "END"])
+
+    def _cmd_SERIAL(self) -> str:
+        return SERIAL_NUMBER
+
+    def _cmd_STATUS(self) -> str:
+        return str(self.moving_status())
+
+    def _cmd_LMT(self) -> str:
+        x, y, _ = self.current_position()
+        limits = 0
+        limits |= LIMIT_PLUS_X if x >= self.x_limits[1] else 0
+        limits |= LIMIT_MINUS_X if x <= self.x_limits[0] else 0
+        limits |= LIMIT_PLUS_Y if y >= self.y_limits[1] else 0
+        limits |= LIMIT_MINUS_Y if y <= self.y_limits[0] else 0
+        return "{:02X}".format(limits)
+
+    # ---------------------------------------------------------------------------------------------------- position
+
+    def _cmd_P(self, *args) -> str:
+        if args:
+            with self._state_lock:
+                for axis, value in enumerate(args[:3]):
+                    self.position[axis] = int(value)
+            return "0"
+        return ",".join(str(round(value)) for value in self.current_position())
+
+    def _cmd_PX(self) -> str:
+        return str(round(self.current_position()[0]))
+
+    def _cmd_PY(self) -> str:
+        return str(round(self.current_position()[1]))
+
+    def _cmd_PZ(self) -> str:
+        return str(round(self.current_position()[2]))
+
+    def _cmd_Z(self) -> str:
+        with self._state_lock:
+            self.position = [0., 0., 0.]
+        return "0"
+
+    # --------------------------------------------------------------------------------------------------- movements
+
+    def _queue_motion(self, target: typing.List[typing.Union[None, float]], relative: bool = False) \
+            -> typing.Union[None, str]:
+        with self._state_lock:
+            if len(self._motions) + (self._current_motion is not None) >= self.queue_size:
+                return "E,18"
+            self._motions.append((target, relative))
+            self._motion_event.notify_all()
+        return None
+
+    def _cmd_G(self, x, y, z=None):
+        return self._queue_motion([int(x), int(y), None if z is None else int(z)])
+
+    def _cmd_GR(self, x, y, z=None):
+        return self._queue_motion([int(x), int(y), 0 if z is None else int(z)], relative=True)
+
+    def _cmd_M(self):
+        return self._queue_motion([0, 0, 0])
+
+    def _cmd_SIS(self):
+        return self._queue_motion([0, 0, None])
+
+    def _cmd_U(self, z):
+        return self._queue_motion([0, 0, int(z)], relative=True)
+
+    def _cmd_D(self, z):
+        return self._queue_motion([0, 0, -int(z)], relative=True)
+
+    def _cmd_V(self, z):
+        return self._queue_motion([None, None, int(z)])
+
+    def _cmd_K(self) -> str:
+        self._abort_motions()
+        return "R"
+
+    def _cmd_I(self) -> str:
+        self._abort_motions()
+        return "R"
+
+    def _abort_motions(self) -> None:
+        """
+        Every accepted movement is answered by "R" when the stage stops, including the aborted ones.
+        """
+        with self._state_lock:
+            dropped = len(self._motions)
+            self._motions.clear()
+            if self._current_motion is not None:
+                self._stop_motion.set()
+        for _ in range(dropped):
+            self.send("R")
+
+    def _execute_motions(self) -> None:
+        while self._running:
+            with self._state_lock:
+                while self._running and not self._motions:
+                    self._motion_event.wait()
+                if not self._running:
+                    return
+                target, relative = self._motions.popleft()
+                motion = self._build_motion(target, relative)
+                motion.start_time = time.monotonic()
+                self._current_motion = motion
+                self._stop_motion.clear()
+
+            aborted = self._stop_motion.wait(timeout=motion.duration)
+
+            with self._state_lock:
+                self.position = motion.position(time.monotonic()) if aborted else list(motion.target)
+                self._current_motion = None
+            self.send("R")
+
+    def _build_motion(self, target: typing.List[typing.Union[None, float]], relative: bool) -> Motion:
+        start = list(self.position)
+        if relative:
+            end = [start[axis] + target[axis] for axis in range(3)]
+        else:
+            end = [start[axis] if target[axis] is None else target[axis] for axis in range(3)]
+        end[0] = min(max(end[0], self.x_limits[0]), self.x_limits[1])
+        end[1] = min(max(end[1], self.y_limits[0]), self.y_limits[1])
+
+        xy_speed = MAX_XY_SPEED * self.speed / 100
+        xy_acceleration = MAX_XY_ACCELERATION * self.acceleration / 100
+        z_speed = MAX_Z_SPEED * self.z_speed / 100
+        z_acceleration = MAX_Z_ACCELERATION * self.z_acceleration / 100
+        return Motion(start=start, target=end, speeds=[xy_speed, xy_speed, z_speed],
+                      accelerations=[xy_acceleration, xy_acceleration, z_acceleration])
+
+    # ---------------------------------------------------------------------------------------------------- settings
+
+    def _setting(self, attribute: str, args, minimum=None, maximum=None, cast=int) -> str:
+        if not args:
+            return str(getattr(self, attribute))
+        value = cast(args[0])
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            return "E,8"
+        setattr(self, attribute, value)
+        return "0"
+
+    def _cmd_SMS(self, *args) -> str:
+        return self._setting("speed", args, 1, 100)
+
+    def _cmd_SAS(self, *args) -> str:
+        return self._setting("acceleration", args, 1, 100)
+
+    def _cmd_SCS(self, *args) -> str:
+        return self._setting("s_curve", args, 0, 100)
+
+    def _cmd_SMZ(self, *args) -> str:
+        return self._setting("z_speed", args, 1, 100)
+
+    def _cmd_SAZ(self, *args) -> str:
+        return self._setting("z_acceleration", args, 1, 100)
+
+    def _cmd_XD(self, *args) -> str:
+        return self._setting("x_direction", args, -1, 1)
+
+    def _cmd_YD(self, *args) -> str:
+        return self._setting("y_direction", args, -1, 1)
+
+    def _cmd_COMP(self, *args) -> str:
+        return self._setting("compatibility_mode", args, 0, 1)
+
+    def _cmd_RES(self, axis="s", *args) -> str:
+        return self._setting("resolution", args, cast=float)
+
+    def _cmd_X(self, *args) -> str:
+        if not args:
+            return "{},{}".format(*self.step_size)
+        self.step_size = (int(args[0]), int(args[1]))
+        return "0"
+
+    def _cmd_BAUD(self, code) -> typing.Union[None, str]:
+        baudrate = BAUDRATE_CODES.get(int(code))
+        if baudrate is None:
+            return "E,8"
+        # the acknowledgement is sent at the previous baud rate
+        self.send("0")
+        self.link_baudrate = baudrate
+        return None
+
+    def _cmd_J(self) -> str:
+        self.joystick = True
+        return "0"
+
+    def _cmd_H(self) -> str:
+        self.joystick = False
+        return "0"
+
+
+if __name__ == "__main__":
+    with ProScanSimulator() as simulator:
+        print("ProScan II simulator listening on {port}".format(port=simulator.port))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -1,6 +1,6 @@
+import collections
 import sys
 import threading
-import time
 import typing
 
 import qdarkstyle
@@ -9,7 +9,6 @@ from PyQt5.QtCore import pyqtSignal, QObject, Qt, QSize
 from PyQt5.QtGui import QCloseEvent
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QApplication, QFormLayout, QSpacerItem
 from qtwidgets import AnimatedToggle
-from serial import SerialTimeoutException
 
 from app.go_to_windows import GoToPosition
 from app.ui import DisplayCurrentValues, DirectionalButtons, Directions
@@ -30,49 +29,27 @@ class MicroscopeHandler(QObject):
         super().__init__(parent)
         self._current_coords = None
         self.prior = prior
-        self._is_running = True
         self._position_reached = True
 
-        read_position_thread = threading.Thread(target=self.read_prior_position)
-        # self.write_thread = threading.Thread(target=self.write_to_port, args=(self.prior, Position(10, 20), 2))
+        # movements are sent one after the other: the next one is written when the "R" of the previous one arrives
+        self._motion_lock = threading.Lock()
+        self._waiting_motions = collections.deque()
 
-        read_position_thread.start()
+        # SettleDetector fed by the camera: when set, reach_position_signal is emitted as soon as the image is still
+        # instead of after the fixed delay of the movement
+        self.settle_detector = None
 
-        # self.write_thread.start()
+        # the I/O engine owns the serial port: position requests and movements go through its command queue
+        self.engine = self.prior.start_engine()
+        self.engine.unsolicited_callback = lambda answer: print("--- unexpected answer:", answer)
+        self.engine.start_position_polling(callback=self.handle_position, period=0.1)
 
     def close(self):
-        self._is_running = False
-
-    def read_prior_position(self, delay: float = 0.1):
-        while self._is_running:
-            try:
-                self.prior.write_cmd("P")
-            except SerialTimeoutException:
-                print("Can\'t write due to timeout")
-
-            while self.prior.in_waiting > 0:  # Wait for response
-                reading = self.prior.read_until(b"\r").decode().strip()
-
-                # if reading.endswith('<R>\n'):
-                self.handle_data(reading)
-
-                break
-
-            # time.sleep(0.5)
-            time.sleep(delay)
+        self.engine.stop_position_polling()
+        self.prior.stop_engine()
 
     def return2home(self):
-        thread_return2home = threading.Thread(target=self.return2home_with_thread)
-        thread_return2home.start()
-
-    def return2home_with_thread(self):
-        while True:
-            if self.prior.in_waiting > 0 and self._position_reached:
-                # # print("set position")
-                cmd = "M"
-                self.prior.write_cmd(cmd)
-
-                break
+        self.submit_motion("M")
 
     def move_relative_z(self, value, delay=0):
         if value <= 0:
@@ -80,73 +57,87 @@ class MicroscopeHandler(QObject):
         else:
             cmd = "U, {z}".format(z=value)
 
-        while True:
-            if self.prior.in_waiting > 0 and self._position_reached:
-                self.prior.write_cmd(cmd)
-                self._position_reached = False
-
-                time.sleep(delay)  # wait for a bit for data to be sent
-                self.reach_position_signal.emit()
-                break
+        self.submit_motion(cmd, delay=delay)
 
     def go_to_relative_position_z(self, z):
-        thread_goto = threading.Thread(target=self.move_relative_z, args=(z, 0))
-        thread_goto.start()
+        self.move_relative_z(z)
 
     def go_to_absolute_position(self, position: Position):
-        thread_goto = threading.Thread(target=self.write_to_port, args=(position, 0))
-        thread_goto.start()
-        print("end")
+        self.write_to_port(position, delay=0)
 
     def go_to_relative_position_xy(self, x=0, y=0):
-        thread_goto = threading.Thread(target=self.write_to_relative, args=(x, y, 0))
-        thread_goto.start()
+        self.write_to_relative(x, y, delay=0)
 
     def write_to_port(self, position: Position, delay=2):
         x = position.x
         y = position.y
         z = position.z
 
-        while True:
-            if self.prior.in_waiting > 0 and self._position_reached:
-                # # print("set position")
-                if z is not None:
-                    cmd = "G, {x}, {y}, {z}".format(x=x, y=y, z=z)
+        if z is not None:
+            cmd = "G, {x}, {y}, {z}".format(x=x, y=y, z=z)
+        else:
+            cmd = "G, {x}, {y}".format(x=x, y=y)
+        self.submit_motion(cmd, delay=delay)
+
+    def write_to_relative(self, x, y, delay=2):
+        cmd = "GR, {x}, {y}".format(x=x, y=y)
+        self.submit_motion(cmd, delay=delay)
+
+    def submit_motion(self, cmd: str, delay: float = 0) -> None:
+        """
+        Send a movement to the controller, or keep it until the current movement is finished.
+        :param cmd: movement command.
+        :param delay: time (in s) waited after the end of the movement before emitting reach_position_signal. If a
+                      settle detector is set, any positive delay waits for a still image instead (up to the timeout of
+                      the detector).
+        """
+        with self._motion_lock:
+            if not self._position_reached:
+                self._waiting_motions.append((cmd, delay))
+                return
+            self._position_reached = False
+
+        self._write_motion(cmd, delay)
+
+    def _write_motion(self, cmd: str, delay: float) -> None:
+        future = self.engine.submit(cmd)
+        future.add_done_callback(lambda done_future: self.handle_motion_done(done_future, delay))
+
+    def handle_motion_done(self, future, delay: float = 0) -> None:
+        try:
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                print("[ERROR] : movement / {error}".format(error=future.exception()))
+                return
+
+            answer = future.result()
+            if answer == "R":
+                if delay > 0 and self.settle_detector is not None:
+                    self.settle_detector.arm(callback=lambda settled: self.reach_position_signal.emit())
+                elif delay > 0:
+                    threading.Timer(delay, self.reach_position_signal.emit).start()
                 else:
-                    cmd = "G, {x}, {y}".format(x=x, y=y)
-                self.prior.write_cmd(cmd)
-                self._position_reached = False
+                    self.reach_position_signal.emit()
+            else:
+                print("[ERROR] : movement / {answer}".format(answer=answer))
+        finally:
+            # the next movement is sent even if this one failed, otherwise every later movement would be kept forever
+            with self._motion_lock:
+                if self._waiting_motions:
+                    next_motion = self._waiting_motions.popleft()
+                else:
+                    next_motion = None
+                    self._position_reached = True
 
-                time.sleep(delay)  # wait for a bit for data to be sent
-                # self.reach_position_signal.emit()
-                break
+            if next_motion is not None:
+                self._write_motion(*next_motion)
 
-    def write_to_relative(self, x, y, delay=2):
-        while True:
-            if self.prior.in_waiting > 0 and self._position_reached:
-                # # print("set position")
-                cmd = "GR, {x}, {y}".format(x=x, y=y)
-                self.prior.write_cmd(cmd)
-                self._position_reached = False
-
-                time.sleep(delay)  # wait for a bit for data to be sent
-                # self.reach_position_signal.emit()
-                break
-
-    def handle_data(self, data):
-        print("---", data)
-
-        if data == "R":
-            self._position_reached = True
-            print("position reached")
-            self.reach_position_signal.emit()
-        else:
-            try:
-                x, y, z = [int(i) for i in data.split(",")]
-                # print(f"{x}x, {y}y, {z}z")
-                self.current_coords = (x, y, z)
-            except Exception as e:
-                print(str(e))
+    def handle_position(self, position: typing.Tuple[int, ...]) -> None:
+        try:
+            self.current_coords = position
+        except Exception as e:
+            print(str(e))
 
     @property
     def current_coords(self) -> Position:
@@ -391,10 +382,10 @@ if __name__ == "__main__":
     # self.prior.write_cmd("COMP")
     baudrate = 9600
     ps = PriorSearcher(baudrate_list=[baudrate])
-    ser = PriorController(port=ps.port, baudrate=baudrate, timeout=0.1)
+    ser = PriorController(port=ps.port, baudrate=baudrate, timeout=0.1, target_baudrate=115200)
     ser.acceleration = 10
     ser.speed = 10
-    ser.write_cmd("COMP, 1")
+    ser.query("COMP, 1")
     microscope_handler = MicroscopeHandler(ser)
 
     app = QApplication(sys.argv)
@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def simulator():
+    if os.name != "posix":
+        pytest.skip("the ProScan simulator needs a pseudo-terminal")
+    from simulator.proscan_simulator import ProScanSimulator
+
+    simulator = ProScanSimulator(emulate_wire=False, seed=0)
+    simulator.start()
+    yield simulator
+    simulator.stop()
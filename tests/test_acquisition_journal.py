@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+from acquisition_journal import AcquisitionJournal, acquire_journaled
+from objectives import OBJECTIVES
+
+
+def blank_frame(index, position):
+    return np.full((8, 8, 3), index, dtype=np.uint8)
+
+
+def test_journal_resumes_after_a_torn_line(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    grids = [np.array([[0, 0], [100, 0], [200, 0]]), np.array([[0, 500]])]
+    journal = AcquisitionJournal.create(path, grids, objective=OBJECTIVES["x40"], metadata={"slides": [0, 1]})
+    journal.record_tile(0, 0, "000000_0_0.png", (0, 0))
+    journal.record_tile(0, 2, "000002_200_0.png", (200, 0))
+    journal.close()
+    # crash while a record was being written
+    with open(path, "a") as file:
+        file.write('{"type": "tile", "grid": 0, "ind')
+
+    journal = AcquisitionJournal.open_or_create(path, grids=[])
+    assert journal.nb_tiles == 4 and journal.nb_completed == 2
+    assert journal.get_remaining(0).tolist() == [1]
+    assert journal.plan["metadata"] == {"slides": [0, 1]}
+    journal.record_tile(0, 1, "000001_100_0.png", (100, 0))
+    journal.close()
+    assert AcquisitionJournal.open(path).nb_completed == 3
+
+
+def test_acquire_journaled_records_the_read_back_positions(tmp_path):
+    grids = [np.array([[0, 0], [100, 0]]), np.array([[0, 500], [100, 500], [200, 500]])]
+    journal = AcquisitionJournal.create(str(tmp_path / "journal.jsonl"), grids)
+    positions = iter([(1, 2), (101, 2), (1, 502), (101, 502), (201, 502)])
+    assert acquire_journaled(journal, str(tmp_path), acquire=blank_frame, locate=lambda: next(positions))
+    assert journal.finished and journal.nb_completed == 5
+    assert journal.tiles[(1, 2)]["position"] == [201, 502]
+    assert sorted(os.listdir(tmp_path / "grid_1"))[:3] == ["000000_0_500.png", "000001_100_500.png",
+                                                           "000002_200_500.png"]
+    journal.close()
+
+
+def test_acquire_journaled_keeps_the_tiles_before_a_failure(tmp_path):
+    grid = np.array([[index * 100, 0] for index in range(10)])
+    journal = AcquisitionJournal.create(str(tmp_path / "journal.jsonl"), [grid])
+
+    def acquire(index, position):
+        if index == 4:
+            raise IOError("the stage did not reach the tile")
+        return blank_frame(index, position)
+
+    assert not acquire_journaled(journal, str(tmp_path), acquire=acquire)
+    assert journal.nb_completed == 4 and not journal.finished
+    journal.close()
+
+    # the resumed run only acquires the missing tiles
+    journal = AcquisitionJournal.open(str(tmp_path / "journal.jsonl"))
+    acquired = []
+    assert acquire_journaled(journal, str(tmp_path), acquire=lambda index, position: acquired.append(index) or
+                             blank_frame(index, position))
+    assert acquired == list(range(4, 10))
+    journal.close()
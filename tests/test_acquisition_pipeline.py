@@ -0,0 +1,83 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from acquisition_pipeline import AcquisitionPipeline, PipelineStage, TileWriter
+
+
+def blank_frame(index, position):
+    return np.full((8, 8, 3), index, dtype=np.uint8)
+
+
+def test_pipeline_processes_every_tile_in_order():
+    processed = []
+    pipeline = AcquisitionPipeline(acquire=blank_frame,
+                                   stages=[PipelineStage("double", lambda tile: setattr(tile, "data", tile.index * 2)),
+                                           PipelineStage("collect", lambda tile: processed.append(tile.data))])
+    statistics = pipeline.run([(index, 0) for index in range(20)], indices=range(5, 20))
+    assert processed == [index * 2 for index in range(5, 20)]
+    assert [stage.count for stage in statistics] == [15, 15, 15]
+
+
+def test_pipeline_back_pressure_bounds_the_queues():
+    release = threading.Event()
+    acquired = []
+
+    def acquire(index, position):
+        acquired.append(index)
+        return None
+
+    pipeline = AcquisitionPipeline(acquire=acquire,
+                                   stages=[PipelineStage("slow", lambda tile: release.wait(), queue_size=2)])
+    pipeline.start(list(range(20)))
+    pipeline.join(timeout=0.3)
+    # one tile in the stage, two in its queue, one blocked in the acquisition
+    assert len(acquired) <= 4
+    release.set()
+    pipeline.join()
+    assert len(acquired) == 20
+
+
+def test_pipeline_stage_error_stops_the_acquisition():
+    acquired = []
+
+    def fail(tile):
+        raise ValueError("disk full")
+
+    pipeline = AcquisitionPipeline(acquire=lambda index, position: acquired.append(index),
+                                   stages=[PipelineStage("write", fail, queue_size=1)])
+    with pytest.raises(ValueError):
+        pipeline.run(list(range(100)))
+    assert len(acquired) < 100
+
+
+def test_tile_writer(tmp_path):
+    writer = TileWriter(folder=str(tmp_path), extension=".png")
+    pipeline = AcquisitionPipeline(acquire=blank_frame, stages=writer.get_stages(encoders=2))
+    pipeline.run([(0, 0), (100, 0)])
+    assert sorted(os.listdir(tmp_path)) == ["000000_0_0.png", "000001_100_0.png"]
+
+
+def test_tile_writer_records_the_measured_positions(tmp_path):
+    writer = TileWriter(folder=str(tmp_path), extension=".png")
+    pipeline = AcquisitionPipeline(acquire=blank_frame, stages=writer.get_stages(encoders=2), locate=lambda: (1, 2))
+    pipeline.run([(0, 0), (100, 0)])
+    with open(writer.positions_path) as file:
+        assert sorted(file.read().splitlines()) == ["000000_0_0.png,1.0,2.0", "000001_100_0.png,1.0,2.0"]
+
+
+def test_pipeline_drains_the_tiles_acquired_before_an_error():
+    written = []
+
+    def acquire(index, position):
+        if index == 4:
+            raise IOError("tile 4 lost")
+        return index
+
+    pipeline = AcquisitionPipeline(acquire=acquire,
+                                   stages=[PipelineStage("write", lambda tile: written.append(tile.index))])
+    with pytest.raises(IOError):
+        pipeline.run(list(range(10)))
+    assert written == [0, 1, 2, 3]
@@ -0,0 +1,21 @@
+import pytest
+
+from grid.coverage import GridCoverage, get_min_tiles_matrix
+from grid.grid_movement import get_serpentine_grid
+
+
+def test_grid_coverage():
+    grid = get_serpentine_grid(start_pt=(0, 0), matrix=(2, 2), step=(80, 80))
+    coverage = GridCoverage(grid, tile_size=(100, 100))
+    assert coverage.union_area == pytest.approx(180 * 180)
+    assert coverage.tiles_area == pytest.approx(4 * 100 * 100)
+    assert coverage.gap_area == pytest.approx(0)
+
+    sparse = GridCoverage(get_serpentine_grid(start_pt=(0, 0), matrix=(2, 1), step=(150, 0)), tile_size=(100, 100))
+    assert sparse.gap_area == pytest.approx(50 * 100)
+
+
+def test_min_tiles_matrix():
+    matrix, step = get_min_tiles_matrix(area_size=(1000, 500), tile_size=(200, 100), min_overlap=10)
+    assert matrix == (6, 6)
+    assert all(value <= limit for value, limit in zip(step, (180, 90)))
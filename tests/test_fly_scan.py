@@ -0,0 +1,155 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from fly_scan import FlyLine, FlyScanner, PositionTrack, get_fly_lines, get_fly_speed, get_speed_setting
+from grid.grid_movement import get_serpentine_grid
+from motion_model import MAX_XY_SPEED
+from objectives import OBJECTIVES
+from prior_engine import MotionHandle
+
+
+class FakeStage:
+    """
+    I/O engine of a stage moving in a straight line at the "SMS" speed. With stop_at, the sweeps end at this coordinate
+    of the scanned axis; with silent, the sweeps never start and no position is sent.
+    """
+    position_polling = (None, None)
+
+    def __init__(self, stop_at=None, silent=False):
+        self.stop_at = stop_at
+        self.silent = silent
+        self.position = np.zeros(2)
+        self.setting = 50
+        self.commands = []
+        self._lock = threading.Lock()
+        self._polling = threading.Event()
+
+    def submit(self, cmd, timeout=None):
+        self.commands.append(cmd)
+        handle = MotionHandle(cmd)
+        if cmd == "I":
+            handle.set_result("0")
+        elif not self.commands[:-1] or not self._polling.is_set():
+            # travel between the lines
+            self.position = np.array([float(value) for value in cmd[2:].split(",")[:2]])
+            handle.set_result("R")
+        elif not self.silent:
+            target = np.array([float(value) for value in cmd[2:].split(",")[:2]])
+            threading.Thread(target=self.sweep, args=(target, handle), daemon=True).start()
+        return handle
+
+    def sweep(self, target, handle):
+        start, speed = self.position.copy(), MAX_XY_SPEED * self.setting / 100
+        if self.stop_at is not None:
+            target = target.copy()
+            target[1] = self.stop_at
+        duration = np.linalg.norm(target - start) / speed
+        start_time = time.perf_counter()
+        while time.perf_counter() - start_time < duration:
+            with self._lock:
+                self.position = start + (target - start) * (time.perf_counter() - start_time) / duration
+            time.sleep(0.001)
+        with self._lock:
+            self.position = target
+        handle.set_result("R")
+
+    def query(self, cmd, timeout=None):
+        if cmd.startswith("SMS,"):
+            self.setting = int(cmd[4:])
+            return "0"
+        return str(self.setting)
+
+    def start_position_polling(self, callback, period):
+        self._polling.set()
+
+        def poll():
+            while self._polling.is_set():
+                if not self.silent:
+                    with self._lock:
+                        callback(tuple(int(value) for value in self.position))
+                time.sleep(period)
+        threading.Thread(target=poll, daemon=True).start()
+
+    def stop_position_polling(self):
+        self._polling.clear()
+
+
+def test_speed_setting():
+    assert get_speed_setting(MAX_XY_SPEED * 0.255) == 25
+    assert get_speed_setting(MAX_XY_SPEED * 3) == 100
+    with pytest.raises(ValueError):
+        get_speed_setting(MAX_XY_SPEED * 0.005)
+
+
+def test_fly_speed_against_stop_and_shoot():
+    objective = OBJECTIVES["x40"]
+    pitch = objective.pitch[1]
+    speed = get_fly_speed(pitch, objective.pixel_scale)
+    assert pitch / speed < 0.22
+    # 1 ms of exposure would need more than a second per tile
+    with pytest.raises(ValueError):
+        get_fly_speed(pitch, objective.pixel_scale, exposure=0.001)
+    assert get_fly_speed(pitch, objective.pixel_scale, exposure=0.001, stop_and_shoot_time=None) > 0
+
+
+def test_fly_lines_follow_the_serpentine():
+    grid = get_serpentine_grid(start_pt=(0, 0), matrix=(3, 4), step=(100, 100))
+    lines = get_fly_lines(grid, axis=1)
+    assert len(lines) == 3
+    assert [line.direction for line in lines] == [1, -1, 1]
+    assert np.concatenate([line.indices for line in lines]).tolist() == list(range(len(grid)))
+    assert lines[1].triggers.tolist() == [300, 200, 100, 0]
+
+    resumed = get_fly_lines(grid, axis=1, indices=[1, 2, 3, 5, 6])
+    assert [line.indices.tolist() for line in resumed] == [[1, 2, 3], [5, 6]]
+
+
+def test_fly_line_path_has_run_ups():
+    line = FlyLine(np.arange(3), np.array([[0, 300, 10], [0, 200, 30], [0, 100, 20]]))
+    assert line.direction == -1
+    assert line.get_path(run_up=50) == ((0, 350, 20), (0, 50, 20))
+
+
+def test_position_track_interpolation():
+    track = PositionTrack()
+    track.times, track.positions = [0., 1.], [(0, 0), (0, 100)]
+    assert track.interpolate(np.array([0.5, 2.])).tolist() == [[0, 50], [0, 200]]
+
+
+def test_scan_tags_the_frames_with_the_crossing_positions():
+    engine = FakeStage()
+    scanner = FlyScanner(engine, capture=lambda: None, speed=MAX_XY_SPEED * 0.1, polling_period=0.005)
+    grid = get_serpentine_grid(start_pt=(0, 0), matrix=(2, 4), step=(100, 100))
+    tiles = list(scanner.scan(grid, axis=1))
+    assert [tile.index for tile in tiles] == list(range(len(grid)))
+    measured = np.array([tile.measured_position for tile in tiles])
+    # within a few polling periods at the sweep speed
+    assert np.abs(measured - grid).max() < 4 * scanner.speed * scanner.polling_period
+    # the travel speed is restored after the scan
+    assert engine.setting == 50 and "I" not in engine.commands
+
+
+def test_sweep_stopping_short_fails_without_hanging():
+    engine = FakeStage(stop_at=150)
+    scanner = FlyScanner(engine, capture=lambda: None, speed=MAX_XY_SPEED * 0.1, polling_period=0.005)
+    line = FlyLine(np.arange(3), np.array([[0, 100], [0, 200], [0, 300]]))
+    start_time = time.perf_counter()
+    with pytest.raises(IOError):
+        scanner.scan_line(line)
+    assert time.perf_counter() - start_time < scanner.get_sweep_time(line) + 1
+
+
+def test_stuck_sweep_is_stopped_at_the_deadline(monkeypatch):
+    monkeypatch.setattr("fly_scan.SWEEP_TIMEOUT_MARGIN", 0.2)
+    engine = FakeStage(silent=True)
+    scanner = FlyScanner(engine, capture=lambda: None, speed=MAX_XY_SPEED * 0.1, polling_period=0.005)
+    line = FlyLine(np.arange(2), np.array([[0, 100], [0, 200]]))
+    start_time = time.perf_counter()
+    with pytest.raises(IOError):
+        scanner.scan_line(line)
+    assert time.perf_counter() - start_time < scanner.get_sweep_time(line) + 1
+    # the stage is stopped before anything else is sent
+    assert engine.commands[-1] == "I"
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from grid.focus_map import FocusMap, find_best_focus, get_best_focus, get_sweep_positions, select_focus_points
+from grid.grid_movement import get_serpentine_grid
+
+
+def test_focus_map_fits_a_tilted_slide():
+    focus_map = FocusMap(surface="plane")
+    for x, y in ((0, 0), (1000, 0), (0, 1000), (1000, 1000)):
+        focus_map.add_point(x, y, 100 + 0.01 * x - 0.02 * y)
+    positions = np.array([[500, 500], [250, 750]])
+    np.testing.assert_array_equal(focus_map.predict(positions), [95, 88])
+    assert focus_map.attach_z(positions).tolist() == [[500, 500, 95], [250, 750, 88]]
+
+
+def test_focus_map_falls_back_on_fewer_points():
+    focus_map = FocusMap(surface="thin-plate")
+    focus_map.add_point(0, 0, 42)
+    assert focus_map.predict(np.array([[100, 100]])).tolist() == [42]
+    with pytest.raises(ValueError):
+        FocusMap().fit()
+
+
+def test_focus_points_are_spread():
+    grid = get_serpentine_grid(start_pt=(0, 0), matrix=(5, 5), step=(10, 10))
+    chosen = select_focus_points(grid, nb_points=5)
+    assert len(set(chosen.tolist())) == 5
+    # the center first, then the corners
+    assert grid[chosen[0]].tolist() == [20, 20]
+    assert {tuple(grid[index]) for index in chosen[1:]} == {(0, 0), (0, 40), (40, 0), (40, 40)}
+
+
+def test_best_focus_between_sweep_positions():
+    sweep = get_sweep_positions(center=100, half_range=20, step=5)
+    assert sweep.tolist() == [80, 85, 90, 95, 100, 105, 110, 115, 120]
+    assert get_best_focus(sweep, -(sweep - 102.) ** 2) == pytest.approx(102)
+    assert find_best_focus(lambda z: -abs(z - 137), center=100, coarse_sweep=(60, 20), fine_sweep=(20, 5)) == \
+        pytest.approx(137, abs=3)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from grid.grid_movement import GridCache, get_serpentine_grid
+from grid.roi import MaskROI
+from objectives import OBJECTIVES
+
+
+def test_serpentine_course():
+    grid = get_serpentine_grid(start_pt=(0, 0), matrix=(2, 3), step=(10, 5))
+    assert grid.dtype == np.int32
+    assert grid.tolist() == [[0, 0], [0, 5], [0, 10], [10, 10], [10, 5], [10, 0]]
+
+
+def test_serpentine_course_by_rows():
+    grid = get_serpentine_grid(start_pt=(100, 200), matrix=(3, 2), step=(10, 5), by_rows=True)
+    assert grid.tolist() == [[100, 200], [110, 200], [120, 200], [120, 205], [110, 205], [100, 205]]
+
+
+def test_grid_cache_translates_square_grids():
+    cache = GridCache()
+    objective = OBJECTIVES["x40"]
+    first = cache.get_grid(start_pt=(0, 0), matrix=(3, 3), objective=objective)
+    moved = cache.get_grid(start_pt=(1000, 500), matrix=(3, 3), objective=objective)
+    np.testing.assert_array_equal(np.asarray(moved) - np.asarray(first), np.tile([1000, 500], (9, 1)))
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_grid_cache_follows_an_roi_edited_in_place():
+    cache = GridCache()
+    objective = OBJECTIVES["x40"]
+    mask = np.zeros((100, 100), dtype=bool)
+    mask[10:20, 10:20] = True
+    roi = MaskROI(mask, pixel_size=20.)
+    small = cache.get_roi_grid(roi, None, objective=objective)
+    assert len(cache.get_roi_grid(roi, None, objective=objective)) == len(small)
+    roi.mask[10:90, 10:90] = True
+    assert len(cache.get_roi_grid(roi, None, objective=objective)) > len(small)
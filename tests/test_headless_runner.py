@@ -0,0 +1,102 @@
+import json
+import os
+
+import pytest
+import yaml
+
+from acquisition_journal import JOURNAL_FILE_NAME
+from headless_runner import RunSpec, main
+
+posix_only = pytest.mark.skipif(os.name != "posix", reason="the ProScan simulator needs a pseudo-terminal")
+
+
+def write_spec(tmp_path, **kwargs) -> str:
+    spec = dict(output=str(tmp_path / "run"), objective="x40", grids=[{"start": [1000, 2000], "matrix": [2, 3]}],
+                settle="time", settle_time=0., encoders=2, metadata={"slides": [0]})
+    spec.update(kwargs)
+    path = str(tmp_path / "spec.yaml")
+    with open(path, "w") as file:
+        yaml.safe_dump(spec, file)
+    return path
+
+
+def get_tiles(output: str) -> dict:
+    """
+    :return: modification time of each tile file.
+    """
+    folder = os.path.join(output, "grid_0")
+    return {name: os.stat(os.path.join(folder, name)).st_mtime_ns for name in os.listdir(folder)
+            if name.endswith(".png")}
+
+
+def read_journal(output: str) -> list:
+    with open(os.path.join(output, JOURNAL_FILE_NAME)) as file:
+        return [json.loads(line) for line in file]
+
+
+@posix_only
+@pytest.mark.parametrize("mode", ["stop", "fly"])
+def test_simulated_run_is_not_acquired_twice(tmp_path, mode):
+    spec = write_spec(tmp_path, mode=mode)
+    output = str(tmp_path / "run")
+    assert main([spec, "--simulate"]) == 0
+    tiles = get_tiles(output)
+    assert len(tiles) == 6
+    records = read_journal(output)
+    assert [record["type"] for record in records].count("tile") == 6
+    assert records[-1]["type"] == "end"
+    with open(os.path.join(output, "grid_0", "measured_positions.csv")) as file:
+        assert len(file.read().splitlines()) == 6
+
+    assert main([spec, "--simulate"]) == 0
+    assert get_tiles(output) == tiles
+    assert read_journal(output) == records
+
+
+@posix_only
+def test_simulated_run_resumes_the_missing_tiles(tmp_path):
+    spec = write_spec(tmp_path)
+    output = str(tmp_path / "run")
+    assert main([spec, "--simulate"]) == 0
+    tiles = get_tiles(output)
+
+    # crash after the fourth tile: the last two tiles and the end of the run are not journaled
+    records = read_journal(output)
+    tile_records = [record for record in records if record["type"] == "tile"]
+    lost = {record["file"] for record in tile_records[4:]}
+    with open(os.path.join(output, JOURNAL_FILE_NAME), "w") as file:
+        for record in records:
+            if record["type"] != "end" and record.get("file") not in lost:
+                file.write(json.dumps(record) + "\n")
+
+    assert main([spec, "--simulate"]) == 0
+    resumed = get_tiles(output)
+    assert resumed.keys() == tiles.keys()
+    assert {name for name in tiles if resumed[name] != tiles[name]} == lost
+    assert read_journal(output)[-1]["type"] == "end"
+
+
+@pytest.mark.parametrize("option", [{"mode": "zigzag"}, {"settle": "never"}, {"autofocus": {"policy": "laser"}},
+                                    {"camera": "webcam"}])
+def test_run_spec_rejects_unknown_values(tmp_path, option):
+    with pytest.raises(ValueError):
+        RunSpec(output=str(tmp_path), grids=[], **option)
+    with pytest.raises(ValueError):
+        RunSpec.from_file(write_spec(tmp_path, **option))
+
+
+def test_run_spec_rejects_unknown_keys(tmp_path):
+    with pytest.raises(ValueError):
+        RunSpec.from_file(write_spec(tmp_path, speed=100))
+
+
+def test_run_spec_grids(tmp_path):
+    spec = RunSpec.from_file(write_spec(tmp_path, overlap=[10, 10],
+                                        grids=[{"start": [0, 0], "matrix": [2, 3]},
+                                               {"start": [5000, 0], "size": [500, 400], "by_rows": True}]))
+    grids = spec.get_grids()
+    objective = spec.get_objective()
+    assert objective.overlap_percentage == pytest.approx((10, 10))
+    columns, rows = objective.get_matrix((500, 400))
+    assert [len(grid) for grid in grids] == [6, columns * rows]
+    assert grids[1][0].tolist() == [5000, 0]
@@ -0,0 +1,44 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("ids_peak")
+
+from camera.idscamwindow import IDSCamWindow  # noqa: E402
+
+
+@pytest.fixture
+def window():
+    # the frame handoff only, without opening a camera
+    window = IDSCamWindow.__new__(IDSCamWindow)
+    window._frame_condition = threading.Condition()
+    window._frame = None
+    window._frame_time = None
+    return window
+
+
+def deliver(window, frame, delay=0.):
+    def store():
+        time.sleep(delay)
+        with window._frame_condition:
+            window._frame = frame
+            window._frame_time = time.perf_counter()
+            window._frame_condition.notify_all()
+    threading.Thread(target=store, daemon=True).start()
+
+
+def test_get_frame_waits_for_a_frame_after_the_movement(window):
+    deliver(window, np.zeros((4, 4, 4), dtype=np.uint8))
+    old_frame = window.get_frame(timeout=1)
+    settle_time = time.perf_counter()
+    new_frame = np.ones((4, 4, 4), dtype=np.uint8)
+    deliver(window, new_frame, delay=0.05)
+    assert window.get_frame(newer_than=settle_time, timeout=1) is new_frame
+    assert old_frame is not new_frame
+
+
+def test_get_frame_times_out_without_camera(window):
+    with pytest.raises(TimeoutError):
+        window.get_frame(timeout=0.05)
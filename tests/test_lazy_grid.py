@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from grid.grid_movement import get_serpentine_grid
+from grid.lazy_grid import LazyGrid
+
+
+@pytest.mark.parametrize("by_rows", [False, True])
+def test_lazy_grid_matches_the_serpentine_grid(by_rows):
+    grid = get_serpentine_grid(start_pt=(100, 200), matrix=(7, 4), step=(30, 20), by_rows=by_rows)
+    lazy_grid = LazyGrid(origin=(100, 200), matrix=(7, 4), step=(30, 20), by_rows=by_rows)
+    assert len(lazy_grid) == len(grid) == 28
+    np.testing.assert_array_equal(lazy_grid.to_array(), grid)
+    np.testing.assert_array_equal(lazy_grid[-1], grid[-1])
+    np.testing.assert_array_equal(lazy_grid[3:9], grid[3:9])
+    assert lazy_grid.bounds == (100, 200, 280, 260)
+
+
+def test_fractional_pitch_does_not_accumulate():
+    lazy_grid = LazyGrid(origin=(0, 0), matrix=(1, 1000), step=(1, 105.59))
+    assert lazy_grid[999][1] == round(999 * 105.59)
@@ -0,0 +1,22 @@
+from main import PriorController
+from motion_stream import MotionStreamer
+
+
+def test_queue_full_reduces_the_depth_and_keeps_the_order(simulator):
+    simulator.queue_size = 2
+    prior = PriorController(port=simulator.port, baudrate=9600, timeout=0.1)
+    try:
+        engine = prior.start_engine()
+        waypoints = [(index * 100, (index % 2) * 100) for index in range(12)]
+        reached = []
+        streamer = MotionStreamer(engine, waypoints, depth=4,
+                                  on_waypoint_reached=lambda index, waypoint: reached.append(index))
+        streamer.start()
+        assert streamer.wait(timeout=30)
+        assert reached == list(range(12))
+        assert streamer.reached_count == 12
+        assert streamer.queue_full_count > 0
+        assert streamer.depth <= 2
+        assert engine.query("P").split(",")[:2] == ["1100", "100"]
+    finally:
+        prior.close()
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from grid.overview import OverviewScan, get_overview_positions
+from objectives import OBJECTIVES, ObjectiveProfile
+
+
+def test_objective_profile():
+    objective = ObjectiveProfile.from_overlap_percentage(name="test", pixel_scale=10., sensor_size=(2000, 1000),
+                                                         overlap_percentage=(10, 20))
+    assert objective.field_of_view == (200., 100.)
+    assert objective.pitch == pytest.approx((180., 80.))
+    with pytest.raises(ValueError):
+        ObjectiveProfile(name="test", pixel_scale=10., sensor_size=(2000, 1000), overlap=(200, 0))
+
+
+def test_overview_tiles_with_the_x4_profile():
+    objective = OBJECTIVES["x4"]
+    positions = get_overview_positions((0, 0, 10000, 5000), objective=objective)
+    assert objective.get_matrix((10000, 5000)) == (5, 3)
+    assert len(positions) == 15
+    np.testing.assert_allclose(positions[1] - positions[0], (0, objective.pitch[1]), atol=1)
+    # the frames are side by side and cover the whole area
+    assert np.all(positions.max(axis=0) + objective.field_of_view >= (10000, 5000))
+    assert OverviewScan(slide_indices=[0]).objective is objective
@@ -0,0 +1,37 @@
+from main import PriorController
+
+
+def test_controller_settings_always_written(simulator):
+    prior = PriorController(port=simulator.port, baudrate=9600, timeout=0.1)
+    try:
+        prior.speed = 30
+        # reset of the controller behind the back of the cache
+        simulator.speed = 50
+        prior.speed = 30
+        assert simulator.speed == 30
+    finally:
+        prior.close()
+
+
+def test_controller_moves_through_the_engine(simulator):
+    prior = PriorController(port=simulator.port, baudrate=9600, timeout=0.1)
+    try:
+        engine = prior.start_engine()
+        handle = prior.move_to(1000, -2000)
+        assert handle.wait(timeout=10) and handle.reached
+        assert engine.query("P").split(",")[:2] == ["1000", "-2000"]
+        assert prior.query("SMS") == str(simulator.speed)
+    finally:
+        prior.close()
+
+
+def test_controller_recovers_a_negotiated_baud_rate(simulator):
+    # a previous session crashed while the link was at 115200
+    simulator.link_baudrate = 115200
+    prior = PriorController(port=simulator.port, baudrate=9600, timeout=0.1)
+    try:
+        assert prior.baudrate == 9600
+        assert simulator.link_baudrate == 9600
+        assert prior.check_link()
+    finally:
+        prior.close()
@@ -0,0 +1,201 @@
+import threading
+import time
+
+import pytest
+
+from main import PriorController
+from prior_engine import PendingCommand, PriorIOEngine, ResponseRouter, get_mnemonic
+from prior_protocol import Ack, Limits, Position, Value
+
+
+def route_all(router, lines):
+    for line in lines:
+        router.route(line.encode())
+
+
+def test_router_answers_in_sending_order():
+    router = ResponseRouter()
+    commands = [PendingCommand(cmd) for cmd in ("SMS", "P", "SAS")]
+    for command in commands:
+        router.register(command)
+    route_all(router, ["50", "1,2,3", "20"])
+    assert [command.future.result(0) for command in commands] == ["50", "1,2,3", "20"]
+    assert len(router) == 0
+
+
+def test_router_types_the_answers_by_their_command():
+    router = ResponseRouter()
+    speed, position, limits = PendingCommand("SMS"), PendingCommand("P", typed=True), PendingCommand("LMT")
+    for command in (speed, position, limits):
+        router.register(command)
+    messages = [router.route(frame)[1] for frame in (b"0A", b"1,2,3", b"0A")]
+    assert [type(message) for message in messages] == [Value, Position, Limits]
+    assert speed.future.result(0) == "0A"
+    # the typed future gets the message itself, its coordinates are not parsed again
+    assert position.future.result(0) is messages[1]
+    assert position.future.result(0).coords == (1, 2, 3)
+
+
+def test_router_ready_resolves_the_movement_after_later_answers():
+    router = ResponseRouter()
+    motion, query = PendingCommand("G, 1, 2"), PendingCommand("P")
+    router.register(motion)
+    router.register(query)
+    # the position answers the query before the end of the movement (and accepts the movement)
+    router.route(b"1,2,0")
+    assert query.future.result(0) == "1,2,0"
+    assert not motion.future.done()
+    router.route(b"R")
+    assert motion.future.reached
+
+
+def test_router_error_refuses_a_movement_not_accepted_yet():
+    router = ResponseRouter()
+    motion = PendingCommand("G, 1, 2")
+    router.register(motion)
+    router.route(b"E,13")
+    assert motion.future.result(0) == "E,13"
+    assert not motion.future.reached
+
+
+def test_router_unsolicited_answers():
+    router = ResponseRouter()
+    unsolicited = []
+    router.unsolicited_callback = unsolicited.append
+    router.route(b"R")
+    assert unsolicited == ["R"]
+
+
+def test_router_expire_fails_late_commands():
+    router = ResponseRouter()
+    command = PendingCommand("SMS", timeout=0.5)
+    command.deadline = 10.
+    router.register(command)
+    assert router.expire(now=5.) == []
+    assert router.expire(now=11.) == [command]
+    assert isinstance(command.future.exception(0), TimeoutError)
+    # the late answer is dropped, the next command gets its own answer
+    following = PendingCommand("P")
+    router.register(following)
+    route_all(router, ["50", "1,2,3"])
+    assert following.future.result(0) == "1,2,3"
+    assert len(router) == 0
+
+
+def test_router_forgets_a_lost_answer():
+    router = ResponseRouter()
+    command = PendingCommand("SMS", timeout=0.5)
+    command.deadline = 10.
+    router.register(command)
+    assert router.expire(now=11.) == [command]
+    assert len(router) == 1
+    assert router.expire(now=11.6) == []
+    assert len(router) == 0
+
+
+def test_get_mnemonic():
+    assert get_mnemonic("G, 1, 2") == "G"
+    assert get_mnemonic("P") == "P"
+
+
+class SilentPort:
+    """
+    Serial port of a controller which never answers.
+    """
+    timeout = 0.05
+    in_waiting = 0
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        time.sleep(self.timeout)
+        return b""
+
+    def flush(self) -> None:
+        pass
+
+
+@pytest.fixture
+def silent_engine():
+    engine = PriorIOEngine(SilentPort(), answer_timeout=0.2, motion_timeout=0.3)
+    engine.start()
+    yield engine
+    engine.stop()
+
+
+def test_query_times_out(silent_engine):
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        silent_engine.query("SMS")
+    assert time.monotonic() - start < 2
+
+
+def test_motion_times_out(silent_engine):
+    handle = silent_engine.submit("G, 100, 200")
+    assert handle.wait(timeout=2)
+    assert not handle.reached
+    assert isinstance(handle.exception(), TimeoutError)
+
+
+def test_stop_resolves_every_submitted_command():
+    engine = PriorIOEngine(SilentPort())
+    engine.start()
+    futures = []
+
+    def submit():
+        for _ in range(5000):
+            futures.append(engine.submit("P"))
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    time.sleep(0.01)
+    engine.stop()
+    thread.join()
+    # the commands submitted after the stop are failed at once
+    assert all(future.done() for future in futures)
+
+
+def test_late_answer_does_not_shift_the_next_ones(simulator):
+    prior = PriorController(port=simulator.port, baudrate=9600, timeout=0.1)
+    try:
+        engine = prior.start_engine()
+        engine.answer_timeout = 0.3
+        simulator.latency = 0.5
+        with pytest.raises(TimeoutError):
+            engine.query("SERIAL")
+        simulator.latency = 0.
+        simulator.position = [100., 200., 0.]
+        assert engine.query("P") == "100,200,0"
+        assert engine.query("SMS") == str(simulator.speed)
+    finally:
+        prior.close()
+
+
+def test_positions_are_typed_through_the_engine(simulator):
+    prior = PriorController(port=simulator.port, baudrate=9600, timeout=0.1)
+    try:
+        engine = prior.start_engine()
+        simulator.position = [100., -200., 30.]
+        assert engine.get_position() == (100, -200, 30)
+        assert prior.get_position() == (100, -200, 30)
+        assert isinstance(engine.submit("SMS, 40", typed=True).result(), Ack)
+        positions = []
+        engine.start_position_polling(positions.append, period=0.01)
+        time.sleep(0.2)
+        engine.stop_position_polling()
+        assert positions and all(position == (100, -200, 30) for position in positions)
+    finally:
+        prior.close()
+
+
+def test_controller_without_engine_types_the_position(simulator):
+    prior = PriorController(port=simulator.port, baudrate=9600, timeout=0.1)
+    try:
+        simulator.position = [5., 6., 7.]
+        assert prior.get_position() == (5, 6, 7)
+        prior.enable_profiling()
+        assert prior.get_position() == (5, 6, 7)
+        assert prior.profiler.summary()["P"]["responses"] == {"position": 1}
+    finally:
+        prior.close()
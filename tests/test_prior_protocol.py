@@ -0,0 +1,36 @@
+from prior_protocol import Ack, Error, Limits, Position, Ready, ResponseFramer, Value, parse_frame
+
+
+def test_parse_frame_common_answers():
+    assert isinstance(parse_frame(b"R"), Ready)
+    assert isinstance(parse_frame(b"0"), Ack)
+    error = parse_frame(b"E,8")
+    assert isinstance(error, Error) and error.code == 8
+
+
+def test_parse_frame_depends_on_the_command():
+    # the same bytes are a position for "P" only, and a limit switch state for "LMT" only
+    position = parse_frame(b"100,-200,30", mnemonic="P")
+    assert isinstance(position, Position) and position.coords == (100, -200, 30)
+    assert isinstance(parse_frame(b"1,1", mnemonic="X"), Value)
+    assert isinstance(parse_frame(b"0A", mnemonic="SMS"), Value)
+    limits = parse_frame(b"0A", mnemonic="LMT")
+    assert isinstance(limits, Limits) and limits.bits == 0x0A
+    assert isinstance(parse_frame(b"0x", mnemonic="LMT"), Value)
+
+
+def test_framer_merged_and_fragmented_answers():
+    framer = ResponseFramer()
+    assert framer.feed(b"3\rR") == [Value(b"3")]
+    assert framer.pending_bytes == 1
+    assert framer.feed(b"\r 0 \r") == [Ready(b"R"), Ack(b"0")]
+    assert framer.feed(b"E,") == []
+    messages = framer.feed(b"4\r")
+    assert messages == [Error(b"E,4", 4)]
+    assert messages[0].first_byte_time <= messages[0].end_time
+    assert framer.pending_bytes == 0
+
+
+def test_framer_skips_blank_lines():
+    framer = ResponseFramer()
+    assert framer.feed(b"\r\n\x00\r0\r") == [Ack(b"0")]
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from grid.roi import MaskROI, PolygonROI, get_roi_matrix, get_tile_mask
+
+
+def test_mask_roi_intersection():
+    mask = np.zeros((10, 10), dtype=bool)
+    mask[2:4, 5:7] = True
+    roi = MaskROI(mask, origin=(1000, 0), pixel_size=10.)
+    assert roi.bounding_box == (1050, 20, 1070, 40)
+    hits = roi.intersects(np.array([1000., 1060., 1060.]), np.array([0., 30., 50.]), 15, 15)
+    assert hits.tolist() == [False, True, False]
+
+
+def test_mask_roi_edited_in_place():
+    mask = np.zeros((10, 10), dtype=bool)
+    roi = MaskROI(mask, pixel_size=10.)
+    key = roi.key
+    assert not roi.intersects(np.array([0.]), np.array([0.]), 100, 100)[0]
+    roi.mask[5, 5] = True
+    assert roi.key != key
+    assert roi.intersects(np.array([0.]), np.array([0.]), 100, 100)[0]
+
+
+def test_polygon_roi_tile_mask():
+    triangle = PolygonROI([(0, 0), (1000, 0), (0, 1000)])
+    tile_mask = get_tile_mask(triangle, origin=(0, 0), matrix=(4, 4), step=(250, 250), tile_size=(250, 250))
+    # the tiles below the diagonal only
+    assert tile_mask[0, 0] and tile_mask[3, 0] and tile_mask[0, 3]
+    assert not tile_mask[3, 3] and not tile_mask[2, 3]
+
+
+def test_empty_roi_is_rejected():
+    roi = MaskROI(np.zeros((5, 5), dtype=bool))
+    assert roi.bounding_box is None
+    with pytest.raises(ValueError):
+        get_roi_matrix(roi, step=(10, 10), tile_size=(10, 10))
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from grid.scan_order import SCAN_ORDERS, TOP_LEFT, BOTTOM_RIGHT, Hilbert, Serpentine
+
+
+@pytest.mark.parametrize("name", sorted(SCAN_ORDERS))
+def test_scan_orders_visit_every_tile_once(name):
+    indices = SCAN_ORDERS[name].get_indices((6, 5))
+    assert sorted(map(tuple, indices.tolist())) == [(column, row) for column in range(6) for row in range(5)]
+
+
+@pytest.mark.parametrize("matrix", [(8, 8), (6, 3), (12, 5), (1, 7), (16, 9)])
+def test_hilbert_steps_between_neighbours(matrix):
+    steps = np.abs(np.diff(Hilbert().get_indices(matrix), axis=0)).max(axis=1)
+    assert steps.max() == 1
+
+
+def test_hilbert_single_diagonal_step_at_most():
+    for columns in range(1, 25):
+        for rows in range(1, 25):
+            indices = Hilbert().get_indices((columns, rows))
+            assert len(indices) == columns * rows
+            steps = np.abs(np.diff(indices, axis=0))
+            assert np.all(steps <= 1)
+            assert np.count_nonzero(steps.sum(axis=1) == 2) <= 1
+
+
+def test_scan_order_entry_corner():
+    positions = Serpentine().get_positions(origin=(0, 0), matrix=(3, 3), step=(10, 10), corner=BOTTOM_RIGHT)
+    assert positions[0].tolist() == [20, 20]
+    positions = Serpentine().get_positions(origin=(0, 0), matrix=(3, 3), step=(10, 10), corner=TOP_LEFT)
+    assert positions[0].tolist() == [0, 0]
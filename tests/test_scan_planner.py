@@ -0,0 +1,19 @@
+import numpy as np
+
+from grid.scan_planner import ScanPlanner
+
+
+def test_planner_keeps_the_grid_indices():
+    planner = ScanPlanner()
+    plan = planner.plan(origins=[(10000, 0), (0, 0)], matrices=[(3, 3), (3, 3)], step=(100, 100),
+                        start_position=(0, 0), grid_indices=[1, 3])
+    # the nearest grid first, with its own index
+    assert [planned_grid.index for planned_grid in plan] == [3, 1]
+    assert all(len(planned_grid.positions) == 9 for planned_grid in plan)
+
+
+def test_planner_leaves_out_empty_grids():
+    tile_masks = [np.zeros((2, 2), dtype=bool), None]
+    plan = ScanPlanner().plan(origins=[(0, 0), (500, 0)], matrices=[(2, 2), (2, 2)], step=(100, 100),
+                              tile_masks=tile_masks)
+    assert [planned_grid.index for planned_grid in plan] == [1]
@@ -0,0 +1,52 @@
+import csv
+import json
+
+import pytest
+
+from serial_profiler import SerialProfiler, classify_response
+
+
+def record(profiler, mnemonic, terminator, response="0"):
+    profiler.record(mnemonic=mnemonic, queue=0.001, write=0.0001, first_byte=terminator / 2, terminator=terminator,
+                    response=response)
+
+
+def test_percentiles_of_synthetic_samples():
+    profiler = SerialProfiler()
+    for milliseconds in range(1, 101):
+        record(profiler, "P", milliseconds / 1000, response="1,2,3")
+    percentiles = profiler.percentiles("P")
+    assert percentiles["p50"] == pytest.approx(50, abs=1)
+    assert percentiles["p95"] == pytest.approx(95, abs=1)
+    assert percentiles["p99"] == pytest.approx(99, abs=1)
+    assert dict(profiler.histogram("P"))["<=50ms"] == 30
+    assert profiler.summary()["P"]["responses"] == {"position": 100}
+
+
+def test_unknown_command_is_not_reported(tmp_path):
+    profiler = SerialProfiler()
+    record(profiler, "G", 0.002, response="R")
+    assert profiler.percentiles("SMS") == {"p50": None, "p95": None, "p99": None}
+    assert sum(count for _, count in profiler.histogram("SMS")) == 0
+    assert profiler.mnemonics == ["G"]
+    profiler.to_json(str(tmp_path / "profile.json"))
+    with open(tmp_path / "profile.json") as json_file:
+        assert list(json.load(json_file)["commands"]) == ["G"]
+
+
+def test_csv_rows(tmp_path):
+    profiler = SerialProfiler()
+    record(profiler, "G", 0.002, response="R")
+    record(profiler, "P", 0.001, response="1,2,3")
+    record(profiler, "SMS", 0.001, response="E,4")
+    path = str(tmp_path / "profile.csv")
+    profiler.to_csv(path)
+    with open(path, newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [(row["command"], row["response"]) for row in rows] == [("G", "ready"), ("P", "position"), ("SMS", "error")]
+    assert float(rows[0]["terminator"]) == pytest.approx(0.002)
+
+
+def test_classify_response():
+    assert [classify_response(answer) for answer in ("", "R", "0", "E,8", "-1,2,3", "50", "ProScan")] == \
+        ["empty", "ready", "ack", "error", "position", "value", "text"]
@@ -0,0 +1,80 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from camera.settle_detection import SETTLE_THRESHOLDS, SettleDetector
+
+METHODS = sorted(SETTLE_THRESHOLDS)
+
+
+def get_texture(size: int = 700, seed: int = 0) -> np.ndarray:
+    noise = np.random.default_rng(seed).uniform(0, 255, (size, size)).astype(np.float32)
+    return cv2.GaussianBlur(noise, (0, 0), 4) * 4
+
+
+def get_frame(texture: np.ndarray, shift: int = 0) -> np.ndarray:
+    """
+    BGRA frame of the camera looking at the texture moved by shift pixels along x.
+    """
+    gray = np.clip(np.roll(texture, shift, axis=1) - texture.mean() + 128, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGRA)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_still_frames_release_after_the_stable_comparisons(method):
+    detector = SettleDetector(method=method, stable_frames=2)
+    texture = get_texture()
+    released = []
+    detector.arm(callback=released.append)
+    # frames received before the arming are ignored, the first one only sets the reference
+    detector.add_frame(get_frame(texture))
+    detector.add_frame(get_frame(texture))
+    assert detector.armed and released == []
+    detector.add_frame(get_frame(texture))
+    assert released == [True]
+    assert not detector.armed and not detector.timed_out
+    assert detector.wait(timeout=0)
+    assert detector.motion < detector.threshold
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_moving_frames_time_out(method):
+    detector = SettleDetector(method=method, timeout=0.1)
+    texture = get_texture()
+    detector.arm()
+    for shift in range(0, 80, 8):
+        detector.add_frame(get_frame(texture, shift))
+        assert detector.motion is None or detector.motion > detector.threshold
+    assert not detector.wait()
+    assert detector.timed_out and not detector.armed
+
+
+def test_timer_of_a_previous_arming_is_ignored():
+    detector = SettleDetector(timeout=10)
+    released = []
+    detector.arm(callback=lambda settled: released.append(("first", settled)))
+    first_generation = detector._generation
+    detector.arm(callback=lambda settled: released.append(("second", settled)))
+    # timer of the first arming firing while the second one waits
+    detector._release(False, first_generation)
+    assert detector.armed and released == []
+    texture = get_texture()
+    for _ in range(3):
+        detector.add_frame(get_frame(texture))
+    assert released == [("second", True)]
+    detector.disarm()
+
+
+def test_timeout_calls_back_from_the_timer():
+    detector = SettleDetector(timeout=0.05)
+    released = []
+    detector.arm(callback=released.append)
+    time.sleep(0.3)
+    assert released == [False] and detector.timed_out
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        SettleDetector(method="optical flow")